@@ -0,0 +1,141 @@
+"""
+# benchmark.py
+
+Measures the throughput and latency of the upload path (`Database` / `DatabaseSync` over `firebase_admin`)
+against the local Realtime Database stand-in in `Database/emulator.py`, by replaying a session log.
+
+Usage:
+    `python -m Database.benchmark [--log FILE] [--samples N] [--mode update_all|sync] [--emulator HOST:PORT]`
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import numpy as np
+
+from Logs.reader import read_arrays
+from Database.emulator import EmulatorServer
+from Database.sync import DatabaseSync
+from Database.mapping import CompiledMapping
+
+
+
+
+
+_RUNS = itertools.count()
+
+
+def _nest(flat: dict) -> dict:
+    tree = {}
+    for path, value in flat.items():
+        node = tree
+        *parents, leaf = path.split("/")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value
+    return tree
+
+
+def run(log: str, samples: int, mode: str, emulator_host: str = None, verbose: bool = True) -> dict:
+    """
+    Replay a session log through the upload path and time every call.
+
+    ## Parameters
+    - `log` : str
+        - Path to the session log to replay.
+    - `samples` : int
+        - Number of samples to upload (the log is repeated if it is shorter).
+    - `mode` : str
+        - `'update_all'` sends the nested tree of every sample with `Database.update_all`;
+          `'sync'` sends it through `DatabaseSync` (changed leaves only, no rate limit).
+    - `emulator_host` : str, optional
+        - `host:port` of an already running emulator. By default one is started in-process.
+    - `verbose` : bool, optional
+        - Whether to print the results.
+
+    ## Returns
+    - `results` : dict
+        - Throughput, latency percentiles (ms) and request counts.
+    """
+    server = None
+    if emulator_host is None:
+        server = EmulatorServer(port=0).start()
+        emulator_host = server.host
+    if "Database.db" not in sys.modules:
+        # point the module-level instance at the emulator while it is created, so it does not reach the real database
+        previous = os.environ.get("PI_OBD_DATABASE_EMULATOR")
+        os.environ["PI_OBD_DATABASE_EMULATOR"] = previous or emulator_host
+        try:
+            import Database.db
+        finally:
+            if previous is None:
+                del os.environ["PI_OBD_DATABASE_EMULATOR"]
+    from Database.db import Database
+    database = Database(emulator_host=emulator_host, name=f"benchmark-{os.getpid()}-{next(_RUNS)}")
+    try:
+        results = _replay(database, log, samples, mode)
+    finally:
+        database.close()
+        if server is not None:
+            server.stop()
+    if server is not None:
+        results["requests"] = dict(server.requests)
+
+    if verbose:
+        print(f">> {mode}: {samples} samples in {results['seconds']:.2f} s ({results['samples_per_second']:.0f} samples/s)")
+        print(f" > latency p50 {results['latency_ms_p50']:.2f} ms, p95 {results['latency_ms_p95']:.2f} ms, p99 {results['latency_ms_p99']:.2f} ms, max {results['latency_ms_max']:.2f} ms")
+        for key in ("leaves_sent", "leaves_suppressed", "requests"):
+            if key in results:
+                print(f" > {key}: {results[key]}")
+    return results
+
+
+def _replay(database, log: str, samples: int, mode: str) -> dict:
+    """
+    Upload the samples of a log to `database`, timing every call.
+    """
+    columns = read_arrays(log)
+    rows = len(columns["timestamp"])
+    mapping = CompiledMapping()
+    sync = DatabaseSync(database, max_rate=0) if mode == "sync" else None
+
+    latencies = np.empty(samples)
+    started = time.perf_counter()
+    for i in range(samples):
+        flat = mapping.sample_payload({name: float(values[i % rows]) for name, values in columns.items()})
+        t0 = time.perf_counter()
+        if sync is not None:
+            sync.update_all(flat)
+        else:
+            database.update_all(_nest(flat))
+        latencies[i] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - started
+
+    results = {
+        "mode": mode,
+        "samples": samples,
+        "seconds": elapsed,
+        "samples_per_second": samples / elapsed,
+        "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "latency_ms_p95": float(np.percentile(latencies, 95) * 1000),
+        "latency_ms_p99": float(np.percentile(latencies, 99) * 1000),
+        "latency_ms_max": float(latencies.max() * 1000),
+    }
+    if sync is not None:
+        results["leaves_sent"] = sync.leaves_sent
+        results["leaves_suppressed"] = sync.leaves_suppressed
+    return results
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the database upload path against the local emulator.")
+    parser.add_argument("--log", default="data/2023-05-19_10-48-17.txt", help="Session log to replay.")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--mode", choices=("update_all", "sync"), default="update_all")
+    parser.add_argument("--emulator", default=None, help="host:port of a running emulator (default is to start one).")
+    args = parser.parse_args()
+    run(args.log, args.samples, args.mode, args.emulator)
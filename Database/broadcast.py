@@ -0,0 +1,414 @@
+"""
+# broadcast.py
+
+Defines the Broadcaster class, a local WebSocket server that streams live samples to any number of screens on the
+shop network, without the round trip through Firebase.
+
+Each sample handed to `publish()` is compared with the previous one and only the channels that changed are sent, as
+a compact binary frame. Every client has its own rate limit: changes that arrive faster than a client is allowed to
+receive them (or faster than its connection drains) are merged into one pending frame, so a slow client only ever
+misses intermediate values and always catches up to the latest ones. The acquisition loop never waits on a client.
+
+The WebSocket protocol (RFC 6455) is implemented directly on `asyncio` streams, so there are no extra dependencies.
+
+Protocol, server to client:
+- On connect, a text frame with the schema: `{"type": "schema", "channels": [{"name", "unit"}, ...]}`, followed by
+  a binary keyframe with every known value.
+- Then binary delta frames: header `<BdH` (frame type `1` for a keyframe or `2` for a delta, timestamp in seconds
+  since the epoch, number of entries), followed by one `<Hf` entry per changed channel (index into the schema, value).
+
+Usage:
+    `python -m Database.broadcast [--log FILE] [--host HOST] [--port PORT] [--rate HZ]`
+"""
+
+import json
+import time
+import math
+import base64
+import struct
+import asyncio
+import hashlib
+import argparse
+import threading
+
+from OBDModule.channels import CHANNELS
+
+
+
+
+
+KEYFRAME = 1
+DELTA = 2
+
+_HEADER = struct.Struct("<BdH")
+_ENTRY = struct.Struct("<Hf")
+_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+MAX_CLIENT_PAYLOAD = 1 << 16
+"""
+Largest frame accepted from a client, in bytes (clients only send pings and closes, at most 125 bytes each).
+Larger frames close the connection with status 1009 (message too big).
+"""
+
+
+
+
+def encode_frame(kind: int, timestamp: float, entries: dict[int, float]) -> bytes:
+    """
+    Encode a keyframe or delta frame.
+
+    ## Parameters
+    - `kind` : int
+        - `KEYFRAME` or `DELTA`.
+    - `timestamp` : float
+        - Time of the sample, in seconds since the epoch.
+    - `entries` : dict[int, float]
+        - Values keyed by channel index.
+
+    ## Returns
+    - `frame` : bytes
+        - The encoded frame.
+    """
+    parts = [_HEADER.pack(kind, timestamp, len(entries))]
+    parts.extend(_ENTRY.pack(index, value) for index, value in entries.items())
+    return b"".join(parts)
+
+
+def decode_frame(frame: bytes) -> tuple[int, float, dict[int, float]]:
+    """
+    Decode a frame made by `encode_frame`.
+
+    ## Returns
+    - `frame` : tuple[int, float, dict[int, float]]
+        - The frame type, the timestamp, and the values keyed by channel index.
+    """
+    kind, timestamp, count = _HEADER.unpack_from(frame)
+    entries = dict(_ENTRY.iter_unpack(frame[_HEADER.size:_HEADER.size + count * _ENTRY.size]))
+    return kind, timestamp, entries
+
+
+def _websocket_frame(opcode: int, payload: bytes) -> bytes:
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _changed(old: float, new: float) -> bool:
+    if old is None:
+        return True
+    if math.isnan(new):
+        return not math.isnan(old)
+    return old != new
+
+
+
+
+class _Client:
+    """
+    One connected screen: its pending (merged) changes and its rate limit.
+    """
+    def __init__(self, writer: asyncio.StreamWriter, interval: float):
+        self.writer = writer
+        self.interval = interval
+        self.pending = {}
+        self.timestamp = 0.0
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.merged = 0
+
+    def queue(self, timestamp: float, changes: dict[int, float]) -> None:
+        if self.pending:
+            self.merged += 1
+        self.pending.update(changes)
+        self.timestamp = timestamp
+        self.ready.set()
+
+
+
+
+class Broadcaster:
+    """
+    WebSocket server that fans live samples out to every connected client as binary delta frames.
+    """
+    def __init__(self, host: str = "0.0.0.0", port: int = 8765, channels: list[str] = None, max_rate: float = 10.0):
+        """
+        ## Parameters
+        - `host` : str, optional
+            - Interface to listen on (default is every interface).
+        - `port` : int, optional
+            - Port to listen on (default is `8765`, `0` picks a free port).
+        - `channels` : list[str], optional
+            - Names of the channels to broadcast (default is every logged channel).
+        - `max_rate` : float, optional
+            - Default maximum number of frames per second sent to a client (default is `10.0`).
+              A client may ask for a lower rate with the query string, e.g. `ws://pi:8765/?rate=2`; rates that are
+              not finite and above 0 are ignored.
+        """
+        self._host = host
+        self._port = port
+        self._max_rate = max_rate
+        names = list(channels) if channels is not None else [entry.name for entry in CHANNELS]
+        units = {entry.name: entry.unit for entry in CHANNELS}
+        self._names = names
+        self._index = {name: i for i, name in enumerate(names)}
+        self._schema = json.dumps({"type": "schema", "channels": [{"name": name, "unit": units.get(name, "")} for name in names]})
+
+        self._lock = threading.Lock()
+        self._state = [None] * len(names)
+        self._timestamp = 0.0
+        self._clients = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+        self.published = 0
+        self.frames_sent = 0
+
+
+    @property
+    def address(self) -> str:
+        """
+        `host:port` the server listens on (only known once started).
+        """
+        return f"{self._host}:{self._port}"
+
+    @property
+    def clients(self) -> int:
+        """
+        Number of connected clients.
+        """
+        return len(self._clients)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters of the server: `clients`, `published`, `frames_sent`, and per-client `sent` / `merged` frame counts.
+        """
+        return {
+            "clients": self.clients,
+            "published": self.published,
+            "frames_sent": self.frames_sent,
+            "per_client": [{"sent": client.sent, "merged": client.merged} for client in list(self._clients)],
+        }
+
+
+    def publish(self, sample: dict) -> int:
+        """
+        Broadcast a sample. Only channels whose value changed since the previous sample are sent.
+        Safe to call from any thread; never blocks on the network.
+
+        ## Parameters
+        - `sample` : dict
+            - A sample as returned by `Sonata.sample()` / `SonataAsync.sample()`. Unknown keys are ignored.
+
+        ## Returns
+        - `changed` : int
+            - The number of channels that changed.
+        """
+        changes = {}
+        with self._lock:
+            for name, value in sample.items():
+                index = self._index.get(name)
+                if index is None or value is None:
+                    continue
+                value = float(value)
+                if _changed(self._state[index], value):
+                    self._state[index] = value
+                    changes[index] = value
+            self._timestamp = float(sample.get("timestamp", time.time()))
+            self.published += 1
+        if changes and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._fan_out, self._timestamp, changes)
+        return len(changes)
+
+    def _fan_out(self, timestamp: float, changes: dict[int, float]) -> None:
+        for client in self._clients:
+            client.queue(timestamp, changes)
+
+    def _keyframe(self) -> bytes:
+        with self._lock:
+            entries = {i: value for i, value in enumerate(self._state) if value is not None}
+            return encode_frame(KEYFRAME, self._timestamp, entries)
+
+
+    async def _handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> float:
+        """
+        Performs the WebSocket opening handshake. Returns the client's rate limit, or `None` if the request was refused.
+        """
+        request = await reader.readuntil(b"\r\n\r\n")
+        lines = request.decode("latin-1").split("\r\n")
+        target = lines[0].split(" ")[1] if len(lines[0].split(" ")) > 1 else "/"
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if key is None or "websocket" not in headers.get("upgrade", "").lower():
+            writer.write(b"HTTP/1.1 426 Upgrade Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return None
+        accept = base64.b64encode(hashlib.sha1(key.encode("ascii") + _GUID).digest()).decode("ascii")
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode("ascii"))
+
+        rate = self._max_rate
+        if "?" in target:
+            for pair in target.split("?", 1)[1].split("&"):
+                name, _, value = pair.partition("=")
+                if name == "rate":
+                    try: requested = float(value)
+                    except ValueError: continue
+                    if math.isfinite(requested) and requested > 0:    # 0, negative or nan would lift the cap
+                        rate = min(rate, requested)
+        return rate
+
+    async def _receive(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Reads (and discards) client frames, answering pings and closes. Returns when the client goes away.
+        """
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode, length = first & 0x0F, second & 0x7F
+            if length == 126:
+                length, = struct.unpack("!H", await reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack("!Q", await reader.readexactly(8))
+            if length > MAX_CLIENT_PAYLOAD:
+                writer.write(_websocket_frame(0x8, struct.pack("!H", 1009)))
+                await writer.drain()
+                return
+            mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(await reader.readexactly(length)))
+            if opcode == 0x8:
+                writer.write(_websocket_frame(0x8, payload[:2]))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(_websocket_frame(0xA, payload))
+
+    async def _send(self, client: _Client) -> None:
+        """
+        Sends the client's pending changes, at most once per its interval, as one merged delta frame each time.
+        """
+        while True:
+            await client.ready.wait()
+            client.ready.clear()
+            if not client.pending:
+                continue
+            frame = encode_frame(DELTA, client.timestamp, client.pending)
+            client.pending = {}
+            client.writer.write(_websocket_frame(0x2, frame))
+            await client.writer.drain()
+            client.sent += 1
+            self.frames_sent += 1
+            if client.interval > 0:
+                await asyncio.sleep(client.interval)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = None
+        sender = receiver = None
+        try:
+            rate = await self._handshake(reader, writer)
+            if rate is None:
+                return
+            client = _Client(writer, 1 / rate if rate > 0 else 0)
+            # snapshot and register without yielding to the loop in between: every change fanned out from now on
+            # reaches the client's pending frame, so nothing published during the first drain is lost
+            keyframe = self._keyframe()
+            self._clients.add(client)
+            writer.write(_websocket_frame(0x1, self._schema.encode("utf-8")))
+            writer.write(_websocket_frame(0x2, keyframe))
+            await writer.drain()
+            sender = asyncio.ensure_future(self._send(client))
+            receiver = asyncio.ensure_future(self._receive(reader, writer))
+            await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError):
+            pass
+        except asyncio.CancelledError:
+            pass                        # the server is stopping
+        finally:
+            if client is not None:
+                self._clients.discard(client)
+            for task in (sender, receiver):
+                if task is not None:
+                    task.cancel()
+            writer.close()
+
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self._host, self._port))
+        self._port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    def start(self) -> "Broadcaster":
+        """
+        Start serving on a background thread.
+        """
+        if self._thread is None:
+            self._loop = asyncio.new_event_loop()
+            self._started.clear()
+            self._thread = threading.Thread(target=self._run, name="broadcaster", daemon=True)
+            self._thread.start()
+            self._started.wait()
+        return self
+
+    def stop(self) -> None:
+        """
+        Disconnect every client and stop serving.
+        """
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+            self._loop = None
+            self._clients.clear()
+
+
+
+
+if __name__ == "__main__":
+    from Logs.reader import read_arrays, session_start
+
+    parser = argparse.ArgumentParser(description="Broadcast a session log (replayed in real time) to WebSocket clients.")
+    parser.add_argument("--log", default="data/2023-05-19_10-48-17.txt", help="Session log to replay.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=float, default=10.0, help="Maximum frames per second per client.")
+    args = parser.parse_args()
+
+    columns = read_arrays(args.log)
+    start = session_start(args.log).timestamp()
+    broadcaster = Broadcaster(args.host, args.port, max_rate=args.rate).start()
+    print(f">> Broadcasting {args.log} on ws://{broadcaster.address}/")
+    try:
+        previous = None
+        for i, offset in enumerate(columns["timestamp"]):
+            if previous is not None:
+                time.sleep(max(0.0, offset - previous))
+            previous = offset
+            sample = {name: values[i] for name, values in columns.items()}
+            sample["timestamp"] = start + offset
+            broadcaster.publish(sample)
+    except KeyboardInterrupt:
+        pass
+    broadcaster.stop()
@@ -0,0 +1,172 @@
+"""
+# cache.py
+
+Defines the CachedDatabase class, a read-through cache in front of `Database` that a streaming listener keeps current.
+
+`Database.get_node` / `get_all` download the node on every call. `CachedDatabase` instead opens one listener on the
+cached node (`Database.listen`, i.e. server-sent events), keeps a local copy of it up to date from the `put` / `patch`
+events, and answers reads from memory without any HTTP request. Subscribers can register callbacks that are invoked
+with every changed path below (or above) the path they watch.
+"""
+
+import copy
+import threading
+
+from Database.tree import Tree
+
+
+
+
+
+def _segments(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+def _join(*paths: str) -> str:
+    return "/".join(segment for path in paths for segment in _segments(path))
+
+
+
+
+class CachedDatabase:
+    """
+    Read-through, listener-backed cache of a node of the database.
+    """
+    def __init__(self, database, node: str = "/"):
+        """
+        ## Parameters
+        - `database` : Database
+            - The database to cache (anything with `get_node(node)` and `listen(node, callback)` methods).
+        - `node` : str, optional
+            - The node to cache (default is the entire database). Reads outside it go to the database.
+        """
+        self._database = database
+        self._node = _join(node)
+        self._tree = Tree()
+        self._ready = threading.Event()
+        self._registration = None
+        self._stream = None
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._next_token = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+        self.callback_errors = 0
+
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether the initial value of the node has arrived (reads are served from memory only once it has).
+        """
+        return self._ready.is_set()
+
+
+    def start(self, timeout: float = 10.0) -> "CachedDatabase":
+        """
+        Start listening, and wait for the initial value of the node.
+
+        ## Parameters
+        - `timeout` : float, optional
+            - Seconds to wait for the initial value (default is `10.0`). Reads fall through to the database until it arrives.
+        """
+        if self._registration is None:
+            stream = self._stream = object()
+            self._registration = self._database.listen(self._node or "/", lambda event: self._on_event(event, stream))
+        self._ready.wait(timeout)
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop listening. Reads go to the database again.
+
+        The listener is closed on a daemon thread: firebase_admin only notices the close once its server-sent events
+        stream yields again (up to about 30 seconds on a quiet node). Events it still delivers are ignored.
+        """
+        registration, self._registration, self._stream = self._registration, None, None
+        if registration is not None:
+            threading.Thread(target=registration.close, name="cache-listener-close", daemon=True).start()
+        self._ready.clear()
+
+    def _on_event(self, event, stream) -> None:
+        if stream is not self._stream:
+            return
+        relative = _segments(event.path)
+        if event.event_type == "put":
+            self._tree.set(_join(self._node, event.path), event.data)
+            changes = [(_join(self._node, event.path), event.data)]
+        elif event.event_type == "patch":
+            self._tree.update(_join(self._node, event.path), event.data)
+            changes = [(_join(self._node, event.path, key), value) for key, value in event.data.items()]
+        else:
+            return
+        self.events += 1
+        if not relative and event.event_type == "put":
+            self._ready.set()
+        self._notify(changes)
+
+
+    def _cached(self, node: str) -> bool:
+        segments = _segments(self._node)
+        return self._ready.is_set() and _segments(node)[:len(segments)] == segments
+
+    def get_node(self, node: str):
+        """
+        Get the data from a node, from memory if it lies in the cached node (same as `Database.get_node`).
+        The returned data is a copy, which the listener thread does not modify.
+        """
+        if self._cached(node):
+            self.hits += 1
+            with self._tree.lock:
+                return copy.deepcopy(self._tree.get(node))
+        self.misses += 1
+        return self._database.get_node(node)
+
+    def get_all(self):
+        """
+        Get the data from the entire database, from memory if the whole database is cached (same as `Database.get_all`).
+        """
+        return self.get_node("/")
+
+
+    def subscribe(self, path: str, callback) -> int:
+        """
+        Register a callback for the changes of a path.
+
+        ## Parameters
+        - `path` : str
+            - The watched path (e.g. `'engine_load'`; `'/'` for everything cached).
+        - `callback` : Callable[[str, Any], None]
+            - Called on the listener thread with the changed path and its new value (`None` if deleted), for every
+              change at, below or above `path`. Exceptions it raises are counted in `callback_errors` and ignored.
+
+        ## Returns
+        - `token` : int
+            - The subscription's token, for `unsubscribe`.
+        """
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = (_segments(path), callback)
+        return token
+
+    def unsubscribe(self, token: int) -> None:
+        """
+        Remove a subscription made with `subscribe`.
+        """
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    def _notify(self, changes: list[tuple[str, object]]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for segments, callback in subscribers:
+            for path, value in changes:
+                changed = _segments(path)
+                if changed[:len(segments)] == segments or segments[:len(changed)] == changed:
+                    try:
+                        callback(path, value)
+                    except Exception:
+                        self.callback_errors += 1
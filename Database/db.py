@@ -4,6 +4,7 @@
 
 """
 
+import os
 import firebase_admin
 from firebase_admin import db
 
@@ -15,11 +16,30 @@ from firebase_admin import db
 
 
 class Database:
-    def __init__(self):
-        self._url = "https://pi-obd-default-rtdb.firebaseio.com/"
+    def __init__(self, url: str = "https://pi-obd-default-rtdb.firebaseio.com/", emulator_host: str = None, name: str = None):
+        """
+        Connect to the Realtime Database and initialize it with the structure below.
+
+        ## Parameters
+        - `url` : str, optional
+            - URL of the Realtime Database.
+        - `emulator_host` : str, optional
+            - `host:port` of a local stand-in (see `Database/emulator.py`) to use instead of `url`.
+              Defaults to the `PI_OBD_DATABASE_EMULATOR` environment variable, if set.
+        - `name` : str, optional
+            - Name of the `firebase_admin` app to create (default is the default app). Each `Database` needs its own
+              app, so further instances (e.g. one per benchmark run) must be given a unique name.
+        """
+        emulator_host = emulator_host or os.environ.get("PI_OBD_DATABASE_EMULATOR")
+        if emulator_host:
+            url = f"http://{emulator_host}/?ns=pi-obd"     # an http URL puts only this app in emulator mode
+        self._url = url
         self._credentials = firebase_admin.credentials.Certificate("Database/service_account_key.json")
-        self._firebase_admin = firebase_admin.initialize_app(self._credentials, {'databaseURL': self._url})
-        self._ref = db.reference("/")
+        if name is None:
+            self._firebase_admin = firebase_admin.initialize_app(self._credentials, {'databaseURL': self._url})
+        else:
+            self._firebase_admin = firebase_admin.initialize_app(self._credentials, {'databaseURL': self._url}, name=name)
+        self._ref = db.reference("/", app=self._firebase_admin)
         # self._ref_root = db.reference("/")
         self._structure = {
             'accelerator': {
@@ -154,6 +174,16 @@ class Database:
         """
         self._ref.update(data)
 
+    def update_paths(self, data: dict):
+        """
+        Update several leaves of the database at once, in a single multi-path update.
+
+        ## Parameters
+        - `data` : dict
+            - Flat mapping of slash-separated paths (e.g. `'engine_load/absolute'`) to their new values.
+        """
+        self._ref.update(data)
+
     def get_node(self, node: str):
         """
         Get the data from a node in the database.
@@ -167,6 +197,24 @@ class Database:
             - The data from the given node.
         """
         return self._ref.child(node).get()
+
+    def get_range(self, node: str, start_key: str, end_key: str):
+        """
+        Get the children of a node whose keys lie in the given range (inclusive), ordered by key.
+
+        ## Parameters
+        - `node` : str
+            - The node whose children to get.
+        - `start_key` : str
+            - The first key to include.
+        - `end_key` : str
+            - The last key to include.
+
+        ## Returns
+        - `data` : dict
+            - The matching children, keyed by key (empty if there are none).
+        """
+        return self._ref.child(node).order_by_key().start_at(start_key).end_at(end_key).get() or {}
     
     def get_all(self):
         """
@@ -178,6 +226,28 @@ class Database:
         """
         return self._ref.get()
 
+    def listen(self, node: str, callback):
+        """
+        Stream the changes of a node, on a background thread.
+
+        ## Parameters
+        - `node` : str
+            - The node to listen to (`'/'` for the entire database).
+        - `callback` : Callable[[firebase_admin.db.Event], None]
+            - Called with the node's current value first (a `put` at `'/'`), then with every `put` / `patch` below it.
+
+        ## Returns
+        - `registration` : firebase_admin.db.ListenerRegistration
+            - Handle whose `close()` stops listening.
+        """
+        return self._ref.child(node).listen(callback) if node.strip("/") else self._ref.listen(callback)
+
+    def close(self):
+        """
+        Delete the `firebase_admin` app of this database, closing its connections. The instance cannot be used afterwards.
+        """
+        firebase_admin.delete_app(self._firebase_admin)
+
 
 
 
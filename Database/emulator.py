@@ -0,0 +1,303 @@
+"""
+# emulator.py
+
+A local stand-in for the Firebase Realtime Database, for offline testing and load benchmarks.
+
+It implements the subset of the Realtime Database REST API that `firebase_admin.db` uses, all on `/<path>.json`:
+`GET` (with `shallow`, ETags and `orderBy="$key"` range queries), `PUT` (set, including `if-match` conditional
+sets), `PATCH` (update and multi-path update), `POST` (push) and `DELETE`, plus streaming (`Reference.listen()`,
+server-sent `put` / `patch` events). Data is kept in memory and can optionally be persisted to a JSON file.
+
+`Database` is pointed at it by passing `emulator_host='localhost:9000'`, or by setting the
+`PI_OBD_DATABASE_EMULATOR` environment variable (see `Database/db.py`).
+
+Usage:
+    `python -m Database.emulator [--host HOST] [--port PORT] [--persist FILE]`
+"""
+
+import os
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Database.tree import Tree
+
+
+
+
+
+_KEEP_ALIVE = 30.0
+
+
+
+
+def _segments(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+def _key_range(value: dict, query: dict) -> dict:
+    """
+    Apply `startAt` / `endAt` / `limitToFirst` / `limitToLast` of an `orderBy="$key"` query.
+    """
+    keys = sorted(value)
+    if "startAt" in query:
+        keys = [key for key in keys if key >= json.loads(query["startAt"])]
+    if "endAt" in query:
+        keys = [key for key in keys if key <= json.loads(query["endAt"])]
+    if "limitToFirst" in query:
+        keys = keys[:int(query["limitToFirst"])]
+    if "limitToLast" in query:
+        keys = keys[-int(query["limitToLast"]):]
+    return {key: value[key] for key in keys}
+
+
+def _etag(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "EmulatorServer"
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _parse(self) -> tuple[str, dict]:
+        url = urlsplit(self.path)
+        path = url.path
+        if path.endswith(".json"):
+            path = path[:-len(".json")]
+        return path, {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else None
+
+    def _reply(self, status: int, value=None, silent: bool = False, etag: str = None) -> None:
+        payload = b"" if silent else json.dumps(value, separators=(",", ":")).encode()
+        self.send_response(204 if silent and status == 200 else status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if payload:
+            self.wfile.write(payload)
+
+    def _stream(self, path: str) -> None:
+        """
+        Serve server-sent events for `path`: the current value first, then every change below or above it.
+        """
+        self.server.count("listen")
+        with self.server.tree.lock:
+            events = self.server.listen(path)
+            initial = self.server.tree.snapshot(path)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self._event("put", {"path": "/", "data": initial})
+            while not self.server.closing:
+                try:
+                    kind, data = events.get(timeout=1.0)
+                except queue.Empty:
+                    if time.monotonic() - self._last_event > _KEEP_ALIVE:
+                        self._event("keep-alive", None)
+                    continue
+                self._event(kind, data)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.unlisten(events)
+
+    def _event(self, kind: str, data) -> None:
+        self.wfile.write(f"event: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode())
+        self.wfile.flush()
+        self._last_event = time.monotonic()
+
+    def do_GET(self) -> None:
+        path, query = self._parse()
+        if "text/event-stream" in self.headers.get("Accept", ""):
+            self._stream(path)
+            return
+        self.server.count("get")
+        value = self.server.tree.snapshot(path)     # a copy, as concurrent writes would change it while it is serialized
+        if query.get("orderBy") == '"$key"' and isinstance(value, dict):
+            value = _key_range(value, query)
+        if query.get("shallow") == "true" and isinstance(value, dict):
+            value = {key: (True if isinstance(child, dict) else child) for key, child in value.items()}
+        etag = _etag(value) if self.headers.get("X-Firebase-ETag") == "true" else None
+        self._reply(200, value, etag=etag)
+
+    def do_PUT(self) -> None:
+        path, query = self._parse()
+        self.server.count("set")
+        value = self._body()
+        expected = self.headers.get("if-match")
+        with self.server.tree.lock:
+            if expected is not None:
+                current = self.server.tree.get(path)
+                if _etag(current) != expected:
+                    self._reply(412, current, etag=_etag(current))
+                    return
+            self.server.tree.set(path, value)
+            self.server.notify("put", path, value)
+        etag = _etag(value) if expected is not None or self.headers.get("X-Firebase-ETag") == "true" else None
+        self._reply(200, value, silent=query.get("print") == "silent", etag=etag)
+
+    def do_PATCH(self) -> None:
+        path, query = self._parse()
+        self.server.count("update")
+        values = self._body()
+        if not isinstance(values, dict):
+            self._reply(400, {"error": "Invalid data; couldn't parse JSON object."})
+            return
+        with self.server.tree.lock:
+            self.server.tree.update(path, values)
+            self.server.notify("patch", path, values)
+        self._reply(200, values, silent=query.get("print") == "silent")
+
+    def do_POST(self) -> None:
+        path, query = self._parse()
+        self.server.count("push")
+        value = self._body()
+        with self.server.tree.lock:
+            key = self.server.tree.push(path, value)
+            self.server.notify("put", f"{path}/{key}", value)
+        self._reply(200, {"name": key}, silent=query.get("print") == "silent")
+
+    def do_DELETE(self) -> None:
+        path, query = self._parse()
+        self.server.count("delete")
+        with self.server.tree.lock:
+            self.server.tree.set(path, None)
+            self.server.notify("put", path, None)
+        self._reply(200, None, silent=query.get("print") == "silent")
+
+
+
+
+class EmulatorServer(ThreadingHTTPServer):
+    """
+    HTTP server serving a `Tree` over the Realtime Database REST API.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "localhost", port: int = 9000, persist: str = None, verbose: bool = False):
+        """
+        ## Parameters
+        - `host` : str, optional
+            - Interface to listen on (default is `'localhost'`).
+        - `port` : int, optional
+            - Port to listen on (default is `9000`; `0` picks a free port).
+        - `persist` : str, optional
+            - JSON file to load the tree from on start and save it to on shutdown.
+        - `verbose` : bool, optional
+            - Whether to log every request.
+        """
+        super().__init__((host, port), _Handler)
+        self.persist = persist
+        self.verbose = verbose
+        data = None
+        if persist and os.path.exists(persist):
+            with open(persist, "r") as file:
+                data = json.load(file)
+        self.tree = Tree(data)
+        self.requests = {}
+        self.closing = False
+        self._counter_lock = threading.Lock()
+        self._listeners = {}
+        self._thread = None
+
+    @property
+    def host(self) -> str:
+        """
+        `host:port` of the server, as expected by `Database(emulator_host=...)`.
+        """
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def count(self, method: str) -> None:
+        with self._counter_lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def listen(self, path: str) -> queue.Queue:
+        """
+        Register a listener on `path`. Returns the queue its `(event type, data)` events are put in.
+        """
+        events = queue.Queue()
+        with self._counter_lock:
+            self._listeners[events] = _segments(path)
+        return events
+
+    def unlisten(self, events: queue.Queue) -> None:
+        with self._counter_lock:
+            self._listeners.pop(events, None)
+
+    def notify(self, kind: str, path: str, data) -> None:
+        """
+        Send a `put` or `patch` of `data` at `path` to every listener it concerns (call with the tree lock held).
+        """
+        changed = _segments(path)
+        with self._counter_lock:
+            listeners = list(self._listeners.items())
+        for events, segments in listeners:
+            if changed[:len(segments)] == segments:
+                relative = "/" + "/".join(changed[len(segments):])
+                events.put((kind, {"path": relative, "data": data}))
+            elif segments[:len(changed)] == changed:
+                events.put(("put", {"path": "/", "data": self.tree.snapshot("/".join(segments))}))
+
+    def start(self) -> "EmulatorServer":
+        """
+        Serve requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="database-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving, and save the tree if `persist` was given.
+        """
+        self.closing = True
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+        if self.persist:
+            with open(self.persist + ".tmp", "w") as file:
+                json.dump(self.tree.snapshot(), file)
+            os.replace(self.persist + ".tmp", self.persist)
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Firebase Realtime Database REST API.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--persist", default=None, help="JSON file to load from and save to.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = EmulatorServer(args.host, args.port, persist=args.persist, verbose=args.verbose)
+    print(f">> Realtime Database emulator listening on http://{server.host} (set PI_OBD_DATABASE_EMULATOR={server.host})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
@@ -0,0 +1,196 @@
+"""
+# history.py
+
+Append-only history of samples in the database, stored as compact time-keyed chunks.
+
+`Database` itself only keeps the latest value of every leaf. `HistoryWriter` instead groups samples into chunks
+(10 s by default) and writes each chunk once, under `history/<vehicle>/<YYYY-MM-DD>/<first sample time in ms>`.
+A chunk is columnar: the sample times as millisecond offsets and one array per channel, each packed as base64
+(`uint32` offsets, `float32` values, so `nan` survives the trip through JSON). `HistoryReader` fetches the chunks
+overlapping a time range with key-range queries and reassembles them into arrays.
+"""
+
+import base64
+import numpy as np
+from datetime import datetime, timedelta, timezone
+
+from OBDModule.channels import CHANNELS
+
+
+
+
+
+def _pack(array: np.ndarray, dtype: str) -> str:
+    return base64.b64encode(np.ascontiguousarray(array, dtype=dtype).tobytes()).decode("ascii")
+
+
+def _unpack(text: str, dtype: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+
+def _day(t: float) -> str:
+    return datetime.fromtimestamp(t, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _key(t: float) -> str:
+    return f"{int(round(t * 1000)):013d}"
+
+
+
+
+class HistoryWriter:
+    """
+    Buffers samples and writes them to the database one chunk at a time.
+    """
+    def __init__(self, target, vehicle: str, chunk_seconds: float = 10.0, channels: list[str] = None, root: str = "history"):
+        """
+        ## Parameters
+        - `target` : Database or OfflineQueue
+            - Where chunks are written (anything with an `update_paths(dict)` method).
+        - `vehicle` : str
+            - Name of the vehicle, used in the chunk paths.
+        - `chunk_seconds` : float, optional
+            - Length of a chunk, in seconds (default is `10.0`).
+        - `channels` : list[str], optional
+            - Names of the channels to keep (default is every logged channel).
+        - `root` : str, optional
+            - Node under which the history is stored (default is `'history'`).
+        """
+        self._target = target
+        self._vehicle = vehicle
+        self._chunk_seconds = chunk_seconds
+        self._channels = list(channels) if channels is not None else [entry.name for entry in CHANNELS]
+        self._root = root.strip("/")
+        self._times = []
+        self._values = []
+        self._window = None
+        self.chunks_written = 0
+
+    @property
+    def node(self) -> str:
+        """
+        Path of the node holding this vehicle's history.
+        """
+        return f"{self._root}/{self._vehicle}"
+
+
+    def append(self, sample: dict) -> None:
+        """
+        Add one sample. Writes the previous chunk once the sample falls into a new chunk window.
+
+        ## Parameters
+        - `sample` : dict
+            - A sample as returned by `Sonata.sample()` (`timestamp` in seconds since the epoch).
+        """
+        t = float(sample["timestamp"])
+        window = t // self._chunk_seconds
+        if self._window is not None and window != self._window:
+            self.flush()
+        self._window = window
+        self._times.append(t)
+        self._values.append([sample.get(name, np.nan) for name in self._channels])
+
+    def chunk(self) -> tuple[str, dict]:
+        """
+        Encode the buffered samples as a chunk, without writing it.
+
+        ## Returns
+        - `chunk` : tuple[str, dict] or None
+            - The chunk's path and contents, or `None` if nothing is buffered.
+        """
+        if not self._times:
+            return None
+        times = np.asarray(self._times, dtype=np.float64)
+        values = np.asarray(self._values, dtype=np.float64).reshape(len(times), len(self._channels))
+        t0 = times[0]
+        chunk = {
+            "t0": int(round(t0 * 1000)),
+            "n": len(times),
+            "dt": _pack(np.round((times - t0) * 1000), "<u4"),
+        }
+        for i, name in enumerate(self._channels):
+            chunk[name] = _pack(values[:, i], "<f4")
+        return f"{self.node}/{_day(t0)}/{_key(t0)}", chunk
+
+    def flush(self) -> str:
+        """
+        Write the buffered samples as one chunk, even if its window is not over yet.
+        Samples added afterwards start a new chunk, so nothing that was written is ever overwritten.
+
+        ## Returns
+        - `path` : str or None
+            - The path of the written chunk, or `None` if nothing was buffered.
+        """
+        encoded = self.chunk()
+        if encoded is None:
+            return None
+        path, chunk = encoded
+        self._target.update_paths({path: chunk})
+        self._times, self._values, self._window = [], [], None
+        self.chunks_written += 1
+        return path
+
+
+
+
+class HistoryReader:
+    """
+    Reassembles a time range of the history written by `HistoryWriter`.
+    """
+    def __init__(self, database, vehicle: str, chunk_seconds: float = 10.0, root: str = "history"):
+        """
+        ## Parameters
+        - `database` : Database
+            - The database to read from (anything with a `get_range(node, start_key, end_key)` method).
+        - `vehicle` : str
+            - Name of the vehicle.
+        - `chunk_seconds` : float, optional
+            - Chunk length the history was written with (default is `10.0`).
+        - `root` : str, optional
+            - Node under which the history is stored (default is `'history'`).
+        """
+        self._database = database
+        self._node = f"{root.strip('/')}/{vehicle}"
+        self._chunk_seconds = chunk_seconds
+
+    def chunks(self, start: float, end: float) -> list[dict]:
+        """
+        Fetch the raw chunks that may overlap `[start, end]`, oldest first.
+        """
+        chunks = []
+        first = datetime.fromtimestamp(start - self._chunk_seconds, tz=timezone.utc).date()
+        last = datetime.fromtimestamp(end, tz=timezone.utc).date()
+        day = first
+        while day <= last:
+            node = f"{self._node}/{day:%Y-%m-%d}"
+            found = self._database.get_range(node, _key(start - self._chunk_seconds), _key(end))
+            chunks.extend(found[key] for key in sorted(found))
+            day += timedelta(days=1)
+        return chunks
+
+    def read(self, start: float, end: float, channels: list[str] = None) -> dict[str, np.ndarray]:
+        """
+        Read every sample between `start` and `end` (inclusive).
+
+        ## Parameters
+        - `start` : float
+            - Start of the range, in seconds since the epoch.
+        - `end` : float
+            - End of the range, in seconds since the epoch.
+        - `channels` : list[str], optional
+            - Channels to decode (default is every channel found in the chunks).
+
+        ## Returns
+        - `data` : dict[str, np.ndarray]
+            - `timestamp` (seconds since the epoch) and one `float64` array per channel (`nan` where a chunk lacked it).
+        """
+        chunks = self.chunks(start, end)
+        if channels is None:
+            channels = sorted({key for chunk in chunks for key in chunk if key not in ("t0", "n", "dt")})
+        times = [chunk["t0"] / 1000 + _unpack(chunk["dt"], "<u4") / 1000 for chunk in chunks]
+        data = {"timestamp": np.concatenate(times) if times else np.empty(0)}
+        for name in channels:
+            parts = [_unpack(chunk[name], "<f4").astype(np.float64) if name in chunk else np.full(chunk["n"], np.nan) for chunk in chunks]
+            data[name] = np.concatenate(parts) if parts else np.empty(0)
+        keep = (data["timestamp"] >= start) & (data["timestamp"] <= end)
+        return {name: values[keep] for name, values in data.items()}
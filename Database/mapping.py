@@ -0,0 +1,251 @@
+"""
+# mapping.py
+
+Declarative mapping from `Sonata` / `SonataAsync` getters to the paths of the database tree (see `_structure` in
+`Database/db.py`), and its compiled form.
+
+`MAPPING` says, for every leaf path, which getter fills it. `CompiledMapping` turns that into a flat slot table once:
+slot `i` is path `paths[i]`, read by the `i`-th bound getter. A sample vector (or a `Sonata.sample()` dict) then becomes
+a flat multi-path update payload in a single pass, with no nested dicts built per sample.
+"""
+
+import math
+from collections import namedtuple
+
+from OBDModule.channels import channel as _channel
+
+
+
+
+
+Source = namedtuple("Source", ["getter", "kwargs", "transform", "channel"])
+"""
+Where the value of one database leaf comes from.
+
+- `getter`: Dotted name of the method on `Sonata` / `SonataAsync` (e.g. `get_engine_RPM`, `DTCs.count`, `MonitorResults.VVT_bank1`).
+- `kwargs`: Keyword arguments passed to the getter.
+- `transform`: Optional function applied to the getter's result.
+- `channel`: Name of the logged channel carrying the same value (e.g. `rpm`), or `None`.
+"""
+
+
+def source(getter: str, transform=None, **kwargs) -> Source:
+    """
+    Declares a leaf filled by a getter.
+    """
+    return Source(getter, kwargs, transform, None)
+
+
+def logged(name: str) -> Source:
+    """
+    Declares a leaf filled by a logged channel (see `OBDModule.channels.CHANNELS`), with the channel's getter and unit.
+    """
+    entry = _channel(name)
+    return Source(entry.getter, entry.kwargs, None, entry.name)
+
+
+def _latest_code(dtcs: list) -> str:
+    return dtcs[-1].code if dtcs else ""
+
+
+def _latest_description(dtcs: list) -> str:
+    return dtcs[-1].description if dtcs else ""
+
+
+def _first_system(status: tuple) -> str:
+    return status[0] if status else ""
+
+
+
+
+MAPPING = {
+    'accelerator/position_d':                       source("get_accelerator_position_D"),
+    'accelerator/position_e':                       source("get_accelerator_position_E"),
+    'ambient_air/pressure':                         source("get_barometric_pressure"),
+    'ambient_air/temperature':                      source("get_ambient_air_temperature"),
+    'catalyst_temperature/bank1/sensor1':           logged("catalyst_temperature_bank1sensor1"),
+    'catalyst_temperature/bank1/sensor2':           logged("catalyst_temperature_bank1sensor2"),
+    'commanded_equivalence_ratio':                  source("get_commanded_equivalence_ratio"),
+    'commanded_evaporative_purge':                  source("get_evaporative_purge"),
+    'control_module_voltage':                       source("get_control_module_voltage"),
+    'coolant_temperature':                          logged("coolant_temperature"),
+    'dtc/count':                                    source("DTCs.count"),
+    'dtc/distance_since_clear':                     source("DTCs.distance_since_last_clear"),
+    'dtc/latest_code':                              source("DTCs.read", _latest_code),
+    'dtc/latest_code_description':                  source("DTCs.read", _latest_description),
+    'dtc/time_since_clear':                         source("DTCs.time_since_last_clear"),
+    'dtc/warmups_since_clear':                      source("DTCs.warmups_since_last_clear"),
+    'engine_load/absolute':                         logged("absolute_engine_load"),
+    'engine_load/calculated':                       logged("calculated_engine_load"),
+    'engine_rpm':                                   logged("rpm"),
+    'engine_run_time':                              source("get_engine_run_time"),
+    'evap_vapor_pressure':                          source("get_evaporative_system_vapor_pressure"),
+    'fuel_level':                                   logged("fuel_level"),
+    'fuel_rail_pressure':                           logged("fuel_rail_pressure"),
+    'fuel_status':                                  source("get_fuel_status", _first_system),
+    'fuel_trim/long_term/bank1':                    source("get_long_term_fuel_trim_Bank1"),
+    'fuel_trim/short_term/bank1':                   logged("short_term_fuel_trim_bank1"),
+    'intake_manifold/pressure':                     logged("intake_manifold_pressure"),
+    'intake_manifold/temperature':                  source("get_intake_air_temperature"),
+    'monitor_results/catalyst/bank1':               source("MonitorResults.catalyst_bank1"),
+    'monitor_results/evap/_020':                    source("MonitorResults.EVAP_020"),
+    'monitor_results/evap/_040':                    source("MonitorResults.EVAP_040"),
+    'monitor_results/evap/_090':                    source("MonitorResults.EVAP_090"),
+    'monitor_results/evap/_150':                    source("MonitorResults.EVAP_150"),
+    'monitor_results/evap/purge_flow':              source("MonitorResults.purge_flow"),
+    'monitor_results/misfire/cylinder1':            source("MonitorResults.cylinder1_misfire"),
+    'monitor_results/misfire/cylinder2':            source("MonitorResults.cylinder2_misfire"),
+    'monitor_results/misfire/cylinder3':            source("MonitorResults.cylinder3_misfire"),
+    'monitor_results/misfire/cylinder4':            source("MonitorResults.cylinder4_misfire"),
+    'monitor_results/misfire/general':              source("MonitorResults.general_misfire"),
+    'monitor_results/o2_sensor/bank1/sensor1':      source("MonitorResults.O2Sensor_bank1sensor1"),
+    'monitor_results/o2_sensor/bank1/sensor2':      source("MonitorResults.O2Sensor_bank1sensor2"),
+    'monitor_results/o2_sensor_heater/bank1/sensor1': source("MonitorResults.O2SensorHeater_bank1sensor1"),
+    'monitor_results/o2_sensor_heater/bank1/sensor2': source("MonitorResults.O2SensorHeater_bank1sensor2"),
+    'monitor_results/vvt/bank1':                    source("MonitorResults.VVT_bank1"),
+    'o2_sensor/bank1/sensor1_wr_lambda':            logged("o2_bank1sensor1_wr_lambda_current"),
+    'o2_sensor/bank1/sensor2':                      logged("o2_bank1sensor2_voltage"),
+    'o2_trim/long_term/bank1':                      source("get_long_term_O2_trim_Bank1"),
+    'o2_trim/short_term/bank1':                     logged("short_term_o2_trim_bank1"),
+    'throttle_position/absolute':                   logged("absolute_throttle_pos"),
+    'throttle_position/absolute_b':                 source("get_absolute_throttle_position_B"),
+    'throttle_position/commanded':                  source("get_commanded_throttle_actuator"),
+    'throttle_position/relative':                   logged("relative_throttle_pos"),
+    'timing_advance':                               logged("timing_advance"),
+    'vehicle_speed':                                logged("speed"),
+}
+"""
+Source of every leaf of the database tree, keyed by slash-separated path.
+"""
+
+
+
+
+class CompiledMapping:
+    """
+    A mapping compiled into a flat slot table (one slot per database leaf).
+    """
+    def __init__(self, mapping: dict = None, paths: list[str] = None):
+        """
+        ## Parameters
+        - `mapping` : dict, optional
+            - Sources keyed by path (default is `MAPPING`).
+        - `paths` : list[str], optional
+            - Only compile these paths (or subtrees, e.g. `'monitor_results'`), in this order. Default is every path of the mapping.
+        """
+        mapping = MAPPING if mapping is None else mapping
+        if paths is None:
+            selected = list(mapping)
+        else:
+            selected = [path for prefix in paths for path in mapping if path == prefix or path.startswith(prefix.rstrip("/") + "/")]
+            if not selected:
+                raise KeyError(f"No mapped paths match {paths}")
+        self._paths = tuple(selected)
+        self._sources = tuple(mapping[path] for path in self._paths)
+        self._slots = {path: i for i, path in enumerate(self._paths)}
+        self._channel_pairs = tuple((source.channel, path) for path, source in zip(self._paths, self._sources) if source.channel)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+    @property
+    def paths(self) -> tuple[str, ...]:
+        """
+        Database path of every slot, in slot order.
+        """
+        return self._paths
+
+    @property
+    def channels(self) -> tuple[str, ...]:
+        """
+        Names of the logged channels that feed at least one slot.
+        """
+        return tuple(name for name, _ in self._channel_pairs)
+
+    def slot(self, path: str) -> int:
+        """
+        Get the slot index of a path.
+        """
+        return self._slots[path]
+
+
+    def bind(self, sonata):
+        """
+        Resolve every getter against a `Sonata` / `SonataAsync` once.
+
+        ## Parameters
+        - `sonata` : Sonata or SonataAsync
+            - The connected vehicle interface.
+
+        ## Returns
+        - `read` : Callable[[], list]
+            - Function that queries every slot and returns the values in slot order (`None` where a query failed).
+        """
+        readers = []
+        for source in self._sources:
+            target = sonata
+            *owners, name = source.getter.split(".")
+            for owner in owners:
+                target = getattr(target, owner)
+            readers.append((getattr(target, name), source.kwargs, source.transform))
+
+        def read() -> list:
+            values = []
+            append = values.append
+            for getter, kwargs, transform in readers:
+                try:
+                    value = getter(**kwargs)
+                    append(transform(value) if transform is not None else value)
+                except Exception:
+                    append(None)
+            return values
+
+        return read
+
+    def payload(self, values: list) -> dict:
+        """
+        Turn a vector of values in slot order into a flat multi-path update payload.
+
+        ## Parameters
+        - `values` : list
+            - One value per slot.
+
+        ## Returns
+        - `payload` : dict
+            - Values keyed by path, ready for `Database.update_paths`.
+        """
+        return dict(zip(self._paths, values))
+
+    def sample_payload(self, sample: dict) -> dict:
+        """
+        Turn a `Sonata.sample()` dict into a flat multi-path update payload, for the slots fed by logged channels.
+
+        ## Parameters
+        - `sample` : dict
+            - The sample, with values keyed by channel name. Channels missing from it, or whose value is not finite
+              (`nan` when the channel could not be read), are skipped: there is nothing valid to write.
+
+        ## Returns
+        - `payload` : dict
+            - Values keyed by path, ready for `Database.update_paths`.
+        """
+        payload = {}
+        for name, path in self._channel_pairs:
+            value = sample.get(name)
+            if value is not None and math.isfinite(value):
+                payload[path] = value
+        return payload
+
+    def structure(self, default=0) -> dict:
+        """
+        Build the nested tree of the compiled paths, with every leaf set to `default`.
+        """
+        tree = {}
+        for path in self._paths:
+            node = tree
+            *parents, leaf = path.split("/")
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = default
+        return tree
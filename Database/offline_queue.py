@@ -0,0 +1,315 @@
+"""
+# offline_queue.py
+
+Defines the OfflineQueue class, a persistent store-and-forward queue between sample producers and `Database`.
+
+Updates are written to a local SQLite file instead of being sent directly, so they survive having no connectivity
+and reboots. Updates to the same path are coalesced (only the latest value is kept). A background thread sends the
+queued leaves in large multi-path updates whenever the database is reachable, backing off exponentially while it
+is not. Producers only ever touch the local file, so the acquisition loop never waits on the network.
+
+Values that can never be sent are kept out of the way: non-finite numbers (`nan` for unreadable channels) are dropped
+before they are queued, and a batch the database rejects for good (a 4xx response other than 401, 408 or 429) is
+moved to a `dead_letter` table, with the error, instead of blocking the head of the queue.
+"""
+
+import json
+import time
+import random
+import sqlite3
+import threading
+
+from Database.sync import flatten, finite
+
+
+
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Tell whether a failed send would fail again if retried unchanged.
+
+    ## Parameters
+    - `error` : Exception
+        - What the database raised.
+
+    ## Returns
+    - `permanent` : bool
+        - `True` for payloads that cannot be serialized, and for 4xx responses other than 401 (expired credentials),
+          408 (timeout) and 429 (rate limited).
+    """
+    while error is not None:
+        # firebase_admin wraps the underlying requests error (e.g. `InvalidJSONError`) as its cause
+        if isinstance(error, (TypeError, ValueError)) or type(error).__name__ == "InvalidJSONError":
+            return True
+        response = getattr(error, "http_response", None)
+        if response is None:
+            response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+        if isinstance(status, int):
+            return 400 <= status < 500 and status not in (401, 408, 429)
+        error = getattr(error, "cause", None) or error.__cause__
+    return False
+
+
+
+
+class OfflineQueue:
+    """
+    Persistent, coalescing upload queue with batched, backed-off flushing.
+    """
+    def __init__(self, database, path: str = "upload_queue.sqlite3", batch_size: int = 500, flush_interval: float = 1.0, min_backoff: float = 1.0, max_backoff: float = 300.0):
+        """
+        ## Parameters
+        - `database` : Database
+            - The database to flush to (anything with an `update_paths(dict)` method).
+        - `path` : str, optional
+            - Path to the queue file (created if needed).
+        - `batch_size` : int, optional
+            - Maximum number of leaves sent per multi-path update (default is `500`).
+        - `flush_interval` : float, optional
+            - Seconds between flushes while connected (default is `1.0`).
+        - `min_backoff` : float, optional
+            - Seconds to wait after the first failed flush (default is `1.0`). Doubles with each further failure.
+        - `max_backoff` : float, optional
+            - Upper bound of the wait between failed flushes (default is `300.0`).
+        """
+        self._database = database
+        self._path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS pending (path TEXT PRIMARY KEY, value TEXT NOT NULL, seq INTEGER NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS pending_seq ON pending (seq)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS dead_letter (path TEXT NOT NULL, value TEXT NOT NULL, seq INTEGER NOT NULL, error TEXT NOT NULL, failed_at REAL NOT NULL)")
+        self._seq = self._connection.execute("SELECT COALESCE(MAX(seq), 0) FROM pending").fetchone()[0]
+
+        self._failures = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.batches_sent = 0
+        self.leaves_sent = 0
+        self.leaves_dropped = 0
+        self.last_error = None
+
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of leaves waiting to be sent.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    @property
+    def dead_letter_depth(self) -> int:
+        """
+        Number of leaves moved to the dead-letter table.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    @property
+    def failures(self) -> int:
+        """
+        Number of consecutive failed flushes (`0` while connected).
+        """
+        return self._failures
+
+
+    def update_paths(self, data: dict) -> None:
+        """
+        Queue a flat mapping of paths to values. Returns as soon as it is stored locally.
+        Values that cannot be sent as JSON (`nan`, `inf`) are dropped and counted in `leaves_dropped`.
+
+        ## Parameters
+        - `data` : dict
+            - Slash-separated paths and their new values.
+        """
+        valid = finite(data)
+        self.leaves_dropped += len(data) - len(valid)
+        if not valid:
+            return
+        with self._lock:
+            rows = []
+            for path, value in valid.items():
+                try: text = json.dumps(value, allow_nan=False)
+                except (TypeError, ValueError):
+                    self.leaves_dropped += 1
+                    continue
+                self._seq += 1
+                rows.append((path, text, self._seq))
+            if not rows:
+                return
+            self._connection.execute("BEGIN")
+            self._connection.executemany("INSERT OR REPLACE INTO pending (path, value, seq) VALUES (?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+        if len(rows) >= self._batch_size:
+            self._wake.set()
+
+    def update_node(self, node: str, data: dict) -> None:
+        """
+        Queue an update of a node (same arguments as `Database.update_node`).
+        """
+        self.update_paths(flatten(data, node))
+
+    def update_all(self, data: dict) -> None:
+        """
+        Queue an update of the whole tree (same arguments as `Database.update_all`).
+        """
+        self.update_paths(flatten(data))
+
+
+    def _remove(self, rows: list, error: Exception = None) -> None:
+        """
+        Remove sent leaves from the queue, or move rejected ones to the dead-letter table if `error` is given.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            if error is not None:
+                reason, now = f"{type(error).__name__}: {error}", time.time()
+                self._connection.executemany("INSERT INTO dead_letter (path, value, seq, error, failed_at) VALUES (?, ?, ?, ?, ?)",
+                                             [(path, value, seq, reason, now) for path, value, seq in rows])
+            # leaves that were overwritten while the batch was in flight have a newer seq and stay queued
+            self._connection.executemany("DELETE FROM pending WHERE path = ? AND seq = ?", [(path, seq) for path, _, seq in rows])
+            self._connection.execute("COMMIT")
+
+    def flush_once(self) -> int:
+        """
+        Send one batch of the oldest queued leaves. Raises whatever the database raises if the send fails, unless
+        the failure is permanent (see `is_permanent`), in which case the batch goes to the dead-letter table.
+
+        ## Returns
+        - `sent` : int
+            - The number of leaves taken off the queue, sent or dead-lettered (`0` if the queue was empty).
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT path, value, seq FROM pending ORDER BY seq LIMIT ?", (self._batch_size,)).fetchall()
+        if not rows:
+            return 0
+        payload, invalid = {}, []
+        for row in rows:
+            # queue files written before non-finite values were dropped may still hold them
+            value = json.loads(row[1])
+            try: json.dumps(value, allow_nan=False)
+            except ValueError: invalid.append(row)
+            else: payload[row[0]] = value
+        if invalid:
+            self._remove(invalid, ValueError("Out of range float values are not JSON compliant"))
+        sendable = [row for row in rows if row[0] in payload]
+        if sendable:
+            try:
+                self._database.update_paths(payload)
+            except Exception as error:
+                if not is_permanent(error):
+                    raise
+                self.last_error = error
+                self._remove(sendable, error)
+                return len(rows)
+            self._remove(sendable)
+            self.batches_sent += 1
+            self.leaves_sent += len(sendable)
+        return len(rows)
+
+    def dead_letters(self, limit: int = 100) -> list[dict]:
+        """
+        Get the oldest dead-lettered leaves.
+
+        ## Parameters
+        - `limit` : int, optional
+            - Maximum number of leaves returned (default is `100`).
+
+        ## Returns
+        - `leaves` : list[dict]
+            - Each leaf's `path`, `value`, `error` and `failed_at` (seconds since the epoch).
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT path, value, error, failed_at FROM dead_letter ORDER BY rowid LIMIT ?", (limit,)).fetchall()
+        return [{"path": path, "value": json.loads(value), "error": error, "failed_at": failed_at} for path, value, error, failed_at in rows]
+
+    def clear_dead_letters(self) -> int:
+        """
+        Delete every dead-lettered leaf.
+
+        ## Returns
+        - `deleted` : int
+            - The number of leaves deleted.
+        """
+        with self._lock:
+            return self._connection.execute("DELETE FROM dead_letter").rowcount
+
+    def flush(self) -> int:
+        """
+        Send batches until the queue is empty. Raises on the first failed send.
+
+        ## Returns
+        - `sent` : int
+            - The total number of leaves sent.
+        """
+        total = 0
+        while True:
+            sent = self.flush_once()
+            if not sent:
+                return total
+            total += sent
+
+    def _backoff(self) -> float:
+        delay = min(self._max_backoff, self._min_backoff * 2 ** (self._failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.flush()
+                self._failures = 0
+                self.last_error = None
+                wait = self._flush_interval
+            except Exception as error:
+                self._failures += 1
+                self.last_error = error
+                wait = self._backoff()
+            self._wake.wait(wait)
+            self._wake.clear()
+
+
+    def start(self) -> "OfflineQueue":
+        """
+        Start flushing on a background thread.
+        """
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="offline-queue", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True) -> None:
+        """
+        Stop the background thread. Anything still queued stays on disk for next time.
+
+        ## Parameters
+        - `flush` : bool, optional
+            - Whether to try one last full flush before stopping (failures are ignored).
+        """
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        if flush:
+            try: self.flush()
+            except Exception as error: self.last_error = error
+
+    def close(self) -> None:
+        """
+        Stop flushing and close the queue file.
+        """
+        self.stop(flush=False)
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,204 @@
+"""
+# sync.py
+
+Defines the DatabaseSync class, a layer in front of `Database` that only sends what changed.
+
+It remembers the last value pushed for every leaf of the tree, drops changes smaller than a per-field deadband
+and values that could not be read (`nan`), coalesces everything that arrives between two pushes, and sends the rest
+as one flattened multi-path update, at most `max_rate` times per second.
+"""
+
+import time
+import math
+import numbers
+
+
+
+
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    """
+    Flatten a nested dict into slash-separated leaf paths.
+
+    ## Parameters
+    - `data` : dict
+        - The nested data (e.g. `{'engine_load': {'absolute': 25.9}}`).
+    - `prefix` : str, optional
+        - Path to prepend to every leaf.
+
+    ## Returns
+    - `flat` : dict
+        - The leaves, keyed by path (e.g. `{'engine_load/absolute': 25.9}`).
+    """
+    flat = {}
+    stack = [(prefix.strip("/"), data)]
+    while stack:
+        path, node = stack.pop()
+        for key, value in node.items():
+            child = f"{path}/{key}" if path else str(key)
+            if isinstance(value, dict):
+                stack.append((child, value))
+            else:
+                flat[child] = value
+    return flat
+
+
+def finite(data: dict) -> dict:
+    """
+    Drop the leaves whose value is a non-finite number (`nan` marks a channel that could not be read, and
+    neither `nan` nor `inf` can be sent as JSON).
+
+    ## Parameters
+    - `data` : dict
+        - Flat mapping of paths to values.
+
+    ## Returns
+    - `data` : dict
+        - The leaves with a finite or non-numeric value.
+    """
+    return {path: value for path, value in data.items()
+            if not (isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) and not math.isfinite(value))}
+
+
+
+
+class DatabaseSync:
+    """
+    Diff-based, rate-limited sync of a local tree to a `Database`.
+
+    Updates that arrive while the rate limit holds are kept pending; they go out with the next update, or with
+    the next call to `push()` once the interval has passed.
+    """
+    def __init__(self, database, deadbands: dict = None, max_rate: float = 1.0, clock=time.monotonic):
+        """
+        ## Parameters
+        - `database` : Database
+            - The database to push to (anything with an `update_paths(dict)` method).
+        - `deadbands` : dict, optional
+            - Minimum change for a numeric leaf to be sent, keyed by path. A key also applies to every leaf below it
+              (e.g. `'catalyst_temperature': 1.0`); the longest matching key wins. Leaves without a deadband are sent on any change.
+        - `max_rate` : float, optional
+            - Maximum number of pushes per second (default is `1.0`).
+        - `clock` : callable, optional
+            - Time source, in seconds (default is `time.monotonic`).
+        """
+        self._database = database
+        self._deadbands = dict(deadbands or {})
+        self._interval = 1.0 / max_rate if max_rate else 0.0
+        self._clock = clock
+        self._last = {}
+        self._pending = {}
+        self._last_push = None
+        self._deadband_cache = {}
+        self.pushes = 0
+        self.leaves_sent = 0
+        self.leaves_suppressed = 0
+
+    @property
+    def pending(self) -> dict:
+        """
+        Leaves received since the last push, keyed by path.
+        """
+        return self._pending
+
+    @property
+    def last_pushed(self) -> dict:
+        """
+        The last value pushed for every leaf, keyed by path.
+        """
+        return self._last
+
+
+    def _deadband(self, path: str) -> float:
+        deadband = self._deadband_cache.get(path)
+        if deadband is None:
+            deadband, key = 0.0, path
+            while key:
+                if key in self._deadbands:
+                    deadband = self._deadbands[key]
+                    break
+                key = key.rpartition("/")[0]
+            self._deadband_cache[path] = deadband
+        return deadband
+
+    def _changed(self, path: str, value) -> bool:
+        if path not in self._last:
+            return True
+        last = self._last[path]
+        if isinstance(value, (int, float)) and isinstance(last, (int, float)) and not isinstance(value, bool):
+            deadband = self._deadband(path)
+            return abs(value - last) > deadband if deadband else value != last
+        return value != last
+
+    def diff(self, data: dict) -> dict:
+        """
+        Get the leaves of `data` that differ from what was last pushed, by more than their deadband.
+        Non-finite values (channels that could not be read) never count as changes.
+
+        ## Parameters
+        - `data` : dict
+            - Flat mapping of paths to values.
+
+        ## Returns
+        - `changes` : dict
+            - The changed leaves, keyed by path.
+        """
+        return {path: value for path, value in finite(data).items() if self._changed(path, value)}
+
+
+    def update_node(self, node: str, data: dict) -> dict:
+        """
+        Queue an update of a node (same arguments as `Database.update_node`) and push if the rate limit allows it.
+
+        ## Returns
+        - `changes` : dict or None
+            - The leaves that were pushed, or `None` if nothing was pushed this time.
+        """
+        self._pending.update(finite(flatten(data, node)))
+        return self.push()
+
+    def update_all(self, data: dict) -> dict:
+        """
+        Queue an update of the whole tree (same arguments as `Database.update_all`) and push if the rate limit allows it.
+
+        ## Returns
+        - `changes` : dict or None
+            - The leaves that were pushed, or `None` if nothing was pushed this time.
+        """
+        self._pending.update(finite(flatten(data)))
+        return self.push()
+
+    def push(self, force: bool = False) -> dict:
+        """
+        Push the pending changes as one multi-path update, unless the last push was less than `1 / max_rate` seconds ago.
+
+        ## Parameters
+        - `force` : bool, optional
+            - Push regardless of the rate limit.
+
+        ## Returns
+        - `changes` : dict or None
+            - The leaves that were pushed, or `None` if nothing was pushed.
+        """
+        now = self._clock()
+        if not self._pending or (not force and self._last_push is not None and now - self._last_push < self._interval):
+            return None
+        changes = self.diff(self._pending)
+        if not changes:
+            self.leaves_suppressed += len(self._pending)
+            self._pending = {}
+            return None
+        self._database.update_paths(changes)    # if this raises, the changes stay pending for the next push
+        self.leaves_suppressed += len(self._pending) - len(changes)
+        self._pending = {}
+        self._last.update(changes)
+        self._last_push = now
+        self.pushes += 1
+        self.leaves_sent += len(changes)
+        return changes
+
+    def reset(self) -> None:
+        """
+        Forget what was last pushed, so that the next push sends every leaf again (e.g. after reconnecting).
+        """
+        self._last = {}
@@ -0,0 +1,144 @@
+"""
+# tree.py
+
+Defines the Tree class, an in-memory JSON tree with the semantics of the Firebase Realtime Database.
+
+It backs the local emulator (`Database/emulator.py`) and the listener-fed cache (`Database/cache.py`).
+"""
+
+import json
+import time
+import random
+import threading
+
+
+
+
+
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+
+
+def _segments(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+class Tree:
+    """
+    In-memory JSON tree with Realtime Database semantics (setting `None` deletes, empty objects disappear).
+    """
+    def __init__(self, data: dict = None):
+        """
+        ## Parameters
+        - `data` : dict, optional
+            - Initial contents of the tree.
+        """
+        self._root = data if isinstance(data, dict) else {}
+        self._lock = threading.RLock()
+        self._last_push_time = 0
+        self._last_push_random = []
+
+    @property
+    def lock(self) -> threading.RLock:
+        """
+        Lock held while the tree is read or modified.
+        """
+        return self._lock
+
+    def get(self, path: str):
+        """
+        Get the value at `path` (`None` if there is none).
+        """
+        with self._lock:
+            node = self._root
+            for segment in _segments(path):
+                if not isinstance(node, dict) or segment not in node:
+                    return None
+                node = node[segment]
+            return node if node != {} else None
+
+    def set(self, path: str, value) -> None:
+        """
+        Replace the value at `path` (deleting it if `value` is `None`).
+        """
+        with self._lock:
+            self._set(_segments(path), _prune(value))
+
+    def update(self, path: str, values: dict) -> None:
+        """
+        Set several children of `path` at once. Keys may be slash-separated paths (multi-path update).
+        """
+        with self._lock:
+            base = _segments(path)
+            for key, value in values.items():
+                self._set(base + _segments(key), _prune(value))
+
+    def push(self, path: str, value) -> str:
+        """
+        Add `value` under a new, chronologically ordered key below `path`, and return that key.
+        """
+        with self._lock:
+            key = self._push_id()
+            self._set(_segments(path) + [key], _prune(value))
+            return key
+
+    def _set(self, segments: list[str], value) -> None:
+        if not segments:
+            self._root = value if isinstance(value, dict) else ({} if value is None else value)
+            return
+        if not isinstance(self._root, dict):
+            self._root = {}
+        parents, node = [], self._root
+        for segment in segments[:-1]:
+            if not isinstance(node.get(segment), dict):
+                if value is None:
+                    return
+                node[segment] = {}
+            parents.append((node, segment))
+            node = node[segment]
+        if value is None:
+            node.pop(segments[-1], None)
+            for parent, segment in reversed(parents):
+                if parent[segment]:
+                    break
+                del parent[segment]
+        else:
+            node[segments[-1]] = value
+
+    def _push_id(self) -> str:
+        now = int(time.time() * 1000)
+        if now == self._last_push_time:
+            for i in range(11, -1, -1):
+                if self._last_push_random[i] != 63:
+                    self._last_push_random[i] += 1
+                    break
+                self._last_push_random[i] = 0
+        else:
+            self._last_push_random = [random.randrange(64) for _ in range(12)]
+        self._last_push_time = now
+        stamp = ""
+        for _ in range(8):
+            stamp = _PUSH_CHARS[now % 64] + stamp
+            now //= 64
+        return stamp + "".join(_PUSH_CHARS[i] for i in self._last_push_random)
+
+    def snapshot(self, path: str = "/"):
+        """
+        Get a deep copy of the value at `path` (default is the whole tree), safe to use once the lock is released.
+        """
+        with self._lock:
+            return json.loads(json.dumps(self.get(path) if _segments(path) else self._root))
+
+
+def _prune(value):
+    """
+    Drop `None` leaves and empty objects, as the Realtime Database does.
+    """
+    if isinstance(value, dict):
+        pruned = {str(key): _prune(child) for key, child in value.items()}
+        pruned = {key: child for key, child in pruned.items() if child is not None}
+        return pruned or None
+    if isinstance(value, list):
+        return _prune({str(i): child for i, child in enumerate(value)})
+    return value
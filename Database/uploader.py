@@ -0,0 +1,169 @@
+"""
+# uploader.py
+
+Defines the Uploader class, which sends snapshots to the database on its own thread and schedule.
+
+The acquisition loop hands each snapshot to `submit()`, which only appends it to a small bounded queue and returns
+immediately. When the queue is full the oldest snapshot is dropped (and counted), so a slow network can never delay
+the next OBD query; the uploader always sends the most recent data it has. An update that fails to send is kept at
+the front of the queue, outside the drop-oldest bound, and is retried (under any newer snapshots) at the next send.
+"""
+
+import time
+import threading
+from collections import deque
+
+from Database.sync import flatten
+
+
+
+
+
+class Uploader:
+    """
+    Background uploader fed by a bounded, drop-oldest queue of snapshots.
+    """
+    def __init__(self, target, interval: float = 1.0, maxsize: int = 1):
+        """
+        ## Parameters
+        - `target` : Database, DatabaseSync or OfflineQueue
+            - Where snapshots are sent (anything with an `update_all(dict)` method).
+        - `interval` : float, optional
+            - Minimum number of seconds between two sends (default is `1.0`).
+        - `maxsize` : int, optional
+            - Number of snapshots the queue holds before dropping the oldest (default is `1`, i.e. only the latest).
+        """
+        self._target = target
+        self._interval = interval
+        self._queue = deque()
+        self._retry = {}
+        self._maxsize = maxsize
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+        self.submitted = 0
+        self.dropped = 0
+        self.sent = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_latency = None
+
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of snapshots waiting to be sent (a failed update waiting to be retried counts as one).
+        """
+        return len(self._queue) + (1 if self._retry else 0)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters of the uploader: `depth`, `submitted`, `dropped`, `sent`, `errors` and `last_latency` (seconds).
+        """
+        return {
+            "depth": self.depth,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "errors": self.errors,
+            "last_latency": self.last_latency,
+        }
+
+
+    def submit(self, snapshot: dict) -> None:
+        """
+        Queue a snapshot for upload. Never blocks on the network.
+
+        ## Parameters
+        - `snapshot` : dict
+            - Nested data (as for `Database.update_all`) or a flat mapping of slash-separated paths to values.
+        """
+        with self._condition:
+            if len(self._queue) >= self._maxsize:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(snapshot)
+            self.submitted += 1
+            self._condition.notify()
+
+    def _take(self) -> dict:
+        """
+        Take the failed update and every queued snapshot, merged into one flat update (later snapshots win).
+        """
+        merged, self._retry = self._retry, {}
+        while self._queue:
+            merged.update(flatten(self._queue.popleft()))
+        return merged
+
+    def send_pending(self) -> bool:
+        """
+        Send whatever is queued right now, on the calling thread.
+
+        ## Returns
+        - `sent` : bool
+            - Whether anything was sent successfully. On failure, the update is queued again for the next send.
+        """
+        with self._condition:
+            update = self._take()
+        if not update:
+            return False
+        started = time.perf_counter()
+        try:
+            self._target.update_all(update)
+        except Exception as error:
+            self.errors += 1
+            self.last_error = error
+            with self._condition:
+                update.update(self._retry)      # set meanwhile by a concurrent send, with later snapshots
+                self._retry = update
+            return False
+        self.last_latency = time.perf_counter() - started
+        self.sent += 1
+        return True
+
+    def _run(self) -> None:
+        next_send = time.monotonic()
+        while True:
+            with self._condition:
+                while not self._queue and not self._retry and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._stopping, timeout=delay)
+                    if self._stopping:
+                        return
+            next_send = time.monotonic() + self._interval
+            self.send_pending()
+
+
+    def start(self) -> "Uploader":
+        """
+        Start sending on a background thread.
+        """
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="uploader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True) -> None:
+        """
+        Stop the background thread.
+
+        ## Parameters
+        - `flush` : bool, optional
+            - Whether to send what is still queued before returning.
+        """
+        if self._thread is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify_all()
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.send_pending()
@@ -0,0 +1,221 @@
+"""
+# wire.py
+
+Compact binary encoding of samples for the uplink, and its decoder.
+
+The values of a sample come from single bytes or words of the ECU's response, but they are sent as JSON doubles
+(e.g. `54.509803921568626`). `WireSchema` quantizes every channel back to its native OBD-II resolution (SAE J1979
+scaling, e.g. `100/255` % for loads, `0.25` rpm, `1` km/h) and packs the codes with `struct`:
+
+- `<Id` header: the schema ID (CRC-32 of the schema's description) and the timestamp (seconds since the epoch).
+- A presence bitmask, one bit per channel (bit `i % 8` of byte `i // 8`), cleared for missing values (`nan`).
+- One unsigned code per channel, `B` or `H` depending on the PID's width, over its whole native range (so full scale,
+  e.g. 100 % load as code 255, stays encodable). Missing channels have code 0.
+
+A full snapshot of the logged channels takes 38 bytes (52 characters in base64, for JSON transports such as the
+Realtime Database), instead of roughly 600 characters of JSON. The schema ID lets the receiver pick the matching
+decoder; `WireSchema.description` can be published once (e.g. under `wire/schemas/<id>`) so receivers can rebuild it.
+"""
+
+import json
+import math
+import base64
+import struct
+import zlib
+from collections import namedtuple
+
+from OBDModule.channels import CHANNELS
+
+
+
+
+
+Quantity = namedtuple("Quantity", ["scale", "offset", "code"])
+"""
+Native resolution of a channel: `value = code * scale + offset`, with `code` a `struct` format (`B` or `H`).
+"""
+
+
+RESOLUTIONS = {
+    "speed":                                Quantity(1.0,           0.0,        "B"),
+    "rpm":                                  Quantity(0.25,          0.0,        "H"),
+    "calculated_engine_load":               Quantity(100 / 255,     0.0,        "B"),
+    "absolute_engine_load":                 Quantity(100 / 255,     0.0,        "H"),
+    "relative_throttle_pos":                Quantity(100 / 255,     0.0,        "B"),
+    "absolute_throttle_pos":                Quantity(100 / 255,     0.0,        "B"),
+    "timing_advance":                       Quantity(0.5,           -64.0,      "B"),
+    "fuel_rail_pressure":                   Quantity(10.0,          0.0,        "H"),
+    "intake_manifold_pressure":             Quantity(1.0,           0.0,        "B"),
+    "coolant_temperature":                  Quantity(1.0,           -40.0,      "B"),
+    "fuel_level":                           Quantity(100 / 255,     0.0,        "B"),
+    "catalyst_temperature_bank1sensor1":    Quantity(0.1,           -40.0,      "H"),
+    "catalyst_temperature_bank1sensor2":    Quantity(0.1,           -40.0,      "H"),
+    "o2_bank1sensor2_voltage":              Quantity(0.005,         0.0,        "B"),
+    "o2_bank1sensor1_wr_lambda_current":    Quantity(1 / 256,       -128.0,     "H"),
+    "short_term_fuel_trim_bank1":           Quantity(100 / 128,     -100.0,     "B"),
+    "short_term_o2_trim_bank1":             Quantity(100 / 128,     -100.0,     "B"),
+}
+"""
+Native OBD-II resolution of every logged channel, keyed by channel name.
+"""
+
+
+_HEADER = struct.Struct("<Id")
+_MAXIMUM = {"B": 0xFF, "H": 0xFFFF}
+_FORMAT = 2
+"""
+Version of the frame layout, part of every schema ID (version 1 had no presence bitmask).
+"""
+
+SCHEMAS = {}
+"""
+Every schema created so far, keyed by schema ID (used by `decode`).
+"""
+
+
+
+
+class WireSchema:
+    """
+    Fixed layout of quantized channels, with its encoder and decoder.
+    """
+    def __init__(self, channels: list[str] = None, resolutions: dict = None):
+        """
+        ## Parameters
+        - `channels` : list[str], optional
+            - Names of the channels to encode, in order (default is every logged channel).
+        - `resolutions` : dict, optional
+            - `Quantity` of each channel (default is `RESOLUTIONS`).
+        """
+        resolutions = RESOLUTIONS if resolutions is None else resolutions
+        self._names = tuple(channels) if channels is not None else tuple(entry.name for entry in CHANNELS)
+        self._quantities = tuple(Quantity(*resolutions[name]) for name in self._names)
+        self._mask_size = (len(self._names) + 7) // 8
+        self._struct = struct.Struct(f"<{self._mask_size}s" + "".join(quantity.code for quantity in self._quantities))
+        self._maximum = tuple(_MAXIMUM[quantity.code] for quantity in self._quantities)
+        self._id = zlib.crc32(json.dumps([_FORMAT, self._entries()]).encode("utf-8"))
+        SCHEMAS[self._id] = self
+
+    @classmethod
+    def from_description(cls, description: dict) -> "WireSchema":
+        """
+        Rebuild a schema from its `description` (e.g. as read back from the database).
+        """
+        names = [entry["name"] for entry in description["channels"]]
+        resolutions = {entry["name"]: Quantity(entry["scale"], entry["offset"], entry["code"]) for entry in description["channels"]}
+        schema = cls(names, resolutions)
+        if "id" in description and schema.id != description["id"]:
+            raise ValueError(f"Schema description does not match its ID {description['id']}")
+        return schema
+
+
+    @property
+    def id(self) -> int:
+        """
+        Schema ID carried in every frame.
+        """
+        return self._id
+
+    @property
+    def channels(self) -> tuple[str, ...]:
+        """
+        Names of the encoded channels, in frame order.
+        """
+        return self._names
+
+    @property
+    def size(self) -> int:
+        """
+        Size of an encoded frame, in bytes.
+        """
+        return _HEADER.size + self._struct.size
+
+    @property
+    def description(self) -> dict:
+        """
+        JSON-serializable description of the schema, from which `from_description` rebuilds it.
+        """
+        return {"id": self._id, "channels": self._entries()}
+
+    def _entries(self) -> list[dict]:
+        return [{"name": name, "scale": quantity.scale, "offset": quantity.offset, "code": quantity.code} for name, quantity in zip(self._names, self._quantities)]
+
+
+    def quantize(self, sample: dict) -> list[int]:
+        """
+        Quantize the channels of a sample to their codes (`None` for missing and `nan` values).
+        """
+        codes = []
+        for name, quantity, maximum in zip(self._names, self._quantities, self._maximum):
+            value = sample.get(name)
+            if value is None or math.isnan(value):
+                codes.append(None)
+            else:
+                codes.append(min(maximum, max(0, round((value - quantity.offset) / quantity.scale))))
+        return codes
+
+    def encode(self, sample: dict) -> bytes:
+        """
+        Encode a sample as a frame.
+
+        ## Parameters
+        - `sample` : dict
+            - A sample as returned by `Sonata.sample()`. Values out of a channel's range are clamped to it.
+
+        ## Returns
+        - `frame` : bytes
+            - The encoded frame (`size` bytes).
+        """
+        codes = self.quantize(sample)
+        mask = sum(1 << i for i, code in enumerate(codes) if code is not None).to_bytes(self._mask_size, "little")
+        return _HEADER.pack(self._id, float(sample.get("timestamp", 0.0))) + self._struct.pack(mask, *(code or 0 for code in codes))
+
+    def decode(self, frame: bytes) -> dict:
+        """
+        Decode a frame made with this schema.
+
+        ## Parameters
+        - `frame` : bytes
+            - The encoded frame.
+
+        ## Returns
+        - `sample` : dict
+            - `timestamp` and every channel, at the channel's native resolution (`nan` where missing).
+        """
+        schema_id, timestamp = _HEADER.unpack_from(frame)
+        if schema_id != self._id:
+            raise ValueError(f"Frame has schema ID {schema_id}, expected {self._id}")
+        sample = {"timestamp": timestamp}
+        mask, *codes = self._struct.unpack_from(frame, _HEADER.size)
+        present = int.from_bytes(mask, "little")
+        for i, (name, quantity, code) in enumerate(zip(self._names, self._quantities, codes)):
+            sample[name] = code * quantity.scale + quantity.offset if present >> i & 1 else math.nan
+        return sample
+
+    def encode_text(self, sample: dict) -> str:
+        """
+        Encode a sample as a base64 string, for JSON transports (e.g. `Database.update_paths({'live/frame': ...})`).
+        """
+        return base64.b64encode(self.encode(sample)).decode("ascii")
+
+
+
+
+def decode(frame) -> dict:
+    """
+    Decode a frame (bytes, or its base64 string) with whichever known schema its ID names.
+
+    ## Parameters
+    - `frame` : bytes or str
+        - The encoded frame.
+
+    ## Returns
+    - `sample` : dict
+        - The decoded sample (see `WireSchema.decode`).
+    """
+    if isinstance(frame, str):
+        frame = base64.b64decode(frame)
+    schema_id, _ = _HEADER.unpack_from(frame)
+    if schema_id not in SCHEMAS:
+        raise KeyError(f"Unknown schema ID {schema_id}")
+    return SCHEMAS[schema_id].decode(frame)
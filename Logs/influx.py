@@ -0,0 +1,365 @@
+"""
+# influx.py
+
+Exports samples to InfluxDB line protocol, in large gzip-compressed batches, from live samples or from session logs.
+
+Every sample becomes one line of measurement `obd`, tagged with the vehicle, the session and the ECU, with one field
+per channel (missing / `nan` values, and infinite ones, which line protocol cannot carry, are left out) and a
+nanosecond timestamp:
+
+    `obd,vehicle=sonata,session=2023-05-19_10-48-17,ecu=ISO\\ 15765-4 rpm=1498.0,speed=0.0,... 1684493297067000000`
+
+Batches go to a sink: `FileSink` appends them to a `.lp.gz` file (each batch is one gzip member, so the file stays a
+valid gzip stream), and `HTTPSink` posts them to a write endpoint (InfluxDB 2 `/api/v2/write` or 1.x `/write`) with
+`Content-Encoding: gzip`. Archives are converted in worker processes, so formatting and compression run in parallel.
+
+Usage:
+    `python -m Logs.influx <directory> [<directory> ...] (--output FILE | --url URL) [--vehicle NAME] [--batch-size N]`
+"""
+
+import os
+import math
+import gzip
+import time
+import argparse
+import urllib.request
+import numpy as np
+from functools import partial
+
+from Logs.ingest import discover
+from Logs.parallel import map_files
+from Logs.reader import read_arrays, read_metadata, session_start
+from OBDModule.channels import CHANNELS
+
+
+
+
+
+MEASUREMENT = "obd"
+
+
+
+
+def escape_tag(value) -> str:
+    """
+    Escapes a tag key or value (commas, equal signs and spaces) for line protocol.
+    """
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def series_key(measurement: str = MEASUREMENT, **tags) -> str:
+    """
+    Builds the measurement and tag set of a line (tags that are `None` or empty are left out).
+
+    Returns
+    -------
+    `str`
+        E.g. `obd,ecu=...,session=...,vehicle=sonata`.
+    """
+    parts = [escape_tag(measurement)]
+    parts.extend(f"{escape_tag(key)}={escape_tag(value)}" for key, value in sorted(tags.items()) if value not in (None, ""))
+    return ",".join(parts)
+
+
+def format_lines(key: str, times_ns: np.ndarray, columns: dict[str, np.ndarray]) -> list[str]:
+    """
+    Formats many samples as lines of line protocol.
+
+    Rows without missing values, by far the most common, go through one precompiled template each;
+    only rows with `nan` or infinite values, which are left out, are assembled field by field.
+
+    Parameters
+    ----------
+    `key` : str
+        The measurement and tag set (see `series_key`).
+    `times_ns` : np.ndarray
+        Timestamps, in integer nanoseconds since the epoch.
+    `columns` : dict[str, np.ndarray]
+        One array of values per field, each as long as `times_ns`.
+
+    Returns
+    -------
+    `list[str]`
+        One line per sample (without the trailing newline). Samples with no value at all are skipped.
+    """
+    names = list(columns)
+    if not names or not len(times_ns):
+        return []
+    values = np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in names])
+    complete = np.isfinite(values).all(axis=1)
+    template = key + " " + ",".join(f"{escape_tag(name)}=%r" for name in names) + " %d"
+    rows = values.tolist()
+    times = np.asarray(times_ns, dtype=np.int64).tolist()
+    fields = [escape_tag(name) + "=" for name in names]
+
+    lines = []
+    for row, t, full in zip(rows, times, complete.tolist()):
+        if full:
+            lines.append(template % (*row, t))
+        else:
+            present = [field + repr(value) for field, value in zip(fields, row) if math.isfinite(value)]
+            if present:
+                lines.append(f"{key} {','.join(present)} {t}")
+    return lines
+
+
+def compress(lines: list[str], level: int = 6) -> bytes:
+    """
+    Joins lines into a gzip-compressed batch (one gzip member).
+    """
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=level)
+
+
+
+
+class FileSink:
+    """
+    Appends compressed batches to a file (read back with `gzip.open(path, 'rt')`).
+    """
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        `path` : str
+            Path of the output file (e.g. `fleet.lp.gz`), appended to if it exists.
+        """
+        self._file = open(path, "ab")
+
+    def write(self, batch: bytes) -> None:
+        self._file.write(batch)
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class HTTPSink:
+    """
+    Posts compressed batches to an InfluxDB write endpoint.
+    """
+    def __init__(self, url: str, token: str = None, timeout: float = 30.0):
+        """
+        Parameters
+        ----------
+        `url` : str
+            Full write URL, including its query, e.g. `http://localhost:8086/api/v2/write?org=shop&bucket=obd&precision=ns`
+            or `http://localhost:8086/write?db=obd&precision=ns`.
+        `token` : str, optional
+            API token, sent as `Authorization: Token <token>`.
+        `timeout` : float, optional
+            Seconds to wait for each request (default is `30.0`).
+        """
+        self._url = url
+        self._headers = {"Content-Encoding": "gzip", "Content-Type": "text/plain; charset=utf-8"}
+        if token:
+            self._headers["Authorization"] = f"Token {token}"
+        self._timeout = timeout
+
+    def write(self, batch: bytes) -> None:
+        request = urllib.request.Request(self._url, data=batch, headers=self._headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self._timeout) as response:
+            response.read()
+
+    def close(self) -> None:
+        pass
+
+
+
+
+class InfluxExporter:
+    """
+    Batches live samples into line protocol and sends them to a sink.
+    """
+    def __init__(self, sink, vehicle: str = None, session: str = None, ecu: str = None, channels: list[str] = None,
+                 batch_size: int = 5000, flush_interval: float = 10.0, compression: int = 6) -> "InfluxExporter":
+        """
+        Parameters
+        ----------
+        `sink` : FileSink or HTTPSink
+            Where batches are written (anything with `write(bytes)` and `close()` methods).
+        `vehicle`, `session`, `ecu` : str, optional
+            Tags of every line.
+        `channels` : list[str], optional
+            Names of the channels exported as fields (default is every logged channel).
+        `batch_size` : int, optional
+            Number of lines per batch (default is `5000`).
+        `flush_interval` : float, optional
+            Maximum number of seconds a line waits before its batch is sent, checked on every `write` (default is `10.0`).
+        `compression` : int, optional
+            gzip compression level, 1 (fastest) to 9 (smallest) (default is `6`).
+        """
+        self._sink = sink
+        self._key = series_key(vehicle=vehicle, session=session, ecu=ecu)
+        self._channels = list(channels) if channels is not None else [entry.name for entry in CHANNELS]
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._compression = compression
+        self._lines = []
+        self._oldest = None
+        self.lines_written = 0
+        self.batches_written = 0
+        self.bytes_written = 0
+
+    def __enter__(self) -> "InfluxExporter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+    def write(self, sample: dict) -> None:
+        """
+        Adds one sample (as returned by `Sonata.sample()`, `timestamp` in seconds since the epoch).
+        """
+        columns = {name: np.array([sample.get(name, np.nan)], dtype=np.float64) for name in self._channels}
+        times = np.array([round(float(sample["timestamp"]) * 1e9)], dtype=np.int64)
+        self._add(format_lines(self._key, times, columns))
+
+    def write_arrays(self, times: np.ndarray, columns: dict[str, np.ndarray]) -> None:
+        """
+        Adds many samples at once.
+
+        Parameters
+        ----------
+        `times` : np.ndarray
+            Timestamps, in seconds since the epoch.
+        `columns` : dict[str, np.ndarray]
+            Values of every channel (channels not exported are ignored, missing ones are left out).
+        """
+        times_ns = np.round(np.asarray(times, dtype=np.float64) * 1e9).astype(np.int64)
+        self._add(format_lines(self._key, times_ns, {name: columns[name] for name in self._channels if name in columns}))
+
+    def _add(self, lines: list[str]) -> None:
+        if lines and self._oldest is None:
+            self._oldest = time.monotonic()
+        self._lines.extend(lines)
+        while len(self._lines) >= self._batch_size:
+            self._send(self._lines[:self._batch_size])
+            del self._lines[:self._batch_size]
+        if self._lines and time.monotonic() - self._oldest >= self._flush_interval:
+            self.flush()
+
+    def _send(self, lines: list[str]) -> None:
+        batch = compress(lines, self._compression)
+        self._sink.write(batch)
+        self.lines_written += len(lines)
+        self.batches_written += 1
+        self.bytes_written += len(batch)
+        self._oldest = time.monotonic() if self._lines else None
+
+    def flush(self) -> None:
+        """
+        Sends whatever is buffered as one (possibly short) batch. If the sink raises, the lines stay buffered.
+        """
+        if self._lines:
+            self._send(self._lines)
+            self._lines = []
+            self._oldest = None
+
+    def close(self) -> None:
+        """
+        Flushes and closes the sink.
+        """
+        self.flush()
+        self._sink.close()
+
+
+
+
+def _export_file(path: str, vehicle: str, ecu: str, batch_size: int, compression: int) -> dict:
+    """
+    Formats and compresses a single session log. Runs in a worker process.
+    """
+    lines, batches = _format_file(path, vehicle, ecu, batch_size, compression)
+    return {"lines": lines, "batches": batches}
+
+
+def _format_file(path: str, vehicle: str, ecu: str, batch_size: int, compression: int) -> tuple[int, list[bytes]]:
+    """
+    Formats a session log into compressed batches, returning the number of lines and the batches.
+    """
+    metadata = read_metadata(path)
+    vehicle = vehicle or metadata.get("vehicle") or os.path.basename(os.path.dirname(path))
+    ecu = ecu or metadata.get("ecu") or metadata.get("protocol_name")
+    session = os.path.splitext(os.path.basename(path))[0]
+    start = session_start(path)
+    start = start.timestamp() if start is not None else os.stat(path).st_mtime
+
+    columns = read_arrays(path)
+    times_ns = np.round((start + columns.pop("timestamp")) * 1e9).astype(np.int64)
+    lines = format_lines(series_key(vehicle=vehicle, session=session, ecu=ecu), times_ns, columns)
+    batches = [compress(lines[i:i + batch_size], compression) for i in range(0, len(lines), batch_size)]
+    return len(lines), batches
+
+
+def export_logs(roots: list[str], sink, vehicle: str = None, ecu: str = None, batch_size: int = 50000, compression: int = 6, workers: int = None) -> dict:
+    """
+    Exports every session log below `roots` to a sink.
+
+    Parameters
+    ----------
+    `roots` : list[str]
+        Files or directories to search for session logs.
+    `sink` : FileSink or HTTPSink
+        Where batches are written. Left open.
+    `vehicle` : str, optional
+        Vehicle tag. If not given, the vehicle from each log's metadata is used, or else the name of its directory.
+    `ecu` : str, optional
+        ECU tag. If not given, the protocol recorded in each log's metadata is used.
+    `batch_size` : int, optional
+        Number of lines per batch (default is `50000`).
+    `compression` : int, optional
+        gzip compression level (default is `6`).
+    `workers` : int, optional
+        Number of worker processes (default is the number of CPUs).
+
+    Returns
+    -------
+    `dict`
+        Number of `files`, `lines`, `batches` and compressed `bytes` written, the elapsed `seconds`, and the
+        `results` of each log: its `path` and `status` (`'ok'` or `'error'`, with the `error`). A log that cannot be
+        read is skipped; the others are still exported.
+    """
+    started = time.perf_counter()
+    totals = {"files": 0, "lines": 0, "batches": 0, "bytes": 0, "results": []}
+    worker = partial(_export_file, vehicle=vehicle, ecu=ecu, batch_size=batch_size, compression=compression)
+    for result in map_files(worker, discover(roots), workers):
+        if result["status"] == "ok":
+            batches = result.pop("batches")
+            for batch in batches:
+                sink.write(batch)
+                totals["bytes"] += len(batch)
+            totals["files"] += 1
+            totals["lines"] += result["lines"]
+            totals["batches"] += len(batches)
+        totals["results"].append(result)
+    totals["seconds"] = time.perf_counter() - started
+    return totals
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export session logs to InfluxDB line protocol (gzip-compressed).")
+    parser.add_argument("roots", nargs="+", help="Files or directories to search for session logs.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="File to append the compressed line protocol to (e.g. fleet.lp.gz).")
+    target.add_argument("--url", help="Write endpoint, e.g. http://localhost:8086/api/v2/write?org=shop&bucket=obd&precision=ns")
+    parser.add_argument("--token", default=None, help="API token for --url.")
+    parser.add_argument("--vehicle", default=None, help="Vehicle tag (default is taken from each log's metadata, else its parent directory).")
+    parser.add_argument("--ecu", default=None, help="ECU tag (default is the protocol from each log's metadata).")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--compression", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    sink = FileSink(args.output) if args.output else HTTPSink(args.url, args.token)
+    try:
+        totals = export_logs(args.roots, sink, args.vehicle, args.ecu, args.batch_size, args.compression, args.workers)
+    finally:
+        sink.close()
+    for result in totals["results"]:
+        if result["status"] != "ok":
+            print(f"  error  {result['path']}  ({result['error']})")
+    print(f">> Exported {totals['lines']} points from {totals['files']} file(s) in {totals['batches']} batch(es), "
+          f"{totals['bytes'] / 1e6:.1f} MB in {totals['seconds']:.1f} s ({totals['lines'] / max(totals['seconds'], 1e-9):.0f} points/s)")
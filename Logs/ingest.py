@@ -0,0 +1,255 @@
+"""
+# ingest.py
+
+Bulk ingestion of session logs into one consolidated, columnar (Parquet) dataset.
+
+The dataset is partitioned Hive-style by date and vehicle (`<dataset>/date=2023-05-19/vehicle=sonata/<session>.parquet`),
+so it can be read back as a whole with `pd.read_parquet(dataset)`. A manifest (`<dataset>/_manifest.json`) records
+per-file statistics and the size / modification time of every ingested file, so that re-ingesting a directory only
+parses files that are new or have changed since the last run. Channels are stored in the units of
+`OBDModule.channels.CHANNELS`, whatever unit the log was written in (see `Logs.reader.log_units`).
+
+Usage:
+    `python -m Logs.ingest <dataset> <directory> [<directory> ...] [--vehicle NAME] [--workers N]`
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from Logs.reader import read_header, read_log, read_metadata, session_start
+from OBDModule.channels import LOG_COLUMNS
+
+
+
+
+
+MANIFEST_NAME = "_manifest.json"
+
+UNKNOWN_VEHICLE = "unknown"
+"""
+Vehicle partition of logs whose vehicle is neither given nor recorded in their metadata.
+"""
+
+FORMAT_VERSION = 2
+"""
+Version of the conversion from logs to the dataset, stored with every manifest entry. Files ingested by an older
+version are re-ingested (version 2 converts every channel to the units of `CHANNELS`, e.g. legacy `speed` from m/s).
+"""
+
+
+
+
+def discover(roots: list[str], extensions: tuple[str, ...] = (".txt", ".csv")) -> list[str]:
+    """
+    Finds every session log below the given directories.
+
+    A file counts as a session log if it has one of the given extensions and its first line is a log header
+    (i.e. starts with `timestamp,`). Its schema is checked separately, at parse time.
+
+    Parameters
+    ----------
+    `roots` : list[str]
+        Files or directories to search (recursively).
+    `extensions` : tuple[str, ...], optional
+        File extensions to consider (default is `.txt` and `.csv`).
+
+    Returns
+    -------
+    `list[str]`
+        Absolute paths of the session logs found, sorted.
+    """
+    found = []
+    for root in roots:
+        if os.path.isfile(root):
+            candidates = [root]
+        else:
+            candidates = [os.path.join(directory, name) for directory, _, names in os.walk(root) for name in names]
+        for path in candidates:
+            if not path.lower().endswith(extensions):
+                continue
+            try: header = read_header(path)
+            except (OSError, UnicodeDecodeError): continue
+            if header and header[0] == "timestamp":
+                found.append(os.path.abspath(path))
+    return sorted(set(found))
+
+
+def fingerprint(path: str) -> dict:
+    """
+    Gets the size and modification time of a file, which together decide whether it needs to be re-ingested.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the file.
+
+    Returns
+    -------
+    `dict`
+        The file's `size` (bytes) and `mtime_ns`.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _ingest_file(path: str, dataset: str, vehicle: str) -> dict:
+    """
+    Parses a single session log and writes it to its partition of the dataset. Runs in a worker process.
+
+    Returns the per-file statistics that are stored in the manifest. Errors (including schema mismatches)
+    are reported in the statistics rather than raised, so that one bad file does not abort a whole run.
+    """
+    started = time.perf_counter()
+    stats = {"source": path, "format": FORMAT_VERSION, **fingerprint(path)}
+    try:
+        vehicle = vehicle or read_metadata(path).get("vehicle") or UNKNOWN_VEHICLE
+        df = read_log(path)
+        # logs of a channel subset get the missing channels as empty columns, so every partition has the same schema
+        for column in LOG_COLUMNS:
+            if column not in df.columns:
+                df[column] = np.nan
+        df = df[list(LOG_COLUMNS)]
+        start = session_start(path)
+        if start is None:
+            start = datetime.fromtimestamp(stats["mtime_ns"] / 1e9) - timedelta(seconds=float(df["timestamp"].max() if len(df) else 0))
+        session = os.path.splitext(os.path.basename(path))[0] + "-" + hashlib.sha1(path.encode()).hexdigest()[:8]
+
+        df.insert(0, "time", pd.Timestamp(start) + pd.to_timedelta(df["timestamp"].to_numpy(), unit="s"))
+        df.insert(0, "session", session)
+
+        partition = os.path.join(dataset, f"date={start:%Y-%m-%d}", f"vehicle={vehicle}")
+        os.makedirs(partition, exist_ok=True)
+        output = os.path.join(partition, session + ".parquet")
+        df.to_parquet(output + ".tmp", index=False)
+        os.replace(output + ".tmp", output)
+
+        timestamps = df["timestamp"].to_numpy()
+        intervals = np.diff(timestamps)
+        stats.update({
+            "status": "ok",
+            "session": session,
+            "vehicle": vehicle,
+            "date": f"{start:%Y-%m-%d}",
+            "start": start.isoformat(),
+            "rows": int(len(df)),
+            "duration": float(timestamps[-1] - timestamps[0]) if len(timestamps) else 0.0,
+            "mean_interval": float(intervals.mean()) if len(intervals) else None,
+            "max_interval": float(intervals.max()) if len(intervals) else None,
+            "null_values": int(df[list(LOG_COLUMNS)].isna().sum().sum()),
+            "output": os.path.relpath(output, dataset),
+        })
+    except Exception as error:
+        stats.update({"status": "error", "error": f"{type(error).__name__}: {error}"})
+    stats["parse_seconds"] = time.perf_counter() - started
+    return stats
+
+
+def load_manifest(dataset: str) -> dict:
+    """
+    Loads the manifest of a dataset.
+
+    Parameters
+    ----------
+    `dataset` : str
+        Path to the dataset directory.
+
+    Returns
+    -------
+    `dict`
+        Per-file statistics, keyed by absolute source path (empty if the dataset does not exist yet).
+    """
+    path = os.path.join(dataset, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def _save_manifest(dataset: str, manifest: dict) -> None:
+    path = os.path.join(dataset, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def ingest(roots: list[str], dataset: str, vehicle: str = None, workers: int = None, force: bool = False) -> list[dict]:
+    """
+    Ingests every new or changed session log below `roots` into the dataset.
+
+    Parameters
+    ----------
+    `roots` : list[str]
+        Files or directories to search for session logs.
+    `dataset` : str
+        Path to the dataset directory (created if needed).
+    `vehicle` : str, optional
+        Vehicle name to partition by. If not given, the vehicle from each log's metadata is used,
+        or else `UNKNOWN_VEHICLE`.
+    `workers` : int, optional
+        Number of worker processes (default is the number of CPUs).
+    `force` : bool, optional
+        Whether to re-ingest files that have not changed since the last run (default is `False`). Files that failed
+        last time are always retried.
+
+    Returns
+    -------
+    `list[dict]`
+        The statistics of the files processed in this run (unchanged files are skipped and not included).
+    """
+    os.makedirs(dataset, exist_ok=True)
+    manifest = load_manifest(dataset)
+    dataset = os.path.abspath(dataset)
+
+    pending = []
+    for path in discover(roots):
+        if path.startswith(dataset + os.sep):
+            continue
+        previous = manifest.get(path)
+        # files that failed are retried on every run, in case the failure was transient or the reader was fixed
+        if (not force and previous is not None and previous.get("status") == "ok" and previous.get("format") == FORMAT_VERSION
+                and all(previous.get(key) == value for key, value in fingerprint(path).items())):
+            continue
+        pending.append((path, vehicle))
+
+    results = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_ingest_file, path, dataset, name) for path, name in pending]
+            for future in futures:
+                stats = future.result()
+                # a re-ingested file may land in another partition (or fail): its previous output would duplicate its rows
+                stale = (manifest.get(stats["source"]) or {}).get("output")
+                if stale and stale != stats.get("output"):
+                    try: os.remove(os.path.join(dataset, stale))
+                    except FileNotFoundError: pass
+                manifest[stats["source"]] = stats
+                results.append(stats)
+        _save_manifest(dataset, manifest)
+    return results
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest session logs into a consolidated Parquet dataset.")
+    parser.add_argument("dataset", help="Output dataset directory.")
+    parser.add_argument("roots", nargs="+", help="Files or directories to search for session logs.")
+    parser.add_argument("--vehicle", default=None, help=f"Vehicle name (default is taken from each log's metadata, else '{UNKNOWN_VEHICLE}').")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--force", action="store_true", help="Re-ingest files that have not changed.")
+    args = parser.parse_args()
+
+    results = ingest(args.roots, args.dataset, vehicle=args.vehicle, workers=args.workers, force=args.force)
+    for stats in results:
+        if stats["status"] == "ok":
+            print(f"  ok     {stats['source']}  ({stats['rows']} rows, {stats['duration']:.1f} s)")
+        else:
+            print(f"  error  {stats['source']}  ({stats['error']})")
+    print(f">> Ingested {sum(stats['status'] == 'ok' for stats in results)} file(s), {sum(stats['status'] != 'ok' for stats in results)} error(s).")
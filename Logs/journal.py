@@ -0,0 +1,327 @@
+"""
+# journal.py
+
+Defines the Journal class, a crash-safe, append-only alternative to writing session logs as CSV.
+
+The Pi loses power whenever the ignition turns off, which can leave a CSV log truncated mid-row. A journal is
+written in checksummed blocks instead, and `fsync` is only called every `fsync_interval` seconds rather than
+once per row: a block is written when it fills up, or earlier, partially filled, when the interval has elapsed.
+On startup, `recover()` scans the blocks and truncates the file back to the end of the last intact one, so a power
+cut while sampling loses at most the samples appended during the last `fsync_interval` seconds. A journal whose
+header was cut short while it was being created holds no samples and is started afresh.
+
+File layout (all integers little-endian):
+- File header: `PIOBDJ1\\0`, header length (`uint32`), header CRC-32 (`uint32`), header (JSON, with the column names
+  and the session metadata, see `Logs.session`).
+- Blocks: `BLK1`, payload length (`uint32`), row count (`uint32`), CRC-32 of length + row count + payload (`uint32`), payload.
+  The payload is `row count × columns` `float64` values, row-major.
+"""
+
+import os
+import json
+import time
+import zlib
+import struct
+import numpy as np
+from datetime import datetime
+
+from Logs.reader import METADATA_PREFIX
+from OBDModule.channels import CHANNELS, LOG_COLUMNS
+
+
+
+
+
+FILE_MAGIC = b"PIOBDJ1\x00"
+BLOCK_MAGIC = b"BLK1"
+_FILE_HEADER = struct.Struct("<8sII")
+_BLOCK_HEADER = struct.Struct("<4sIII")
+
+
+
+
+def _block_crc(payload_length: int, rows: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(struct.pack("<II", payload_length, rows)))
+
+
+def _read_file_header(file) -> tuple[dict, int]:
+    """
+    Reads and validates the file header. Returns the header and the offset of the first block.
+    """
+    raw = file.read(_FILE_HEADER.size)
+    if len(raw) < _FILE_HEADER.size:
+        raise ValueError("Journal header is truncated")
+    magic, length, crc = _FILE_HEADER.unpack(raw)
+    if magic != FILE_MAGIC:
+        raise ValueError("Not a journal file")
+    header = file.read(length)
+    if len(header) < length or zlib.crc32(header) != crc:
+        raise ValueError("Journal header is corrupted")
+    return json.loads(header.decode("utf-8")), _FILE_HEADER.size + length
+
+
+def _header_truncated(path: str) -> bool:
+    """
+    Tells whether a journal file ends before the end of its header (e.g. power was cut while it was being created).
+    """
+    with open(path, "rb") as file:
+        raw = file.read(_FILE_HEADER.size)
+        if len(raw) < _FILE_HEADER.size:
+            return FILE_MAGIC.startswith(raw[:len(FILE_MAGIC)])
+        magic, length, _ = _FILE_HEADER.unpack(raw)
+        return magic == FILE_MAGIC and len(file.read(length)) < length
+
+
+def _scan(file, columns: int, offset: int):
+    """
+    Yields `(offset, rows, payload)` for every intact block, stopping at the first truncated or corrupted one.
+    """
+    file.seek(offset)
+    while True:
+        raw = file.read(_BLOCK_HEADER.size)
+        if len(raw) < _BLOCK_HEADER.size:
+            return
+        magic, length, rows, crc = _BLOCK_HEADER.unpack(raw)
+        if magic != BLOCK_MAGIC or length != rows * columns * 8:
+            return
+        payload = file.read(length)
+        if len(payload) < length or _block_crc(length, rows, payload) != crc:
+            return
+        yield offset, rows, payload
+        offset += _BLOCK_HEADER.size + length
+
+
+
+
+def recover(path: str) -> int:
+    """
+    Truncates a journal to the end of its last intact block.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the journal.
+
+    Returns
+    -------
+    `int`
+        The number of bytes that were cut off (`0` if the journal was intact).
+    """
+    with open(path, "r+b") as file:
+        size = os.fstat(file.fileno()).st_size
+        header, end = _read_file_header(file)
+        for offset, rows, payload in _scan(file, len(header["columns"]), end):
+            end = offset + _BLOCK_HEADER.size + len(payload)
+        if end < size:
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+    return size - end
+
+
+def read_journal(path: str) -> dict[str, np.ndarray]:
+    """
+    Reads every intact block of a journal.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the journal.
+
+    Returns
+    -------
+    `dict[str, np.ndarray]`
+        One `float64` array per column, keyed by column name.
+    """
+    with open(path, "rb") as file:
+        header, offset = _read_file_header(file)
+        columns = header["columns"]
+        payloads = [payload for _, _, payload in _scan(file, len(columns), offset)]
+    rows = np.frombuffer(b"".join(payloads), dtype="<f8").reshape(-1, len(columns))
+    return {column: rows[:, i] for i, column in enumerate(columns)}
+
+
+def read_journal_metadata(path: str) -> dict:
+    """
+    Reads the session metadata of a journal without reading its blocks.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the journal.
+
+    Returns
+    -------
+    `dict`
+        The session metadata, or an empty dict for journals written without it.
+    """
+    with open(path, "rb") as file:
+        return _read_file_header(file)[0].get("metadata") or {}
+
+
+def to_csv(path: str, output: str) -> int:
+    """
+    Converts a journal into a CSV session log, with a metadata line declaring the unit of every channel.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the journal.
+    `output` : str
+        Path to the CSV file to write.
+
+    Returns
+    -------
+    `int`
+        The number of rows written.
+    """
+    with open(path, "rb") as file:
+        header = _read_file_header(file)[0]
+    columns = read_journal(path)
+    metadata = header.get("metadata")
+    if not metadata:
+        # without it, readers would take the log for one written before units were recorded
+        metadata = {"channels": [{"name": entry.name, "pid": entry.command, "unit": entry.unit} for entry in CHANNELS if entry.name in columns]}
+    if "timestamp" in columns and metadata.get("start_epoch") is not None:
+        columns["timestamp"] = columns["timestamp"] - metadata["start_epoch"]
+    rows = np.column_stack(list(columns.values())) if columns else np.empty((0, 0))
+    preamble = METADATA_PREFIX + json.dumps(metadata, separators=(",", ":")) + "\n" + ",".join(columns)
+    np.savetxt(output, rows, delimiter=",", header=preamble, comments="", fmt="%.17g")
+    return len(rows)
+
+
+
+
+class Journal:
+    """
+    Append-only, checksummed sample journal with batched `fsync`.
+    """
+    def __init__(self, path: str, columns: tuple[str, ...] = LOG_COLUMNS, block_rows: int = 32, fsync_interval: float = 2.0, metadata: dict = None) -> "Journal":
+        """
+        Opens a journal for appending, creating it if needed. An existing journal is recovered first.
+
+        Parameters
+        ----------
+        `path` : str
+            Path to the journal.
+        `columns` : tuple[str, ...], optional
+            Column names of each row (default is `LOG_COLUMNS`). Must match the columns of an existing journal.
+        `block_rows` : int, optional
+            Number of rows buffered before a block is written (default is `32`).
+        `fsync_interval` : float, optional
+            Minimum number of seconds between two `fsync` calls (default is `2.0`). `0` syncs every block.
+        `metadata` : dict, optional
+            Session metadata stored in the header of a new journal (see `Logs.session.session_metadata`).
+        """
+        self._path = path
+        self._columns = tuple(columns)
+        self._block_rows = block_rows
+        self._fsync_interval = fsync_interval
+        self._rows = []
+        self._dirty = False
+        self._recovered_bytes = 0
+
+        if os.path.exists(path) and os.path.getsize(path) > 0 and not _header_truncated(path):
+            self._recovered_bytes = recover(path)
+            with open(path, "rb") as file:
+                existing = _read_file_header(file)[0]["columns"]
+            if tuple(existing) != self._columns:
+                raise ValueError(f"Journal '{path}' has columns {existing}, expected {list(self._columns)}")
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        else:
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o644)
+            header = json.dumps({"columns": list(self._columns), "created": datetime.now().isoformat(), "metadata": metadata or {}}).encode("utf-8")
+            os.write(self._fd, _FILE_HEADER.pack(FILE_MAGIC, len(header), zlib.crc32(header)) + header)
+            os.fsync(self._fd)
+            self._fsync_directory()
+        self._last_sync = time.monotonic()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+    @property
+    def path(self) -> str:
+        """
+        Path to the journal.
+        """
+        return self._path
+
+    @property
+    def columns(self) -> tuple[str, ...]:
+        """
+        Column names of each row.
+        """
+        return self._columns
+
+    @property
+    def recovered_bytes(self) -> int:
+        """
+        Number of bytes cut off by the recovery scan when the journal was opened.
+        """
+        return self._recovered_bytes
+
+
+    def _fsync_directory(self) -> None:
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY)
+        except OSError:
+            return
+        try: os.fsync(fd)
+        except OSError: pass
+        finally: os.close(fd)
+
+    def append(self, sample: dict) -> None:
+        """
+        Appends one sample. It is written out once a block fills up, or once `fsync_interval` seconds have passed
+        since the last sync, whichever comes first, and synced to disk then.
+
+        Parameters
+        ----------
+        `sample` : dict
+            A sample as returned by `Sonata.sample()`. Missing columns are stored as `nan`.
+        """
+        self._rows.append([sample.get(column, np.nan) for column in self._columns])
+        if len(self._rows) >= self._block_rows:
+            self._write_block()
+        # syncing also writes a partial block, so buffered rows never wait longer than the interval
+        if (self._dirty or self._rows) and time.monotonic() - self._last_sync >= self._fsync_interval:
+            self.sync()
+
+    def _write_block(self) -> None:
+        if not self._rows:
+            return
+        payload = np.asarray(self._rows, dtype="<f8").tobytes()
+        rows = len(self._rows)
+        header = _BLOCK_HEADER.pack(BLOCK_MAGIC, len(payload), rows, _block_crc(len(payload), rows, payload))
+        os.write(self._fd, header + payload)
+        self._rows = []
+        self._dirty = True
+
+    def flush(self) -> None:
+        """
+        Writes any buffered rows as a (possibly short) block, without syncing.
+        """
+        self._write_block()
+
+    def sync(self) -> None:
+        """
+        Writes any buffered rows and forces everything written so far to disk.
+        """
+        self._write_block()
+        os.fsync(self._fd)
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Syncs and closes the journal.
+        """
+        if self._fd is None:
+            return
+        self.sync()
+        os.close(self._fd)
+        self._fd = None
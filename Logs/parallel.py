@@ -0,0 +1,53 @@
+"""
+# parallel.py
+
+Runs a per-file function over many session logs in worker processes, for the batch tools (`Logs.segmentation`,
+`Logs.influx`, `OBDModule.gears`, `OBDModule.opmap`).
+
+A file that cannot be processed does not stop the batch: its result records the error, and the other files are still
+processed.
+"""
+
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+
+
+
+
+def _run(worker, path: str) -> dict:
+    """
+    Applies `worker` to a single file, catching its errors. Runs in a worker process.
+    """
+    try:
+        return {"path": path, "status": "ok", **worker(path)}
+    except Exception as error:
+        return {"path": path, "status": "error", "error": f"{type(error).__name__}: {error}"}
+
+
+def map_files(worker, paths: list[str], workers: int = None):
+    """
+    Applies `worker` to every file of `paths`, in parallel.
+
+    Parameters
+    ----------
+    `worker` : callable
+        Takes the path of a file and returns a dictionary of results. Must be picklable (a module-level function, or a
+        `functools.partial` of one to pass settings).
+    `paths` : list[str]
+        Files to process.
+    `workers` : int, optional
+        Number of worker processes (default is the number of CPUs).
+
+    Yields
+    ------
+    `dict`
+        Per file, in the order of `paths`: its `path`, `status` (`'ok'` or `'error'`), and the results of `worker` or
+        the `error`.
+    """
+    if not paths:
+        return
+    chunksize = max(1, len(paths) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(partial(_run, worker), paths, chunksize=chunksize)
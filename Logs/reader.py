@@ -0,0 +1,267 @@
+"""
+# reader.py
+
+Helpers for reading session logs (the CSV files written by the logger, e.g. `data/2023-05-19_10-48-17.txt`).
+
+A log may start with a session metadata line (`# {...}`, see `Logs.session`) before its CSV header.
+Older logs without one are read the same way.
+
+Values are converted to the units of `OBDModule.channels.CHANNELS` as they are read. The metadata line declares the
+unit of every channel; logs without one were written with the getters' default units (see `LEGACY_UNITS`), which
+differ for `speed` (m/s instead of km/h).
+"""
+
+import re
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from OBDModule.channels import CHANNELS, LOG_COLUMNS
+
+
+
+
+
+SESSION_NAME_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+"""
+Matches the wall-clock start time embedded in a session file name (e.g. `data_2023-05-19_10-47-33.txt`).
+"""
+
+
+METADATA_PREFIX = "# "
+"""
+Prefix of the session metadata line at the start of a log.
+"""
+
+
+LEGACY_UNITS = {"speed": "m/s"}
+"""
+Units of the channels of logs written without a metadata line, where they differ from `CHANNELS`.
+"""
+
+
+UNIT_FACTORS = {
+    ("m/s", "km/h"): 3.6,
+    ("mph", "km/h"): 1.609344,
+    ("ft/s", "km/h"): 1.09728,
+}
+"""
+Factors converting a logged value from one unit to another, keyed by `(from, to)`.
+"""
+
+_UNITS = {entry.name: entry.unit for entry in CHANNELS}
+
+
+
+
+def read_preamble(path: str) -> tuple[dict, tuple[str, ...], int]:
+    """
+    Reads everything before the body of a session log.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the session log.
+
+    Returns
+    -------
+    `tuple[dict, tuple[str, ...], int]`
+        The session metadata (empty for logs written without it), the column names, and the number of lines before the CSV header.
+    """
+    metadata, skipped = {}, 0
+    with open(path, "r", newline="") as file:
+        line = file.readline()
+        while line.startswith("#"):
+            if not metadata and line.startswith(METADATA_PREFIX):
+                try: metadata = json.loads(line[len(METADATA_PREFIX):])
+                except ValueError: metadata = {}
+            skipped += 1
+            line = file.readline()
+    return metadata, tuple(column.strip() for column in line.strip().split(",")), skipped
+
+
+def read_metadata(path: str) -> dict:
+    """
+    Reads the session metadata of a log without reading its body.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the session log.
+
+    Returns
+    -------
+    `dict`
+        The session metadata, or an empty dict for logs written without it.
+    """
+    return read_preamble(path)[0]
+
+
+def session_start(path: str) -> datetime:
+    """
+    Gets the wall-clock start time of a session, from its metadata or else from its file name.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the session log.
+
+    Returns
+    -------
+    `datetime` or `None`
+        The start time of the session, or `None` if neither the metadata nor the file name carry one.
+    """
+    start = read_metadata(path).get("start")
+    if start:
+        return datetime.fromisoformat(start)
+    match = SESSION_NAME_PATTERN.search(str(path).replace("\\", "/").rsplit("/", 1)[-1])
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S")
+
+
+def expected_columns(metadata: dict) -> tuple[str, ...]:
+    """
+    Gets the header a session log should have: `timestamp` followed by the channels declared in its metadata
+    (any subset of `LOG_COLUMNS`, in any order), or `LOG_COLUMNS` for logs written without metadata.
+
+    Parameters
+    ----------
+    `metadata` : dict
+        The session metadata of the log (empty for logs written without it).
+
+    Returns
+    -------
+    `tuple[str, ...]`
+        The expected column names, in file order.
+    """
+    declared = tuple(entry["name"] for entry in metadata.get("channels", ()))
+    if declared and len(set(declared)) == len(declared) and all(name in LOG_COLUMNS[1:] for name in declared):
+        return ("timestamp",) + declared
+    return LOG_COLUMNS
+
+
+def log_units(metadata: dict, columns: tuple[str, ...]) -> dict[str, str]:
+    """
+    Gets the unit every channel of a log was written in.
+
+    Parameters
+    ----------
+    `metadata` : dict
+        The session metadata of the log (empty for logs written without it).
+    `columns` : tuple[str, ...]
+        The column names of the log.
+
+    Returns
+    -------
+    `dict[str, str]`
+        The unit of each known channel column, keyed by column name.
+    """
+    declared = {entry["name"]: entry.get("unit") for entry in metadata.get("channels", ())}
+    units = {}
+    for column in columns:
+        if column not in _UNITS:
+            continue
+        if column in declared and declared[column]:
+            units[column] = declared[column]
+        elif not metadata:
+            units[column] = LEGACY_UNITS.get(column, _UNITS[column])
+        else:
+            units[column] = _UNITS[column]
+    return units
+
+
+def conversion_factors(metadata: dict, columns: tuple[str, ...]) -> dict[str, float]:
+    """
+    Gets the factors that bring the channels of a log to the units of `CHANNELS`.
+
+    Returns
+    -------
+    `dict[str, float]`
+        The factor of each column that needs converting (empty if the log is already in the current units).
+    """
+    factors = {}
+    for column, unit in log_units(metadata, columns).items():
+        if unit == _UNITS[column]:
+            continue
+        factor = UNIT_FACTORS.get((unit, _UNITS[column]))
+        if factor is None:
+            raise ValueError(f"Cannot convert '{column}' from {unit} to {_UNITS[column]}")
+        factors[column] = factor
+    return factors
+
+
+def read_header(path: str) -> tuple[str, ...]:
+    """
+    Reads the column names of a session log without reading its body.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the session log.
+
+    Returns
+    -------
+    `tuple[str, ...]`
+        The column names, in file order.
+    """
+    return read_preamble(path)[1]
+
+
+def read_log(path: str, check_schema: bool = True, convert_units: bool = True) -> pd.DataFrame:
+    """
+    Reads a session log into a DataFrame.
+
+    Every column is parsed as `float64` so that logs which happened to record a channel as integers (e.g. `intake_manifold_pressure`)
+    have the same schema as the rest.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the session log.
+    `check_schema` : bool, optional
+        Whether to raise a `ValueError` if the header does not match `LOG_COLUMNS`, or the channels declared in the
+        session metadata (see `expected_columns`). Default is `True`.
+    `convert_units` : bool, optional
+        Whether to convert every channel to the unit of `CHANNELS` (default is `True`), see `log_units`.
+
+    Returns
+    -------
+    `pd.DataFrame`
+        The session, one row per sample.
+    """
+    metadata, columns, skipped = read_preamble(path)
+    expected = expected_columns(metadata)
+    if check_schema and columns != expected:
+        missing = [column for column in expected if column not in columns]
+        extra = [column for column in columns if column not in expected]
+        raise ValueError(f"Unexpected log schema in '{path}' (missing: {missing}, extra: {extra})")
+    df = pd.read_csv(path, dtype=np.float64, engine="c", skiprows=skipped)
+    if convert_units:
+        for column, factor in conversion_factors(metadata, columns).items():
+            df[column] *= factor
+    return df
+
+
+def read_arrays(path: str, check_schema: bool = True, convert_units: bool = True) -> dict[str, np.ndarray]:
+    """
+    Reads a session log into one contiguous `float64` array per column.
+
+    Parameters
+    ----------
+    `path` : str
+        Path to the session log.
+    `check_schema` : bool, optional
+        Whether to raise a `ValueError` if the header does not match `LOG_COLUMNS`, or the channels declared in the
+        session metadata (see `expected_columns`). Default is `True`.
+    `convert_units` : bool, optional
+        Whether to convert every channel to the unit of `CHANNELS` (default is `True`).
+
+    Returns
+    -------
+    `dict[str, np.ndarray]`
+        The columns of the session, keyed by column name.
+    """
+    df = read_log(path, check_schema=check_schema, convert_units=convert_units)
+    return {column: np.ascontiguousarray(df[column].to_numpy(dtype=np.float64)) for column in df.columns}
@@ -0,0 +1,281 @@
+"""
+# resample.py
+
+Aligns irregularly timed samples (about every 0.34 s, with jitter) to a uniform time grid, so that trips can be
+compared point by point and fed to FFTs or cross-correlations.
+
+Three interpolations are available: zero-order hold (`'hold'`, the last known value), `'linear'`, and `'cubic'`
+(cubic Hermite, with slopes from the neighbouring samples). Grid points that fall in a gap longer than `max_gap`
+are left missing instead of being bridged. The grid is aligned to multiples of the period, so grids of different
+trips line up. `resample_arrays` works on whole log arrays; `StreamingResampler` does the same sample by sample.
+"""
+
+import math
+import numpy as np
+
+
+
+
+
+METHODS = ("hold", "linear", "cubic")
+
+
+
+
+def make_grid(start: float, end: float, period: float) -> np.ndarray:
+    """
+    Builds the grid points between `start` and `end` (inclusive) that are multiples of `period`.
+    """
+    first = math.ceil(start / period - 1e-9)
+    last = math.floor(end / period + 1e-9)
+    return np.arange(first, last + 1, dtype=np.float64) * period
+
+
+def _slopes(time: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Slopes of the cubic interpolation: centered differences inside, one-sided at both ends.
+    """
+    slopes = np.empty_like(values)
+    if len(values) < 2:
+        slopes[:] = 0.0
+        return slopes
+    slopes[1:-1] = (values[2:] - values[:-2]) / (time[2:] - time[:-2])
+    slopes[0] = (values[1] - values[0]) / (time[1] - time[0])
+    slopes[-1] = (values[-1] - values[-2]) / (time[-1] - time[-2])
+    return slopes
+
+
+def _hermite(y1, y2, m1, m2, h, u):
+    u2 = u * u
+    u3 = u2 * u
+    return (2 * u3 - 3 * u2 + 1) * y1 + (u3 - 2 * u2 + u) * h * m1 + (-2 * u3 + 3 * u2) * y2 + (u3 - u2) * h * m2
+
+
+def resample(time: np.ndarray, values: np.ndarray, grid: np.ndarray, method: str = "linear", max_gap: float = None) -> np.ndarray:
+    """
+    Interpolates one channel onto a grid.
+
+    Parameters
+    ----------
+    `time` : np.ndarray
+        Sample times, increasing.
+    `values` : np.ndarray
+        Values of the channel. Missing (`nan`) values are skipped.
+    `grid` : np.ndarray
+        Times to interpolate at.
+    `method` : str, optional
+        `'hold'`, `'linear'` (default) or `'cubic'`.
+    `max_gap` : float, optional
+        Grid points between two valid samples further apart than this (seconds) are left missing.
+
+    Returns
+    -------
+    `np.ndarray`
+        The values at the grid points (`nan` outside the samples' time range and in gaps).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}' (expected one of {METHODS})")
+    time = np.asarray(time, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    grid = np.asarray(grid, dtype=np.float64)
+    valid = ~np.isnan(values)
+    time, values = time[valid], values[valid]
+    result = np.full(len(grid), np.nan)
+    if len(time) == 0:
+        return result
+    if len(time) == 1:
+        result[grid == time[0]] = values[0]
+        return result
+
+    inside = (grid >= time[0]) & (grid <= time[-1])
+    g = grid[inside]
+    i = np.clip(np.searchsorted(time, g, side="right") - 1, 0, len(time) - 2)
+    h = time[i + 1] - time[i]
+    u = (g - time[i]) / h
+    if method == "hold":
+        out = np.where(u >= 1, values[i + 1], values[i])
+    elif method == "linear":
+        out = values[i] + u * (values[i + 1] - values[i])
+    else:
+        slopes = _slopes(time, values)
+        out = _hermite(values[i], values[i + 1], slopes[i], slopes[i + 1], h, u)
+    if max_gap is not None:
+        out[(h > max_gap) & (u > 0) & (u < 1)] = np.nan
+    result[inside] = out
+    return result
+
+
+def resample_arrays(columns: dict, period: float = 0.25, method: str = "linear", max_gap: float = 2.0, start: float = None, end: float = None) -> dict[str, np.ndarray]:
+    """
+    Resamples every channel of a log onto one uniform grid.
+
+    Parameters
+    ----------
+    `columns` : dict[str, np.ndarray]
+        Log columns, as returned by `Logs.reader.read_arrays` (with `timestamp`).
+    `period` : float, optional
+        Spacing of the grid, in seconds (default is `0.25`).
+    `method` : str, optional
+        `'hold'`, `'linear'` (default) or `'cubic'`.
+    `max_gap` : float, optional
+        Gaps longer than this (seconds) are not bridged (default is `2.0`; `None` bridges everything).
+    `start`, `end` : float, optional
+        Range of the grid (default is the range of the timestamps).
+
+    Returns
+    -------
+    `dict[str, np.ndarray]`
+        `timestamp` (the grid) and every channel on it.
+    """
+    time = np.asarray(columns["timestamp"], dtype=np.float64)
+    if not len(time):
+        return {name: np.empty(0) for name in columns}
+    grid = make_grid(time[0] if start is None else start, time[-1] if end is None else end, period)
+    result = {"timestamp": grid}
+    for name, values in columns.items():
+        if name != "timestamp":
+            result[name] = resample(time, values, grid, method, max_gap)
+    return result
+
+
+def gap_statistics(time: np.ndarray, max_gap: float = 2.0) -> dict:
+    """
+    Describes the timing of a sample stream.
+
+    Parameters
+    ----------
+    `time` : np.ndarray
+        Sample times, in seconds.
+    `max_gap` : float, optional
+        Intervals longer than this (seconds) count as gaps (default is `2.0`).
+
+    Returns
+    -------
+    `dict`
+        `samples`, `duration`, `median_interval`, `mean_interval`, `jitter` (standard deviation of the intervals),
+        `max_interval`, `gaps` (count), `gap_time` (seconds spent in gaps) and `coverage` (fraction not in gaps).
+    """
+    time = np.asarray(time, dtype=np.float64)
+    intervals = np.diff(time)
+    if not len(intervals):
+        return {"samples": len(time), "duration": 0.0, "median_interval": math.nan, "mean_interval": math.nan, "jitter": math.nan,
+                "max_interval": math.nan, "gaps": 0, "gap_time": 0.0, "coverage": 1.0 if len(time) else 0.0}
+    gaps = intervals > max_gap
+    duration = float(time[-1] - time[0])
+    gap_time = float(intervals[gaps].sum())
+    return {
+        "samples": len(time),
+        "duration": duration,
+        "median_interval": float(np.median(intervals)),
+        "mean_interval": float(intervals.mean()),
+        "jitter": float(intervals.std()),
+        "max_interval": float(intervals.max()),
+        "gaps": int(gaps.sum()),
+        "gap_time": gap_time,
+        "coverage": 1 - gap_time / duration if duration > 0 else 1.0,
+    }
+
+
+
+
+class StreamingResampler:
+    """
+    Resamples live samples onto a uniform grid, emitting grid points as soon as they can be computed.
+
+    `'hold'` and `'linear'` emit the points before each new sample as it arrives; `'cubic'` needs one more sample
+    and lags by one. Unlike `resample`, a missing value makes the intervals next to it missing for that channel,
+    rather than being interpolated across.
+    """
+    def __init__(self, period: float = 0.25, method: str = "linear", max_gap: float = 2.0, channels: list[str] = None) -> "StreamingResampler":
+        """
+        Parameters
+        ----------
+        `period` : float, optional
+            Spacing of the grid, in seconds (default is `0.25`).
+        `method` : str, optional
+            `'hold'`, `'linear'` (default) or `'cubic'`.
+        `max_gap` : float, optional
+            Gaps longer than this (seconds) are not bridged (default is `2.0`; `None` bridges everything).
+        `channels` : list[str], optional
+            Channels to resample (default is every channel of the first sample).
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown method '{method}' (expected one of {METHODS})")
+        self._period = period
+        self._method = method
+        self._max_gap = max_gap
+        self._channels = list(channels) if channels is not None else None
+        self._history = []
+        self._next = None
+        self.emitted = 0
+
+    def _emit(self, first: int, end: float, inclusive: bool = False) -> list[dict]:
+        """
+        Emits the grid points from `self._next` up to `end`, inside the interval that starts at `self._history[first]`.
+        """
+        t1, y1 = self._history[first]
+        t2, y2 = self._history[first + 1] if first + 1 < len(self._history) else (t1, y1)
+        times = []
+        while self._next < end or (inclusive and self._next <= end + 1e-9):
+            times.append(self._next)
+            self.emitted += 1
+            self._next = (round(self._next / self._period) + 1) * self._period
+        if not times:
+            return []
+        g = np.array(times)
+        h = t2 - t1
+        u = (g - t1) / h if h > 0 else np.zeros(len(g))
+        if self._method == "hold":
+            out = np.where(u[:, None] >= 1, y2, y1)
+        elif self._method == "linear":
+            out = y1 + u[:, None] * (y2 - y1)
+        else:
+            points = self._history
+            t0, y0 = points[first - 1] if first > 0 else (t1, y1)
+            t3, y3 = points[first + 2] if first + 2 < len(points) else (t2, y2)
+            m1 = (y2 - y0) / (t2 - t0) if first > 0 else (y2 - y1) / h
+            m2 = (y3 - y1) / (t3 - t1) if first + 2 < len(points) else (y2 - y1) / h
+            out = _hermite(y1, y2, m1, m2, h, u[:, None])
+        if self._max_gap is not None and h > self._max_gap:
+            out[(u > 0) & (u < 1)] = np.nan
+        return [{"timestamp": t, **dict(zip(self._channels, row.tolist()))} for t, row in zip(times, out)]
+
+    def update(self, sample: dict) -> list[dict]:
+        """
+        Adds a sample (as returned by `Sonata.sample()`, times increasing).
+
+        Returns
+        -------
+        `list[dict]`
+            The grid points that became computable, oldest first (usually zero to two).
+        """
+        if self._channels is None:
+            self._channels = [name for name in sample if name != "timestamp"]
+        time = float(sample["timestamp"])
+        values = np.array([sample.get(name, np.nan) for name in self._channels], dtype=np.float64)
+        if self._next is None:
+            self._next = math.ceil(time / self._period - 1e-9) * self._period
+        self._history.append((time, values))
+        if self._method == "cubic":
+            if len(self._history) > 4:
+                del self._history[0]
+            if len(self._history) < 3:
+                return []
+            first = len(self._history) - 3
+            return self._emit(first, self._history[first + 1][0])
+        if len(self._history) > 2:
+            del self._history[0]
+        if len(self._history) < 2:
+            return []
+        return self._emit(0, time)
+
+    def flush(self) -> list[dict]:
+        """
+        Emits the remaining grid points up to the last sample (e.g. at the end of a trip).
+        """
+        if not self._history:
+            return []
+        if len(self._history) == 1:
+            return self._emit(0, self._history[0][0], inclusive=True)
+        first = len(self._history) - 2
+        return self._emit(first, self._history[-1][0], inclusive=True)
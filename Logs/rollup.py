@@ -0,0 +1,371 @@
+"""
+# rollup.py
+
+Defines the RollupPyramid class, which keeps min / max / mean / count aggregates of every channel at several
+time resolutions (1 s, 10 s, 1 min and 10 min by default), so that charts over long time ranges can be drawn
+without reading every raw sample.
+
+The pyramid is fed live with the samples returned by `Sonata.sample()` / `SonataAsync.sample()`, or rebuilt
+from existing session logs with `RollupPyramid.from_logs()`.
+"""
+
+import numpy as np
+
+from Logs.reader import read_arrays, session_start
+from OBDModule.channels import CHANNELS
+
+
+
+
+
+RESOLUTIONS = (1, 10, 60, 600)
+"""
+Default bucket widths of the pyramid levels, in seconds (finest first).
+"""
+
+
+
+
+class _Buckets:
+    """
+    Growable, columnar storage for the closed buckets of one pyramid level (one column per channel).
+    """
+    def __init__(self, channels: int, retention: int = None) -> "_Buckets":
+        self.size = 0
+        self.retention = retention
+        self.start = np.empty(64, dtype=np.float64)
+        self.min = np.empty((64, channels), dtype=np.float64)
+        self.max = np.empty((64, channels), dtype=np.float64)
+        self.sum = np.empty((64, channels), dtype=np.float64)
+        self.count = np.empty((64, channels), dtype=np.int64)
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.size + extra
+        if needed <= len(self.start):
+            return
+        capacity = max(needed, 2 * len(self.start))
+        for name in ("start", "min", "max", "sum", "count"):
+            array = getattr(self, name)
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+
+    def extend(self, start: np.ndarray, minimum: np.ndarray, maximum: np.ndarray, total: np.ndarray, count: np.ndarray) -> None:
+        if len(start) and self.size and start[0] == self.start[self.size - 1]:
+            # the first new bucket continues the last stored one (e.g. two logs sharing a bucket)
+            last = self.size - 1
+            self.min[last] = np.fmin(self.min[last], minimum[0])
+            self.max[last] = np.fmax(self.max[last], maximum[0])
+            self.sum[last] += total[0]
+            self.count[last] += count[0]
+            start, minimum, maximum, total, count = start[1:], minimum[1:], maximum[1:], total[1:], count[1:]
+        self._reserve(len(start))
+        end = self.size + len(start)
+        self.start[self.size:end] = start
+        self.min[self.size:end] = minimum
+        self.max[self.size:end] = maximum
+        self.sum[self.size:end] = total
+        self.count[self.size:end] = count
+        self.size = end
+        if self.retention is not None and self.size > 2 * self.retention:
+            # drop the oldest buckets in one go, so trimming stays amortized O(1) per bucket
+            keep = self.retention
+            for name in ("start", "min", "max", "sum", "count"):
+                array = getattr(self, name)
+                array[:keep] = array[self.size - keep:self.size]
+            self.size = keep
+
+
+
+
+def _reduce(keys: np.ndarray, minimum: np.ndarray, maximum: np.ndarray, total: np.ndarray, count: np.ndarray) -> tuple:
+    """
+    Aggregates consecutive rows that share the same bucket key. Rows must be in time order.
+    """
+    edges = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], edges))
+    return (
+        keys[starts],
+        np.minimum.reduceat(minimum, starts, axis=0),
+        np.maximum.reduceat(maximum, starts, axis=0),
+        np.add.reduceat(total, starts, axis=0),
+        np.add.reduceat(count, starts, axis=0),
+    )
+
+
+
+
+class RollupPyramid:
+    """
+    Multi-resolution min / max / mean / count aggregates of a set of channels.
+
+    Only the finest level sees raw samples; each time one of its buckets closes, the bucket is merged into the
+    next coarser level, and so on. Feeding a sample is therefore O(number of channels), independent of history length.
+    """
+    def __init__(self, channels: list[str] = None, resolutions: tuple[int, ...] = RESOLUTIONS, retention: dict[int, int] = None) -> "RollupPyramid":
+        """
+        Parameters
+        ----------
+        `channels` : list[str], optional
+            Names of the channels to aggregate (default is every logged channel).
+        `resolutions` : tuple[int, ...], optional
+            Bucket widths in seconds, finest first. Each must be a multiple of the previous one (default is `RESOLUTIONS`).
+        `retention` : dict[int, int], optional
+            Maximum number of closed buckets to keep per resolution (default is to keep everything).
+        """
+        for finer, coarser in zip(resolutions, resolutions[1:]):
+            if coarser % finer:
+                raise ValueError(f"Resolution {coarser} s is not a multiple of {finer} s")
+        self._channels = list(channels) if channels is not None else [entry.name for entry in CHANNELS]
+        self._index = {name: i for i, name in enumerate(self._channels)}
+        self._resolutions = tuple(resolutions)
+        retention = retention or {}
+        self._levels = [_Buckets(len(self._channels), retention.get(resolution)) for resolution in self._resolutions]
+
+        n = len(self._channels)
+        self._open_start = [None] * len(self._resolutions)
+        self._open_min = [np.full(n, np.inf) for _ in self._resolutions]
+        self._open_max = [np.full(n, -np.inf) for _ in self._resolutions]
+        self._open_sum = [np.zeros(n) for _ in self._resolutions]
+        self._open_count = [np.zeros(n, dtype=np.int64) for _ in self._resolutions]
+
+
+    @property
+    def channels(self) -> list[str]:
+        """
+        Names of the aggregated channels.
+        """
+        return self._channels
+
+    @property
+    def resolutions(self) -> tuple[int, ...]:
+        """
+        Bucket widths of the pyramid levels, in seconds (finest first).
+        """
+        return self._resolutions
+
+
+    def _merge(self, level: int, start: float, minimum: np.ndarray, maximum: np.ndarray, total: np.ndarray, count: np.ndarray) -> None:
+        bucket = (start // self._resolutions[level]) * self._resolutions[level]
+        if self._open_start[level] is not None and bucket != self._open_start[level]:
+            self._close(level)
+        if self._open_start[level] is None:
+            self._open_start[level] = bucket
+        np.fmin(self._open_min[level], minimum, out=self._open_min[level])
+        np.fmax(self._open_max[level], maximum, out=self._open_max[level])
+        self._open_sum[level] += total
+        self._open_count[level] += count
+
+    def _close(self, level: int) -> None:
+        start = self._open_start[level]
+        minimum, maximum, total, count = self._open_min[level], self._open_max[level], self._open_sum[level], self._open_count[level]
+        self._levels[level].extend(np.array([start]), minimum[None], maximum[None], total[None], count[None])
+        if level + 1 < len(self._resolutions):
+            self._merge(level + 1, start, minimum, maximum, total, count)
+        self._open_start[level] = None
+        minimum.fill(np.inf)
+        maximum.fill(-np.inf)
+        total.fill(0)
+        count.fill(0)
+
+
+    def feed(self, sample: dict) -> None:
+        """
+        Adds one sample to the pyramid.
+
+        Parameters
+        ----------
+        `sample` : dict
+            A sample as returned by `Sonata.sample()`: `timestamp` in seconds since the epoch, plus channel values keyed by name.
+            Missing or `nan` channel values are ignored.
+        """
+        values = np.array([sample.get(name, np.nan) for name in self._channels], dtype=np.float64)
+        valid = ~np.isnan(values)
+        self._merge(0, float(sample["timestamp"]), values, values, np.where(valid, values, 0.0), valid.astype(np.int64))
+
+    def flush(self) -> None:
+        """
+        Closes the open bucket of every level (e.g. at the end of a session).
+        """
+        for level in range(len(self._resolutions)):
+            if self._open_start[level] is not None:
+                self._close(level)
+
+
+    def add_arrays(self, time: np.ndarray, columns: dict[str, np.ndarray]) -> None:
+        """
+        Adds a block of samples to the pyramid at once (vectorized). The block must come after everything already in the pyramid.
+
+        Parameters
+        ----------
+        `time` : np.ndarray
+            Sample times, in seconds since the epoch, in increasing order.
+        `columns` : dict[str, np.ndarray]
+            Channel values, keyed by channel name. Channels of the pyramid that are missing are treated as `nan`.
+        """
+        if len(time) == 0:
+            return
+        self.flush()
+        values = np.column_stack([np.asarray(columns[name], dtype=np.float64) if name in columns else np.full(len(time), np.nan) for name in self._channels])
+        valid = ~np.isnan(values)
+        minimum = np.where(valid, values, np.inf)
+        maximum = np.where(valid, values, -np.inf)
+        total = np.where(valid, values, 0.0)
+        count = valid.astype(np.int64)
+        keys = np.asarray(time, dtype=np.float64)
+        for level, resolution in enumerate(self._resolutions):
+            keys = (keys // resolution) * resolution
+            keys, minimum, maximum, total, count = _reduce(keys, minimum, maximum, total, count)
+            self._levels[level].extend(keys, minimum, maximum, total, count)
+
+    @classmethod
+    def from_logs(cls, paths: list[str], **kwargs) -> "RollupPyramid":
+        """
+        Builds a pyramid from existing session logs.
+
+        Parameters
+        ----------
+        `paths` : list[str]
+            Paths to the session logs. Each must carry its start time, in its metadata (`start`)
+            or in its file name (see `Logs.reader.session_start`).
+        `**kwargs`
+            Passed to the `RollupPyramid` constructor.
+
+        Returns
+        -------
+        `RollupPyramid`
+            The rebuilt pyramid.
+        """
+        pyramid = cls(**kwargs)
+        sessions = []
+        for path in paths:
+            start = session_start(path)
+            if start is None:
+                raise ValueError(f"Cannot tell the start time of '{path}' from its metadata or its name")
+            sessions.append((start, path))
+        for start, path in sorted(sessions):
+            columns = read_arrays(path)
+            pyramid.add_arrays(start.timestamp() + columns["timestamp"], columns)
+        return pyramid
+
+
+    def level_for(self, start: float, end: float, pixels: int) -> int:
+        """
+        Picks the coarsest level whose buckets are still no wider than one pixel.
+
+        Parameters
+        ----------
+        `start` : float
+            Start of the requested range, in seconds since the epoch.
+        `end` : float
+            End of the requested range, in seconds since the epoch.
+        `pixels` : int
+            Horizontal resolution of the chart.
+
+        Returns
+        -------
+        `int`
+            The index of the level to use (`0` is the finest).
+        """
+        seconds_per_pixel = (end - start) / max(pixels, 1)
+        level = 0
+        for i, resolution in enumerate(self._resolutions):
+            if resolution <= seconds_per_pixel:
+                level = i
+        return level
+
+    def query(self, channel: str, start: float, end: float, pixels: int = None, level: int = None) -> dict[str, np.ndarray]:
+        """
+        Gets the aggregates of one channel over a time range.
+
+        Parameters
+        ----------
+        `channel` : str
+            Name of the channel.
+        `start` : float
+            Start of the range, in seconds since the epoch.
+        `end` : float
+            End of the range, in seconds since the epoch.
+        `pixels` : int, optional
+            Horizontal resolution of the chart; used to pick the level automatically (see `level_for`).
+        `level` : int, optional
+            Index of the level to read from, overriding `pixels`. Default is the finest level if neither is given.
+
+        Returns
+        -------
+        `dict[str, np.ndarray]`
+            `time` (bucket start), `min`, `max`, `mean` and `count` arrays, plus the chosen `resolution` in seconds.
+            Apart from `mean`, the arrays are views into the pyramid when the range does not reach the still-open bucket.
+        """
+        if level is None:
+            level = self.level_for(start, end, pixels) if pixels else 0
+        c = self._index[channel]
+        buckets = self._levels[level]
+        resolution = self._resolutions[level]
+        lo = np.searchsorted(buckets.start[:buckets.size], start - resolution, side="right")
+        hi = np.searchsorted(buckets.start[:buckets.size], end, side="right")
+        result = {
+            "time": buckets.start[lo:hi],
+            "min": buckets.min[lo:hi, c],
+            "max": buckets.max[lo:hi, c],
+            "sum": buckets.sum[lo:hi, c],
+            "count": buckets.count[lo:hi, c],
+        }
+        open_start = self._open_start[level]
+        if open_start is not None and start - resolution < open_start <= end:
+            result["time"] = np.append(result["time"], open_start)
+            result["min"] = np.append(result["min"], self._open_min[level][c])
+            result["max"] = np.append(result["max"], self._open_max[level][c])
+            result["sum"] = np.append(result["sum"], self._open_sum[level][c])
+            result["count"] = np.append(result["count"], self._open_count[level][c])
+        count = result.pop("count")
+        total = result.pop("sum")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result["mean"] = np.where(count > 0, total / count, np.nan)
+        empty = count == 0
+        if empty.any():
+            result["min"] = np.where(empty, np.nan, result["min"])
+            result["max"] = np.where(empty, np.nan, result["max"])
+        result["count"] = count
+        result["resolution"] = resolution
+        return result
+
+
+    def save(self, path: str) -> None:
+        """
+        Saves the closed buckets of every level to a `.npz` file. Open buckets are flushed first.
+
+        Parameters
+        ----------
+        `path` : str
+            Path to the output file.
+        """
+        self.flush()
+        arrays = {"channels": np.array(self._channels), "resolutions": np.array(self._resolutions)}
+        for level, buckets in enumerate(self._levels):
+            for name in ("start", "min", "max", "sum", "count"):
+                arrays[f"{level}_{name}"] = getattr(buckets, name)[:buckets.size]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str, retention: dict[int, int] = None) -> "RollupPyramid":
+        """
+        Loads a pyramid saved with `save`.
+
+        Parameters
+        ----------
+        `path` : str
+            Path to the `.npz` file.
+        `retention` : dict[int, int], optional
+            Maximum number of closed buckets to keep per resolution (default is to keep everything).
+
+        Returns
+        -------
+        `RollupPyramid`
+            The loaded pyramid.
+        """
+        with np.load(path) as arrays:
+            pyramid = cls([str(name) for name in arrays["channels"]], tuple(int(r) for r in arrays["resolutions"]), retention)
+            for level, buckets in enumerate(pyramid._levels):
+                buckets.extend(*(arrays[f"{level}_{name}"] for name in ("start", "min", "max", "sum", "count")))
+        return pyramid
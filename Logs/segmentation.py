@@ -0,0 +1,239 @@
+"""
+# segmentation.py
+
+Labels every sample of a trip with a driving state (engine off, idle, fuel cut, decelerate, accelerate, cruise),
+splits the trip into segments of constant state and summarizes them. Everything is vectorized with NumPy over the
+log arrays; batches of logs are processed in parallel worker processes.
+
+Usage:
+    `python -m Logs.segmentation <directory> [<directory> ...] [--workers N]`
+"""
+
+import argparse
+import numpy as np
+from functools import partial
+from collections import namedtuple
+
+from Logs.ingest import discover
+from Logs.parallel import map_files
+from Logs.reader import read_arrays
+
+
+
+
+
+ENGINE_OFF, IDLE, FUEL_CUT, DECELERATE, ACCELERATE, CRUISE = range(6)
+
+STATES = ("engine_off", "idle", "fuel_cut", "decelerate", "accelerate", "cruise")
+"""
+Names of the states, indexed by their label.
+"""
+
+
+Thresholds = namedtuple(
+    "Thresholds",
+    ["running_rpm", "moving_speed", "acceleration", "smoothing", "fuel_cut_load", "fuel_cut_rpm", "closed_throttle_margin", "max_gap"],
+    defaults=(300.0, 2.0, 1.5, 2.0, 5.0, 1100.0, 1.5, 5.0),
+)
+"""
+Thresholds of the segmentation.
+
+- `running_rpm`: Below this RPM (or without RPM), the engine counts as off.
+- `moving_speed`: Below this speed (km/h), the vehicle counts as stopped.
+- `acceleration`: Smoothed acceleration (km/h per second) past which the vehicle accelerates or decelerates.
+- `smoothing`: Width of the moving average applied to the acceleration, in seconds.
+- `fuel_cut_load`: Calculated engine load (%) below which a closed-throttle deceleration counts as a fuel cut.
+- `fuel_cut_rpm`: Minimum RPM of a fuel cut (the ECU resumes fueling close to idle).
+- `closed_throttle_margin`: Throttle positions within this many points of the trip's closed position count as closed.
+- `max_gap`: Intervals longer than this (seconds) are not counted in the durations of the summary.
+"""
+
+
+
+
+def acceleration(time: np.ndarray, speed: np.ndarray, smoothing: float = 2.0) -> np.ndarray:
+    """
+    Computes the smoothed longitudinal acceleration.
+
+    Parameters
+    ----------
+    `time` : np.ndarray
+        Sample times, in seconds.
+    `speed` : np.ndarray
+        Vehicle speed, in km/h (missing values are interpolated).
+    `smoothing` : float, optional
+        Width of the moving average, in seconds (default is `2.0`).
+
+    Returns
+    -------
+    `np.ndarray`
+        The acceleration, in km/h per second. Samples whose time does not advance (duplicate timestamps) get the
+        acceleration of the last one that did; it is `nan` everywhere if time never advances.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    speed = np.asarray(speed, dtype=np.float64)
+    if len(time) < 2:
+        return np.zeros(len(time))
+    valid = ~np.isnan(speed)
+    if not valid.any():
+        return np.zeros(len(time))
+    # only samples later than every one before them, so that no interval is zero or negative
+    advancing = np.concatenate(([True], time[1:] > np.maximum.accumulate(time)[:-1]))
+    if advancing.sum() < 2:
+        return np.full(len(time), np.nan)
+    kept = np.flatnonzero(advancing)
+    t = time[kept]
+    kept_valid = valid[kept]
+    if not kept_valid.any():
+        return np.zeros(len(time))
+    v = np.interp(t, t[kept_valid], speed[kept][kept_valid])
+    gradient = np.gradient(v, t)
+    width = max(1, int(round(smoothing / np.median(np.diff(t)))))
+    if width > 1:
+        gradient = np.convolve(gradient, np.ones(width) / width, mode="same")
+    return gradient[np.cumsum(advancing) - 1]
+
+
+def label(columns: dict, thresholds: Thresholds = Thresholds()) -> np.ndarray:
+    """
+    Labels every sample with its driving state.
+
+    Parameters
+    ----------
+    `columns` : dict[str, np.ndarray]
+        Log columns (as returned by `Logs.reader.read_arrays`): `timestamp`, `speed`, `rpm`, `absolute_throttle_pos`
+        and `calculated_engine_load`.
+    `thresholds` : Thresholds, optional
+        Thresholds of the segmentation.
+
+    Returns
+    -------
+    `np.ndarray`
+        One label per sample (`uint8`, see `STATES`).
+    """
+    speed = np.nan_to_num(np.asarray(columns["speed"], dtype=np.float64))
+    rpm = np.asarray(columns["rpm"], dtype=np.float64)
+    throttle = np.asarray(columns["absolute_throttle_pos"], dtype=np.float64)
+    load = np.asarray(columns["calculated_engine_load"], dtype=np.float64)
+    accel = acceleration(columns["timestamp"], columns["speed"], thresholds.smoothing)
+
+    running = rpm >= thresholds.running_rpm                             # False where rpm is nan
+    moving = speed >= thresholds.moving_speed
+    closed = throttle <= np.nanmin(throttle) + thresholds.closed_throttle_margin if np.isfinite(throttle).any() else np.zeros(len(speed), dtype=bool)
+    fuel_cut = moving & closed & (load < thresholds.fuel_cut_load) & (rpm >= thresholds.fuel_cut_rpm)
+
+    labels = np.full(len(speed), CRUISE, dtype=np.uint8)
+    labels[accel >= thresholds.acceleration] = ACCELERATE
+    labels[accel <= -thresholds.acceleration] = DECELERATE
+    labels[fuel_cut] = FUEL_CUT
+    labels[~moving] = IDLE
+    labels[~running] = ENGINE_OFF
+    return labels
+
+
+def segments(time: np.ndarray, labels: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Splits labelled samples into runs of constant state.
+
+    Returns
+    -------
+    `dict[str, np.ndarray]`
+        Per segment: `state` (label), `first` and `last` sample index, and `start` / `end` times.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    if not len(labels):
+        empty = np.empty(0, dtype=np.int64)
+        return {"state": np.empty(0, dtype=np.uint8), "first": empty, "last": empty, "start": np.empty(0), "end": np.empty(0)}
+    boundaries = np.flatnonzero(np.diff(labels)) + 1
+    first = np.concatenate(([0], boundaries))
+    last = np.concatenate((boundaries - 1, [len(labels) - 1]))
+    # a segment lasts until the next one starts
+    end = np.concatenate((time[boundaries], [time[-1]]))
+    return {"state": labels[first], "first": first, "last": last, "start": time[first], "end": end}
+
+
+def summarize(columns: dict, labels: np.ndarray = None, thresholds: Thresholds = Thresholds()) -> dict[str, dict]:
+    """
+    Summarizes a trip per driving state.
+
+    Parameters
+    ----------
+    `columns` : dict[str, np.ndarray]
+        Log columns (see `label`).
+    `labels` : np.ndarray, optional
+        Labels from `label` (computed if not given).
+    `thresholds` : Thresholds, optional
+        Thresholds of the segmentation.
+
+    Returns
+    -------
+    `dict[str, dict]`
+        Per state name: `segments` (count), `duration` (seconds), `fraction` (of the trip's duration),
+        `distance_km` and `mean_speed` (km/h).
+    """
+    time = np.asarray(columns["timestamp"], dtype=np.float64)
+    if labels is None:
+        labels = label(columns, thresholds)
+    speed = np.nan_to_num(np.asarray(columns["speed"], dtype=np.float64))
+    # each interval is credited to the state of the sample that starts it
+    dt = np.diff(time, append=time[-1] if len(time) else 0.0)
+    dt[(dt < 0) | (dt > thresholds.max_gap)] = 0.0
+    duration = np.bincount(labels, weights=dt, minlength=len(STATES))
+    distance = np.bincount(labels, weights=speed * dt / 3600, minlength=len(STATES))
+    count = np.bincount(segments(time, labels)["state"], minlength=len(STATES))
+    total = duration.sum()
+    return {
+        name: {
+            "segments": int(count[i]),
+            "duration": float(duration[i]),
+            "fraction": float(duration[i] / total) if total > 0 else 0.0,
+            "distance_km": float(distance[i]),
+            "mean_speed": float(distance[i] / duration[i] * 3600) if duration[i] > 0 else 0.0,
+        }
+        for i, name in enumerate(STATES)
+    }
+
+
+def _summarize_file(path: str, thresholds: Thresholds) -> dict:
+    """
+    Segments a single session log. Runs in a worker process.
+    """
+    return {"states": summarize(read_arrays(path), thresholds=thresholds)}
+
+
+def summarize_logs(roots: list[str], thresholds: Thresholds = Thresholds(), workers: int = None) -> list[dict]:
+    """
+    Segments every session log below `roots`, in parallel.
+
+    Parameters
+    ----------
+    `roots` : list[str]
+        Files or directories to search for session logs.
+    `thresholds` : Thresholds, optional
+        Thresholds of the segmentation.
+    `workers` : int, optional
+        Number of worker processes (default is the number of CPUs).
+
+    Returns
+    -------
+    `list[dict]`
+        Per log: its `path`, `status` (`'ok'` or `'error'`), and the `states` summary (see `summarize`) or the `error`.
+    """
+    return list(map_files(partial(_summarize_file, thresholds=thresholds), discover(roots), workers))
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment session logs by driving state and summarize them.")
+    parser.add_argument("roots", nargs="+", help="Files or directories to search for session logs.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    for result in summarize_logs(args.roots, workers=args.workers):
+        if result["status"] != "ok":
+            print(f"  error  {result['path']}  ({result['error']})")
+            continue
+        print(f"  {result['path']}")
+        for name, state in result["states"].items():
+            print(f"    {name:<11} {state['segments']:>5} segment(s)  {state['duration']:>8.1f} s  {state['fraction']:>6.1%}  {state['distance_km']:>7.2f} km")
@@ -0,0 +1,267 @@
+"""
+# session.py
+
+Self-describing session logs and a catalog of sessions.
+
+Every log written by `SessionWriter` starts with one metadata line (`# {...}`, JSON) before the usual CSV header.
+It records the vehicle, the adapter port, the protocol, the wall-clock start time and, for every channel, its
+PID command and unit. `Catalog` indexes the metadata of many logs by reading only their first lines, so thousands
+of sessions can be listed and filtered without scanning their bodies.
+"""
+
+import os
+import json
+import time
+from datetime import datetime
+
+from Logs.ingest import discover, fingerprint
+from Logs.reader import METADATA_PREFIX, read_preamble, session_start
+from OBDModule.channels import CHANNELS, channel
+
+
+
+
+
+METADATA_VERSION = 1
+
+
+
+
+def session_metadata(sonata, vehicle: str = None, channels: list[str] = None, start: float = None) -> dict:
+    """
+    Builds the metadata block of a new session from a connected `Sonata` / `SonataAsync`.
+
+    Parameters
+    ----------
+    `sonata` : Sonata or SonataAsync
+        The connected vehicle interface (or `None`, in which case the connection fields are left empty).
+    `vehicle` : str, optional
+        Name of the vehicle.
+    `channels` : list[str], optional
+        Names of the logged channels (default is every logged channel).
+    `start` : float, optional
+        Start of the session, in seconds since the epoch (default is now).
+
+    Returns
+    -------
+    `dict`
+        The session metadata.
+    """
+    start = time.time() if start is None else start
+    names = channels if channels is not None else [entry.name for entry in CHANNELS]
+    connection = sonata.connection if sonata is not None else None
+
+    def _ask(method: str):
+        try: return getattr(connection, method)()
+        except Exception: return None
+
+    return {
+        "version": METADATA_VERSION,
+        "vehicle": vehicle,
+        "start": datetime.fromtimestamp(start).isoformat(),
+        "start_epoch": start,
+        "port": _ask("port_name"),
+        "protocol_name": _ask("protocol_name"),
+        "protocol_id": _ask("protocol_id"),
+        "channels": [{"name": name, "pid": channel(name).command, "unit": channel(name).unit} for name in names],
+    }
+
+
+
+
+class SessionWriter:
+    """
+    Writes a session log: a metadata line, the CSV header, then one row per sample.
+    """
+    def __init__(self, path: str, metadata: dict) -> "SessionWriter":
+        """
+        Parameters
+        ----------
+        `path` : str
+            Path to the log to create.
+        `metadata` : dict
+            The session metadata (see `session_metadata`). Its channels decide the columns of the log.
+        """
+        self._path = path
+        self._metadata = metadata
+        self._start = metadata["start_epoch"]
+        self._columns = ["timestamp"] + [entry["name"] for entry in metadata["channels"]]
+        self._file = open(path, "w", newline="")
+        self._file.write(METADATA_PREFIX + json.dumps(metadata, separators=(",", ":")) + "\n")
+        self._file.write(",".join(self._columns) + "\n")
+        self._file.flush()
+
+    @classmethod
+    def create(cls, directory: str, sonata, vehicle: str = None, channels: list[str] = None) -> "SessionWriter":
+        """
+        Starts a new session log in `directory`, named after its start time (e.g. `2023-05-19_10-48-17.txt`).
+
+        Parameters
+        ----------
+        `directory` : str
+            Directory to create the log in.
+        `sonata` : Sonata or SonataAsync
+            The connected vehicle interface.
+        `vehicle` : str, optional
+            Name of the vehicle.
+        `channels` : list[str], optional
+            Names of the logged channels (default is every logged channel).
+
+        Returns
+        -------
+        `SessionWriter`
+            The writer of the new log.
+        """
+        metadata = session_metadata(sonata, vehicle=vehicle, channels=channels)
+        os.makedirs(directory, exist_ok=True)
+        name = datetime.fromtimestamp(metadata["start_epoch"]).strftime("%Y-%m-%d_%H-%M-%S") + ".txt"
+        return cls(os.path.join(directory, name), metadata)
+
+    def __enter__(self) -> "SessionWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+    @property
+    def path(self) -> str:
+        """
+        Path to the log.
+        """
+        return self._path
+
+    @property
+    def metadata(self) -> dict:
+        """
+        The session metadata written at the start of the log.
+        """
+        return self._metadata
+
+
+    def append(self, sample: dict) -> None:
+        """
+        Appends one sample as a row. Its timestamp is written relative to the start of the session.
+
+        Parameters
+        ----------
+        `sample` : dict
+            A sample as returned by `Sonata.sample()`.
+        """
+        values = [repr(float(sample["timestamp"]) - self._start)]
+        values += [repr(float(sample.get(name, float("nan")))) for name in self._columns[1:]]
+        self._file.write(",".join(values) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        """
+        Closes the log.
+        """
+        if not self._file.closed:
+            self._file.close()
+
+
+
+
+class Catalog:
+    """
+    An index of session logs built from their metadata lines only, stored as JSON.
+    """
+    def __init__(self, path: str) -> "Catalog":
+        """
+        Parameters
+        ----------
+        `path` : str
+            Path to the catalog file (created by `refresh` if it does not exist yet).
+        """
+        self._path = path
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self._entries = json.load(file)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    def refresh(self, roots: list[str]) -> int:
+        """
+        Adds new or changed logs below `roots` to the catalog and drops entries whose files no longer exist.
+
+        Parameters
+        ----------
+        `roots` : list[str]
+            Files or directories to search for session logs.
+
+        Returns
+        -------
+        `int`
+            The number of logs whose metadata was (re-)read.
+        """
+        read = 0
+        for path in discover(roots):
+            stat = fingerprint(path)
+            entry = self._entries.get(path)
+            if entry is not None and entry["size"] == stat["size"] and entry["mtime_ns"] == stat["mtime_ns"]:
+                continue
+            metadata, columns, _ = read_preamble(path)
+            start = session_start(path)
+            self._entries[path] = {
+                **stat,
+                "metadata": metadata,
+                "columns": list(columns),
+                "vehicle": metadata.get("vehicle"),
+                "protocol_name": metadata.get("protocol_name"),
+                "start": start.isoformat() if start is not None else None,
+            }
+            read += 1
+        for path in [path for path in self._entries if not os.path.exists(path)]:
+            del self._entries[path]
+        self.save()
+        return read
+
+    def save(self) -> None:
+        """
+        Writes the catalog to disk.
+        """
+        with open(self._path + ".tmp", "w") as file:
+            json.dump(self._entries, file, indent=1, sort_keys=True)
+        os.replace(self._path + ".tmp", self._path)
+
+    def sessions(self, vehicle: str = None, protocol: str = None, since: datetime = None, until: datetime = None, channel: str = None) -> list[dict]:
+        """
+        Lists the catalogued sessions that match every given filter, oldest first.
+
+        Parameters
+        ----------
+        `vehicle` : str, optional
+            Only sessions of this vehicle.
+        `protocol` : str, optional
+            Only sessions recorded over this protocol (substring of the protocol name, case-insensitive).
+        `since` : datetime, optional
+            Only sessions that started at or after this time.
+        `until` : datetime, optional
+            Only sessions that started before this time.
+        `channel` : str, optional
+            Only sessions that logged this channel.
+
+        Returns
+        -------
+        `list[dict]`
+            The matching catalog entries, each with its `path` added.
+        """
+        matches = []
+        for path, entry in self._entries.items():
+            start = datetime.fromisoformat(entry["start"]) if entry["start"] else None
+            if vehicle is not None and entry["vehicle"] != vehicle:
+                continue
+            if protocol is not None and protocol.lower() not in (entry["protocol_name"] or "").lower():
+                continue
+            if since is not None and (start is None or start < since):
+                continue
+            if until is not None and (start is None or start >= until):
+                continue
+            if channel is not None and channel not in entry["columns"]:
+                continue
+            matches.append({"path": path, **entry})
+        return sorted(matches, key=lambda entry: entry["start"] or "")
@@ -4,6 +4,7 @@
 
 """
 import obd
+import time
 import numpy as np
 import pandas as pd
 from datetime import datetime
@@ -12,6 +13,7 @@ from obd.OBDResponse import Status as OBDStatusResponse
 
 from OBDModule.dtcs import DTCs
 from OBDModule.mids import MIDs
+from OBDModule.channels import CHANNELS, channel
 from OBDModule.monitor_results import MonitorResults
 
 
@@ -182,7 +184,31 @@ class Sonata:
         Collection of methods that return results of various OBD monitor tests.
         """
         return self._MonitorResults
-    
+
+
+    def sample(self, channels: list[str] = None) -> dict:
+        """
+        Queries each logged channel once and returns the results as a single sample (one row of a session log).
+
+        Parameters
+        ----------
+        `channels` : list[str], optional
+            Names of the channels to query (see `OBDModule.channels.CHANNELS`). Default is every logged channel.
+
+        Returns
+        -------
+        `dict`
+            The sample, with `timestamp` (seconds since the epoch) followed by the value of each channel, keyed by channel name.
+            Channels that could not be read are `nan`.
+        """
+        names = channels if channels is not None else [entry.name for entry in CHANNELS]
+        sample = {"timestamp": time.time()}
+        for name in names:
+            entry = channel(name)
+            try: sample[name] = float(getattr(self, entry.getter)(**entry.kwargs))
+            except Exception: sample[name] = float("nan")
+        return sample
+
 
     def get_absolute_engine_load(self) -> float:
         """
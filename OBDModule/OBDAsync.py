@@ -15,6 +15,8 @@ from obd.OBDResponse import Status as OBDStatusResponse
 
 from OBDModule.dtcs import DTCs
 from OBDModule.mids import MIDs
+from OBDModule.channels import CHANNELS, channel
+from OBDModule.ring_buffer import RingBuffers
 from OBDModule.monitor_results import MonitorResults
 
 
@@ -195,7 +197,7 @@ class SonataAsync:
         
     
 
-    def watch(self, commands: list[obd.OBDCommand]) -> None:
+    def watch(self, commands: list[obd.OBDCommand], buffers: RingBuffers = None) -> None:
         """
         Watches the given commands and calls the callback function whenever a new response is received.
 
@@ -203,15 +205,22 @@ class SonataAsync:
         ----------
         `commands` : list[obd.OBDCommand]
             List of commands to watch.
+        `buffers` : RingBuffers, optional
+            Ring buffers to push every new response into, keyed by channel name (e.g. `rpm`), or by command name for commands that are not logged channels.
+            Anything else with the same `callback(name)` method works too, e.g. `StreamStats` from `OBDModule/stats.py`.
 
         Returns
         -------
         `None`
         """
+        names = {entry.command: entry.name for entry in CHANNELS}
         for command in commands:
             if command not in self._watched_commands:
                 self._watched_commands.append(command)
-            self._connection.watch(command)
+            if buffers is not None:
+                self._connection.watch(command, callback=buffers.callback(names.get(command.name, command.name)))
+            else:
+                self._connection.watch(command)
     
 
 
@@ -228,6 +237,32 @@ class SonataAsync:
         self._connection.start()
 
 
+    def sample(self, channels: list[str] = None) -> dict:
+        """
+        Reads each logged channel once and returns the results as a single sample (one row of a session log).
+
+        For watched channels this returns immediately with the last known responses.
+
+        Parameters
+        ----------
+        `channels` : list[str], optional
+            Names of the channels to read (see `OBDModule.channels.CHANNELS`). Default is every logged channel.
+
+        Returns
+        -------
+        `dict`
+            The sample, with `timestamp` (seconds since the epoch) followed by the value of each channel, keyed by channel name.
+            Channels that could not be read are `nan`.
+        """
+        names = channels if channels is not None else [entry.name for entry in CHANNELS]
+        sample = {"timestamp": time.time()}
+        for name in names:
+            entry = channel(name)
+            try: sample[name] = float(getattr(self, entry.getter)(**entry.kwargs))
+            except Exception: sample[name] = float("nan")
+        return sample
+
+
 
 
     def get_absolute_engine_load(self) -> float:
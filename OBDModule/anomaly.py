@@ -0,0 +1,208 @@
+"""
+# anomaly.py
+
+Defines the AnomalyDetector class, an online detector that flags abnormal behaviour of channels as samples arrive.
+
+Every watched channel keeps an exponentially weighted baseline (mean and variance) and a smoothed rate of change.
+Each new value is checked against its `Rule`:
+- `zscore`: the value is more than `z_threshold` standard deviations away from its baseline;
+- `rate`: the channel changes faster than `max_rate` units per second (e.g. coolant climbing);
+- `low` / `high`: the baseline itself drifts past a limit (e.g. fuel trims drifting, module voltage sagging),
+  which ignores single spikes.
+
+The standard deviation used for `zscore` never drops below the channel's `resolution`, so a single quantization
+step of a steady PID (e.g. 1 kPa of manifold pressure) is not an anomaly.
+
+`control_module_voltage` is not a logged channel, so `Sonata.sample()` cannot read it: feed the detector from
+`VirtualSonata(sonata).sample(detector.channels)`, which reads it like the other inputs of `virtual.EXTRA_INPUTS`.
+
+Everything is plain float arithmetic on a few numbers per channel, so an update takes constant time and memory.
+"""
+
+import math
+from collections import deque, namedtuple
+
+
+
+
+
+Rule = namedtuple("Rule", ["alpha", "z_threshold", "max_rate", "rate_window", "low", "high", "warmup", "cooldown", "resolution"],
+                  defaults=(0.05, 4.0, None, 10.0, None, None, 20, 30.0, 0.0))
+"""
+How a channel is checked.
+
+- `alpha`: Weight of a new value in the baseline (`0.05` ~ the last 20 samples).
+- `z_threshold`: Distance from the baseline, in standard deviations, flagged as `zscore` (`None` to disable).
+- `max_rate`: Largest normal rate of change, in units per second, flagged as `rate` (`None` to disable).
+- `rate_window`: Time constant, in seconds, over which the rate of change is smoothed (so that quantization steps
+  of the PID, e.g. 1 degC, do not read as fast changes).
+- `low`, `high`: Limits of the baseline, flagged as `low` / `high` (`None` to disable).
+- `warmup`: Number of values to see before checking `zscore` and the limits.
+- `cooldown`: Seconds during which the same kind of event is not raised again for the channel.
+- `resolution`: Smallest step of the channel's values (its PID scaling), the floor of the standard deviation in `zscore`.
+"""
+
+
+Event = namedtuple("Event", ["time", "channel", "kind", "value", "baseline", "score", "context"])
+"""
+An anomaly.
+
+- `time`: Timestamp of the sample that raised it.
+- `channel`: Name of the channel.
+- `kind`: `'zscore'`, `'rate'`, `'low'` or `'high'`.
+- `value`: The channel's value.
+- `baseline`: The channel's baseline (EWMA) when it was raised.
+- `score`: The z-score, the rate (units per second) or the limit that was crossed.
+- `context`: Dict with the baseline's `std`, the channel's `recent` values and the whole `sample`.
+"""
+
+
+DEFAULT_RULES = {
+    "coolant_temperature":                  Rule(alpha=0.02, z_threshold=None, max_rate=1.0, high=110.0),
+    "short_term_fuel_trim_bank1":           Rule(alpha=0.02, z_threshold=5.0, low=-15.0, high=15.0, resolution=100 / 128),
+    "short_term_o2_trim_bank1":             Rule(alpha=0.02, z_threshold=5.0, low=-15.0, high=15.0, resolution=100 / 128),
+    "control_module_voltage":               Rule(alpha=0.1, z_threshold=None, max_rate=None, low=12.0, high=15.5),
+    "catalyst_temperature_bank1sensor1":    Rule(alpha=0.02, z_threshold=None, max_rate=50.0, high=900.0),
+    "intake_manifold_pressure":             Rule(alpha=0.05, z_threshold=6.0, resolution=1.0),
+}
+"""
+Rules used when none are given (`control_module_voltage` is read through `VirtualSonata`, see above).
+"""
+
+
+
+
+class _ChannelState:
+    """
+    Baseline and rate of change of one channel.
+    """
+    __slots__ = ("rule", "count", "mean", "variance", "rate", "last_value", "last_time", "recent", "last_event")
+
+    def __init__(self, rule: Rule, context: int):
+        self.rule = rule
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.rate = 0.0
+        self.last_value = None
+        self.last_time = None
+        self.recent = deque(maxlen=context)
+        self.last_event = {}
+
+
+
+
+class AnomalyDetector:
+    """
+    Online, per-channel anomaly detector fed with `Sonata.sample()` samples.
+    """
+    def __init__(self, rules: dict[str, Rule] = None, callback=None, context: int = 10, history: int = 100) -> "AnomalyDetector":
+        """
+        Parameters
+        ----------
+        `rules` : dict[str, Rule], optional
+            Rule of every watched channel (default is `DEFAULT_RULES`). Other channels are ignored.
+        `callback` : Callable[[Event], None], optional
+            Called with every event, on the thread calling `update`.
+        `context` : int, optional
+            Number of recent values of the channel attached to each event (default is `10`).
+        `history` : int, optional
+            Number of recent events kept in `events` (default is `100`).
+        """
+        self._states = {name: _ChannelState(rule, context) for name, rule in (DEFAULT_RULES if rules is None else rules).items()}
+        self._callback = callback
+        self.events = deque(maxlen=history)
+
+    @property
+    def channels(self) -> list[str]:
+        """
+        Names of the watched channels, e.g. for `VirtualSonata.sample()`.
+        """
+        return list(self._states)
+
+    def baseline(self, name: str) -> tuple[float, float]:
+        """
+        Gets the current baseline of a channel.
+
+        Returns
+        -------
+        `tuple[float, float]`
+            The EWMA mean and standard deviation (`nan` before the first value).
+        """
+        state = self._states[name]
+        if state.count == 0:
+            return math.nan, math.nan
+        return state.mean, math.sqrt(state.variance)
+
+
+    def update(self, sample: dict) -> list[Event]:
+        """
+        Checks a sample and updates the baselines.
+
+        Parameters
+        ----------
+        `sample` : dict
+            A sample as returned by `Sonata.sample()` (with a `timestamp` in seconds).
+
+        Returns
+        -------
+        `list[Event]`
+            The events raised by this sample (usually empty).
+        """
+        time = sample["timestamp"]
+        raised = []
+        for name, state in self._states.items():
+            value = sample.get(name)
+            if value is None or value != value:
+                continue
+            value = float(value)
+            rule = state.rule
+            std = max(math.sqrt(state.variance), rule.resolution)
+
+            if state.count >= rule.warmup and rule.z_threshold is not None and std > 0:
+                z = (value - state.mean) / std
+                if abs(z) > rule.z_threshold:
+                    self._raise(raised, state, name, "zscore", time, value, z, sample)
+
+            if state.last_time is not None and time > state.last_time:
+                rate = (value - state.last_value) / (time - state.last_time)
+                state.rate += (1 - math.exp((state.last_time - time) / rule.rate_window)) * (rate - state.rate)
+                if rule.max_rate is not None and abs(state.rate) > rule.max_rate:
+                    self._raise(raised, state, name, "rate", time, value, state.rate, sample)
+
+            if state.count == 0:
+                state.mean = value
+            else:
+                delta = value - state.mean
+                state.mean += rule.alpha * delta
+                state.variance = (1 - rule.alpha) * (state.variance + rule.alpha * delta * delta)
+            state.count += 1
+            state.last_value, state.last_time = value, time
+            state.recent.append(value)
+
+            if state.count >= rule.warmup:
+                if rule.low is not None and state.mean < rule.low:
+                    self._raise(raised, state, name, "low", time, value, rule.low, sample)
+                if rule.high is not None and state.mean > rule.high:
+                    self._raise(raised, state, name, "high", time, value, rule.high, sample)
+        return raised
+
+    def _raise(self, raised: list, state: _ChannelState, name: str, kind: str, time: float, value: float, score: float, sample: dict) -> None:
+        previous = state.last_event.get(kind)
+        if previous is not None and time - previous < state.rule.cooldown:
+            return
+        state.last_event[kind] = time
+        context = {"std": math.sqrt(state.variance), "recent": list(state.recent), "sample": dict(sample)}
+        event = Event(time, name, kind, value, state.mean, score, context)
+        raised.append(event)
+        self.events.append(event)
+        if self._callback is not None:
+            self._callback(event)
+
+    def reset(self, name: str = None) -> None:
+        """
+        Forgets the baseline of a channel (or of every channel), e.g. after a repair.
+        """
+        for key, state in self._states.items():
+            if name is None or key == name:
+                self._states[key] = _ChannelState(state.rule, state.recent.maxlen)
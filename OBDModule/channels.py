@@ -0,0 +1,77 @@
+"""
+# channels.py
+
+Defines the logged channels, i.e. the columns of a session log and the `Sonata` getters that fill them.
+"""
+
+from collections import namedtuple
+
+
+
+
+
+Channel = namedtuple("Channel", ["name", "command", "getter", "kwargs", "unit"])
+"""
+A single logged channel.
+
+- `name`: The column name used in session logs (e.g. `rpm`).
+- `command`: The name of the `obd.commands` entry that is queried for it (e.g. `RPM`).
+- `getter`: The name of the `Sonata` / `SonataAsync` method that returns its value.
+- `kwargs`: Keyword arguments passed to the getter so the value comes back in the logged unit.
+- `unit`: The unit of the logged value.
+"""
+
+
+CHANNELS = (
+    Channel("speed",                                "SPEED",                    "get_speed",                                {"as_kilometers_per_hour": True},   "km/h"),
+    Channel("rpm",                                  "RPM",                      "get_engine_RPM",                           {},                                 "rpm"),
+    Channel("calculated_engine_load",               "ENGINE_LOAD",              "get_engine_load",                          {},                                 "%"),
+    Channel("absolute_engine_load",                 "ABSOLUTE_LOAD",            "get_absolute_engine_load",                 {},                                 "%"),
+    Channel("relative_throttle_pos",                "RELATIVE_THROTTLE_POS",    "get_relative_throttle_position",           {},                                 "%"),
+    Channel("absolute_throttle_pos",                "THROTTLE_POS",             "get_absolute_throttle_position",           {},                                 "%"),
+    Channel("timing_advance",                       "TIMING_ADVANCE",           "get_timing_advance",                       {},                                 "deg"),
+    Channel("fuel_rail_pressure",                   "FUEL_RAIL_PRESSURE_ABS",   "get_fuel_rail_pressure",                   {},                                 "kPa"),
+    Channel("intake_manifold_pressure",             "INTAKE_PRESSURE",          "get_intake_manifold_pressure",             {},                                 "kPa"),
+    Channel("coolant_temperature",                  "COOLANT_TEMP",             "get_coolant_temperature",                  {},                                 "degC"),
+    Channel("fuel_level",                           "FUEL_LEVEL",               "get_fuel_level",                           {},                                 "%"),
+    Channel("catalyst_temperature_bank1sensor1",    "CATALYST_TEMP_B1S1",       "get_catalyst_temperature_Bank1Sensor1",    {},                                 "degC"),
+    Channel("catalyst_temperature_bank1sensor2",    "CATALYST_TEMP_B1S2",       "get_catalyst_temperature_Bank1Sensor2",    {},                                 "degC"),
+    Channel("o2_bank1sensor2_voltage",              "O2_B1S2",                  "get_O2_Bank1Sensor2_voltage",              {},                                 "V"),
+    Channel("o2_bank1sensor1_wr_lambda_current",    "O2_S1_WR_CURRENT",         "get_O2_sensor1_WR_lambda_current",         {},                                 "mA"),
+    Channel("short_term_fuel_trim_bank1",           "SHORT_FUEL_TRIM_1",        "get_short_term_fuel_trim_Bank1",           {},                                 "%"),
+    Channel("short_term_o2_trim_bank1",             "SHORT_O2_TRIM_B1",         "get_short_term_O2_trim_Bank1",             {},                                 "%"),
+)
+"""
+The channels written to every session log, in column order.
+
+Logs written before session metadata existed used the getters' default units instead (`speed` in m/s);
+`Logs.reader` converts them when reading (see `Logs.reader.LEGACY_UNITS`).
+"""
+
+
+LOG_COLUMNS = ("timestamp",) + tuple(channel.name for channel in CHANNELS)
+"""
+The header of a session log (`timestamp` in seconds since the start of the session, followed by every channel).
+"""
+
+
+
+
+def channel(name: str) -> Channel:
+    """
+    Looks up a channel by its log column name.
+
+    Parameters
+    ----------
+    `name` : str
+        The column name of the channel (e.g. `rpm`).
+
+    Returns
+    -------
+    `Channel`
+        The matching channel.
+    """
+    for candidate in CHANNELS:
+        if candidate.name == name:
+            return candidate
+    raise KeyError(f"Unknown channel '{name}'")
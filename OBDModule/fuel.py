@@ -0,0 +1,353 @@
+"""
+# fuel.py
+
+Estimates fuel consumption from manifold pressure and RPM with the speed-density method, over whole log arrays
+(vectorized with NumPy) or sample by sample while driving.
+
+The air mass drawn in per second is the displaced volume per second (`displacement * rpm / 120` for a four-stroke),
+times the volumetric efficiency, times the density of the manifold air (`MAP / (R * IAT)`). Fuel is that air mass
+divided by the stoichiometric air-fuel ratio, corrected by the fuel trims the ECU reports.
+The result is an estimate: its accuracy mostly depends on how well `Engine.volumetric_efficiency` fits the engine.
+
+The intake air temperature and the long-term fuel trim are not logged channels, so `Sonata.sample()` cannot read them:
+while driving, feed `FuelIntegrator` from `VirtualSonata(sonata).sample(INPUTS)`, which reads them through
+`virtual.EXTRA_INPUTS`. Session logs do not contain them, so estimates from logs use a constant intake temperature.
+"""
+
+import numpy as np
+from collections import namedtuple
+
+from Logs.reader import read_arrays
+
+
+
+
+
+R_AIR = 287.05
+"""
+Specific gas constant of dry air, in J/(kg K).
+"""
+
+LITERS_PER_GALLON = 3.785411784
+KILOMETERS_PER_MILE = 1.609344
+
+
+Engine = namedtuple("Engine", ["displacement", "volumetric_efficiency", "stoichiometric_afr", "fuel_density"])
+"""
+Parameters of the speed-density model of one vehicle.
+
+- `displacement`: Engine displacement, in liters.
+- `volumetric_efficiency`: Either a constant (e.g. `0.85`), or a table `(rpm points, efficiencies)` interpolated linearly.
+- `stoichiometric_afr`: Stoichiometric air-fuel mass ratio of the fuel (`14.7` for gasoline).
+- `fuel_density`: Density of the fuel, in g/L (`745` for gasoline).
+"""
+
+
+SONATA = Engine(
+    displacement=2.4,
+    volumetric_efficiency=((700, 1500, 2500, 3500, 4500, 6000), (0.75, 0.82, 0.88, 0.90, 0.88, 0.82)),
+    stoichiometric_afr=14.7,
+    fuel_density=745.0,
+)
+"""
+Default parameters: the 2.4 L four-cylinder gasoline engine of the Sonata.
+"""
+
+
+INPUTS = ("rpm", "speed", "intake_manifold_pressure", "intake_air_temperature", "short_term_fuel_trim_bank1", "long_term_fuel_trim_bank1")
+"""
+Channels the estimate uses, to read with `VirtualSonata.sample()`.
+"""
+
+
+
+
+def _intake_temperature(measured, default) -> np.ndarray:
+    """
+    Gets the measured intake air temperature, with `default` wherever it is missing (`None` or `nan`).
+    """
+    if measured is None:
+        return default
+    measured = np.asarray(measured, dtype=np.float64)
+    return np.where(np.isnan(measured), default, measured)
+
+
+def volumetric_efficiency(rpm, engine: Engine = SONATA) -> np.ndarray:
+    """
+    Gets the volumetric efficiency of the engine at the given RPM.
+
+    Parameters
+    ----------
+    `rpm` : float or np.ndarray
+        Engine speed, in revolutions per minute.
+    `engine` : Engine, optional
+        Parameters of the engine (default is `SONATA`).
+
+    Returns
+    -------
+    `np.ndarray`
+        The volumetric efficiency (a fraction), shaped like `rpm`.
+    """
+    table = engine.volumetric_efficiency
+    if np.isscalar(table):
+        return np.full(np.shape(rpm), float(table))
+    return np.interp(rpm, table[0], table[1])
+
+
+def air_mass_flow(rpm, intake_manifold_pressure, intake_temperature=25.0, engine: Engine = SONATA) -> np.ndarray:
+    """
+    Computes the mass of air drawn in by the engine.
+
+    Parameters
+    ----------
+    `rpm` : float or np.ndarray
+        Engine speed, in revolutions per minute.
+    `intake_manifold_pressure` : float or np.ndarray
+        Absolute manifold pressure, in kPa.
+    `intake_temperature` : float or np.ndarray, optional
+        Intake air temperature, in degrees Celsius (default is `25.0`).
+    `engine` : Engine, optional
+        Parameters of the engine (default is `SONATA`).
+
+    Returns
+    -------
+    `np.ndarray`
+        The air mass flow, in grams per second.
+    """
+    rpm = np.asarray(rpm, dtype=np.float64)
+    density = np.asarray(intake_manifold_pressure, dtype=np.float64) * 1000 / (R_AIR * (np.asarray(intake_temperature, dtype=np.float64) + 273.15))
+    volume_flow = engine.displacement / 1000 * rpm / 120
+    return volume_flow * volumetric_efficiency(rpm, engine) * density * 1000
+
+
+def fuel_rate(rpm, intake_manifold_pressure, intake_temperature=25.0, short_term_fuel_trim=0.0, long_term_fuel_trim=0.0, engine: Engine = SONATA) -> np.ndarray:
+    """
+    Computes the instantaneous fuel rate.
+
+    Parameters
+    ----------
+    `rpm`, `intake_manifold_pressure`, `intake_temperature` : float or np.ndarray
+        As for `air_mass_flow`.
+    `short_term_fuel_trim`, `long_term_fuel_trim` : float or np.ndarray, optional
+        Fuel trims, in percent (default is `0.0`). Missing (`nan`) trims count as `0`.
+    `engine` : Engine, optional
+        Parameters of the engine (default is `SONATA`).
+
+    Returns
+    -------
+    `np.ndarray`
+        The fuel rate, in liters per hour (`nan` where RPM or pressure is missing, `0` with the engine off).
+    """
+    trim = 1 + (np.nan_to_num(np.asarray(short_term_fuel_trim, dtype=np.float64)) + np.nan_to_num(np.asarray(long_term_fuel_trim, dtype=np.float64))) / 100
+    fuel_grams = air_mass_flow(rpm, intake_manifold_pressure, intake_temperature, engine) / engine.stoichiometric_afr * trim
+    return fuel_grams / engine.fuel_density * 3600
+
+
+def instantaneous_mpg(speed, rate) -> np.ndarray:
+    """
+    Computes the instantaneous fuel economy.
+
+    Parameters
+    ----------
+    `speed` : float or np.ndarray
+        Vehicle speed, in km/h.
+    `rate` : float or np.ndarray
+        Fuel rate, in liters per hour.
+
+    Returns
+    -------
+    `np.ndarray`
+        Fuel economy, in US miles per gallon (`nan` where no fuel is used).
+    """
+    speed = np.asarray(speed, dtype=np.float64)
+    rate = np.asarray(rate, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(rate > 0, (speed / KILOMETERS_PER_MILE) / (rate / LITERS_PER_GALLON), np.nan)
+
+
+def trip_totals(time, speed, rate, max_gap: float = 5.0) -> dict:
+    """
+    Integrates distance and fuel over a trip (trapezoidal rule).
+
+    Parameters
+    ----------
+    `time` : np.ndarray
+        Sample times, in seconds, increasing.
+    `speed` : np.ndarray
+        Vehicle speed, in km/h.
+    `rate` : np.ndarray
+        Fuel rate, in liters per hour.
+    `max_gap` : float, optional
+        Intervals longer than this (seconds), e.g. logging dropouts, are not integrated (default is `5.0`).
+
+    Returns
+    -------
+    `dict`
+        `distance_km`, `fuel_l`, `liters_per_100km`, `mpg` and `duration` (seconds integrated).
+    """
+    time = np.asarray(time, dtype=np.float64)
+    dt = np.diff(time)
+    keep = (dt > 0) & (dt <= max_gap)
+
+    def _integrate(values) -> float:
+        values = np.asarray(values, dtype=np.float64)
+        middle = (values[1:] + values[:-1]) / 2
+        valid = keep & ~np.isnan(middle)
+        return float(np.dot(middle[valid], dt[valid]) / 3600)
+
+    distance = _integrate(speed)
+    fuel = _integrate(rate)
+    return {
+        "distance_km": distance,
+        "fuel_l": fuel,
+        "liters_per_100km": fuel / distance * 100 if distance > 0 else float("nan"),
+        "mpg": (distance / KILOMETERS_PER_MILE) / (fuel / LITERS_PER_GALLON) if fuel > 0 else float("nan"),
+        "duration": float(dt[keep].sum()),
+    }
+
+
+def from_arrays(columns: dict, intake_temperature=25.0, engine: Engine = SONATA, max_gap: float = 5.0) -> dict:
+    """
+    Computes fuel rate, instantaneous MPG and trip totals for a whole log.
+
+    Parameters
+    ----------
+    `columns` : dict[str, np.ndarray]
+        Log columns, as returned by `Logs.reader.read_arrays` (needs `timestamp`, `rpm`, `intake_manifold_pressure`
+        and `speed`; uses `short_term_fuel_trim_bank1` and `intake_air_temperature` when present).
+    `intake_temperature` : float or np.ndarray, optional
+        Intake air temperature (degrees Celsius) used where the columns have no `intake_air_temperature` (always the
+        case for session logs, which do not log it).
+    `engine` : Engine, optional
+        Parameters of the engine (default is `SONATA`).
+    `max_gap` : float, optional
+        As for `trip_totals`.
+
+    Returns
+    -------
+    `dict`
+        `fuel_rate` (L/h) and `mpg` arrays, plus the totals of `trip_totals`.
+    """
+    rate = fuel_rate(
+        columns["rpm"],
+        columns["intake_manifold_pressure"],
+        _intake_temperature(columns.get("intake_air_temperature"), intake_temperature),
+        columns.get("short_term_fuel_trim_bank1", 0.0),
+        columns.get("long_term_fuel_trim_bank1", 0.0),
+        engine,
+    )
+    return {
+        "fuel_rate": rate,
+        "mpg": instantaneous_mpg(columns["speed"], rate),
+        **trip_totals(columns["timestamp"], columns["speed"], rate, max_gap),
+    }
+
+
+def summarize_logs(paths: list[str], intake_temperature=25.0, engine: Engine = SONATA) -> list[dict]:
+    """
+    Computes the trip totals of many session logs.
+
+    Parameters
+    ----------
+    `paths` : list[str]
+        Paths to the session logs.
+    `intake_temperature` : float, optional
+        As for `from_arrays`.
+    `engine` : Engine, optional
+        Parameters of the engine (default is `SONATA`).
+
+    Returns
+    -------
+    `list[dict]`
+        The totals of each log (see `trip_totals`), with its `path`.
+    """
+    summaries = []
+    for path in paths:
+        result = from_arrays(read_arrays(path), intake_temperature, engine)
+        del result["fuel_rate"], result["mpg"]
+        summaries.append({"path": path, **result})
+    return summaries
+
+
+
+
+class FuelIntegrator:
+    """
+    Streaming counterpart of `from_arrays`: integrates fuel and distance one sample at a time, in O(1).
+    """
+    def __init__(self, engine: Engine = SONATA, intake_temperature: float = 25.0, max_gap: float = 5.0) -> "FuelIntegrator":
+        """
+        Parameters
+        ----------
+        `engine` : Engine, optional
+            Parameters of the engine (default is `SONATA`).
+        `intake_temperature` : float, optional
+            Intake air temperature (degrees Celsius) used when a sample has no `intake_air_temperature`, or could not read it.
+        `max_gap` : float, optional
+            Intervals longer than this (seconds) are not integrated (default is `5.0`).
+        """
+        self._engine = engine
+        self._intake_temperature = intake_temperature
+        self._max_gap = max_gap
+        self._previous = None
+        self.fuel_l = 0.0
+        self.distance_km = 0.0
+        self.rate = float("nan")
+
+    @property
+    def mpg(self) -> float:
+        """
+        Fuel economy since the start, in US miles per gallon (`nan` before any fuel is used).
+        """
+        if self.fuel_l <= 0:
+            return float("nan")
+        return (self.distance_km / KILOMETERS_PER_MILE) / (self.fuel_l / LITERS_PER_GALLON)
+
+    @property
+    def liters_per_100km(self) -> float:
+        """
+        Fuel consumption since the start, in liters per 100 km (`nan` before any distance is covered).
+        """
+        return self.fuel_l / self.distance_km * 100 if self.distance_km > 0 else float("nan")
+
+
+    def update(self, sample: dict) -> float:
+        """
+        Adds a sample (as returned by `VirtualSonata.sample(INPUTS)`, or by `Sonata.sample()` without the intake temperature).
+
+        Returns
+        -------
+        `float`
+            The instantaneous fuel rate, in liters per hour.
+        """
+        rate = float(fuel_rate(
+            sample.get("rpm", np.nan),
+            sample.get("intake_manifold_pressure", np.nan),
+            _intake_temperature(sample.get("intake_air_temperature"), self._intake_temperature),
+            sample.get("short_term_fuel_trim_bank1", 0.0),
+            sample.get("long_term_fuel_trim_bank1", 0.0),
+            self._engine,
+        ))
+        time, speed = float(sample["timestamp"]), float(sample.get("speed", np.nan))
+        if self._previous is not None:
+            previous_time, previous_speed, previous_rate = self._previous
+            dt = time - previous_time
+            if 0 < dt <= self._max_gap:
+                fuel = (rate + previous_rate) / 2 * dt / 3600
+                distance = (speed + previous_speed) / 2 * dt / 3600
+                if fuel == fuel:
+                    self.fuel_l += fuel
+                if distance == distance:
+                    self.distance_km += distance
+        self._previous = (time, speed, rate)
+        self.rate = rate
+        return rate
+
+    def reset(self) -> None:
+        """
+        Starts a new trip.
+        """
+        self._previous = None
+        self.fuel_l = 0.0
+        self.distance_km = 0.0
+        self.rate = float("nan")
@@ -0,0 +1,448 @@
+"""
+# gears.py
+
+Estimates the engaged gear from `speed` and `rpm`.
+
+In gear, `rpm / speed` is a constant of the drivetrain (gear ratio times final drive, over the wheel circumference),
+so logged samples pile up around one value per gear. `fit` learns these values for a vehicle by clustering the
+logarithm of the ratio over whole log arrays (a histogram for the initial peaks, then a few k-means passes), keeping
+only samples that are steady in gear: rolling, above idle, and with a ratio that does not change between neighbouring
+samples (which rules out shifts, clutch or torque converter slip, and coasting at idle). The resulting `GearModel`
+classifies a sample in constant time with a lookup table over the log ratio; `GearTracker` adds hysteresis for live use.
+
+Clusters only tell which ratios the vehicle drove in, not which gears they are: a gear that was never driven steadily
+leaves no cluster, and the rest shift down by one. Gear numbers are therefore only reported when every gear was
+found (as many clusters as `max_gears`), or when the vehicle's known ratios are configured (`Thresholds.ratios`);
+otherwise the model is unnamed and classifies samples by the index of the ratio instead.
+
+Usage:
+    `python -m OBDModule.gears <directory> [<directory> ...] [--workers N]`
+"""
+
+import math
+import argparse
+import numpy as np
+from functools import partial
+from collections import namedtuple
+
+from Logs.ingest import discover
+from Logs.parallel import map_files
+from Logs.reader import read_arrays
+
+
+
+
+
+Thresholds = namedtuple(
+    "Thresholds",
+    ["min_speed", "min_rpm", "stability", "tolerance", "min_share", "min_separation", "max_gears", "ratios"],
+    defaults=(10.0, 1000.0, 0.03, 0.06, 0.02, 0.12, 6, None),
+)
+"""
+Settings of the gear estimation.
+
+- `min_speed`: Below this speed (km/h), no gear is estimated (stopped, pulling away on a slipping clutch).
+- `min_rpm`: Below this RPM, no gear is estimated (idle, e.g. coasting with the clutch in or in neutral).
+- `stability`: Largest relative change of the ratio between neighbouring samples for a sample to be used by `fit`.
+- `tolerance`: Largest relative distance between a sample's ratio and a gear's ratio for it to be classified in that gear.
+- `min_share`: Smallest fraction of the steady samples a cluster needs to count as a gear.
+- `min_separation`: Smallest relative distance between the ratios of two gears.
+- `max_gears`: Number of forward gears of the vehicle.
+- `ratios`: Known `rpm / speed` (RPM per km/h) of each gear, from first to top gear, used to number the learned
+  ratios (`None` if unknown). A learned ratio further than `tolerance` from every known one is dropped.
+"""
+
+
+NEUTRAL = 0
+"""
+Label of samples in no identifiable gear (stopped, idle, shifting, slipping).
+"""
+
+_RESOLUTION = 0.005
+"""
+Width of the histogram bins of `fit` and of the lookup table of `GearModel`, in log ratio.
+"""
+
+
+
+
+def log_ratio(speed, rpm) -> np.ndarray:
+    """
+    Computes `log(rpm / speed)` (vectorized), `nan` where it is undefined.
+    """
+    speed = np.asarray(speed, dtype=np.float64)
+    rpm = np.asarray(rpm, dtype=np.float64)
+    with np.errstate(all="ignore"):
+        return np.where((speed > 0) & (rpm > 0), np.log(rpm / speed), np.nan)
+
+
+def steady(time, speed, rpm, thresholds: Thresholds = Thresholds()) -> np.ndarray:
+    """
+    Selects the samples that are steady in gear (see the module description).
+
+    Parameters
+    ----------
+    `time` : np.ndarray
+        Sample times, in seconds (used to ignore neighbours across gaps).
+    `speed` : np.ndarray
+        Vehicle speed, in km/h.
+    `rpm` : np.ndarray
+        Engine RPM.
+    `thresholds` : Thresholds, optional
+        Settings of the estimation.
+
+    Returns
+    -------
+    `np.ndarray`
+        A boolean mask of the steady samples.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    speed = np.asarray(speed, dtype=np.float64)
+    rpm = np.asarray(rpm, dtype=np.float64)
+    x = log_ratio(speed, rpm)
+    usable = (speed >= thresholds.min_speed) & (rpm >= thresholds.min_rpm) & np.isfinite(x)
+    if len(x) < 2:
+        return np.zeros(len(x), dtype=bool)
+    limit = math.log1p(thresholds.stability)
+    # a pair of neighbours agrees if both are usable, close in time and in ratio
+    agrees = usable[1:] & usable[:-1] & (np.abs(np.diff(x)) <= limit) & (np.diff(time) <= 2.0)
+    before = np.concatenate(([False], agrees))
+    after = np.concatenate((agrees, [False]))
+    return usable & before & after
+
+
+
+
+class GearModel:
+    """
+    Learned gear ratios of one vehicle, with constant-time classification.
+    """
+    def __init__(self, ratios: list[float], tolerance: float = 0.06, min_speed: float = 10.0, min_rpm: float = 1000.0,
+                 numbers: list[int] = None) -> "GearModel":
+        """
+        Parameters
+        ----------
+        `ratios` : list[float]
+            `rpm / speed` (RPM per km/h) of each gear.
+        `tolerance` : float, optional
+            Largest relative distance between a sample's ratio and a gear's ratio (default is `0.06`).
+        `min_speed`, `min_rpm` : float, optional
+            Below these, samples are classified as `NEUTRAL` (defaults are `10.0` km/h and `1000.0` RPM).
+        `numbers` : list[int], optional
+            Gear number of each ratio, in the order of `ratios`. If not given, the model is unnamed: samples are
+            classified by the index of their ratio (`1` for the highest), which is not necessarily the gear.
+        """
+        pairs = sorted(zip((float(ratio) for ratio in ratios), numbers if numbers is not None else [None] * len(ratios)), reverse=True,
+                       key=lambda pair: pair[0])
+        self.ratios = [ratio for ratio, _ in pairs]
+        self.numbers = [int(number) for _, number in pairs] if numbers is not None else None
+        self.tolerance = tolerance
+        self.min_speed = min_speed
+        self.min_rpm = min_rpm
+
+        # lookup table over the log ratio: the gear of every bin, or NEUTRAL between gears
+        centers = np.log(self.ratios) if self.ratios else np.empty(0)
+        width = math.log1p(tolerance)
+        self._low = float(centers.min()) - width - _RESOLUTION if len(centers) else 0.0
+        high = float(centers.max()) + width + _RESOLUTION if len(centers) else 0.0
+        bins = self._low + (np.arange(int(math.ceil((high - self._low) / _RESOLUTION)) + 1) + 0.5) * _RESOLUTION
+        self._table = np.zeros(len(bins), dtype=np.uint8)
+        if len(centers):
+            distance = np.abs(bins[:, None] - centers[None, :])
+            nearest = np.argmin(distance, axis=1)
+            labels = np.array(self.numbers if self.numbers is not None else range(1, len(centers) + 1))
+            self._table = np.where(distance[np.arange(len(bins)), nearest] <= width, labels[nearest], NEUTRAL).astype(np.uint8)
+        self._lookup = self._table.tolist()
+
+    def __repr__(self) -> str:
+        return f"GearModel({[round(ratio, 2) for ratio in self.ratios]}, numbers={self.numbers})"
+
+    @property
+    def gears(self) -> int:
+        """
+        Number of gears (or ratios, if the model is unnamed).
+        """
+        return len(self.ratios)
+
+    @property
+    def named(self) -> bool:
+        """
+        Whether samples are classified by gear number rather than by ratio index.
+        """
+        return self.numbers is not None
+
+
+    def classify(self, speed: float, rpm: float) -> int:
+        """
+        Classifies one sample in O(1).
+
+        Returns
+        -------
+        `int`
+            The gear (`1` is first gear), or the ratio index if the model is unnamed, or `NEUTRAL` (`0`).
+        """
+        if not (speed >= self.min_speed and rpm >= self.min_rpm):
+            return NEUTRAL
+        index = int((math.log(rpm / speed) - self._low) / _RESOLUTION)
+        return self._lookup[index] if 0 <= index < len(self._lookup) else NEUTRAL
+
+    def classify_arrays(self, speed, rpm) -> np.ndarray:
+        """
+        Classifies every sample of a log (vectorized, same result as `classify`).
+
+        Returns
+        -------
+        `np.ndarray`
+            One gear (or ratio index) per sample (`uint8`, `NEUTRAL` where none).
+        """
+        speed = np.asarray(speed, dtype=np.float64)
+        rpm = np.asarray(rpm, dtype=np.float64)
+        x = log_ratio(speed, rpm)
+        valid = (speed >= self.min_speed) & (rpm >= self.min_rpm) & np.isfinite(x)
+        index = np.zeros(len(x), dtype=np.int64)
+        index[valid] = ((x[valid] - self._low) / _RESOLUTION).astype(np.int64)
+        valid &= (index >= 0) & (index < len(self._table))
+        gears = np.full(len(x), NEUTRAL, dtype=np.uint8)
+        gears[valid] = self._table[index[valid]]
+        return gears
+
+
+    def to_dict(self) -> dict:
+        return {"ratios": self.ratios, "tolerance": self.tolerance, "min_speed": self.min_speed, "min_rpm": self.min_rpm, "numbers": self.numbers}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GearModel":
+        return cls(data["ratios"], data["tolerance"], data["min_speed"], data["min_rpm"], data.get("numbers"))
+
+
+
+
+def cluster(x: np.ndarray, thresholds: Thresholds = Thresholds(), iterations: int = 10) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters log ratios into gears.
+
+    Parameters
+    ----------
+    `x` : np.ndarray
+        Log ratios of steady samples (see `log_ratio` and `steady`).
+    `thresholds` : Thresholds, optional
+        Settings of the estimation.
+    `iterations` : int, optional
+        Number of k-means passes after the histogram peaks (default is `10`).
+
+    Returns
+    -------
+    `tuple[np.ndarray, np.ndarray]`
+        The log ratio of each gear's cluster center, and the number of samples in each, by decreasing ratio.
+        Centers are at least `min_separation` apart.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x = x[np.isfinite(x)]
+    if not len(x):
+        return np.empty(0), np.empty(0, dtype=np.int64)
+
+    # peaks of the smoothed histogram, the largest first, kept if far enough from larger ones
+    edges = np.arange(x.min() - 3 * _RESOLUTION, x.max() + 4 * _RESOLUTION, _RESOLUTION)
+    counts, edges = np.histogram(x, bins=edges)
+    kernel = np.exp(-0.5 * (np.arange(-4, 5) / 2.0) ** 2)
+    smooth = np.convolve(counts, kernel / kernel.sum(), mode="same")
+    peaks = np.flatnonzero((smooth > np.roll(smooth, 1)) & (smooth >= np.roll(smooth, -1)))
+    peaks = peaks[np.argsort(smooth[peaks])[::-1]]
+    separation = math.log1p(thresholds.min_separation)
+    centers = []
+    for peak in peaks:
+        center = (edges[peak] + edges[peak + 1]) / 2
+        if all(abs(center - other) >= separation for other in centers):
+            centers.append(center)
+        if len(centers) == thresholds.max_gears:
+            break
+    centers = np.array(centers)
+
+    # k-means passes (1-D: assign to the nearest center, move each center to its cluster's median)
+    width = math.log1p(thresholds.tolerance)
+    for _ in range(iterations):
+        distance = np.abs(x[:, None] - centers[None, :])
+        nearest = np.argmin(distance, axis=1)
+        member = distance[np.arange(len(x)), nearest] <= width
+        updated = np.array([np.median(x[member & (nearest == i)]) if (member & (nearest == i)).any() else centers[i] for i in range(len(centers))])
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+
+    # k-means may have pulled centers together: merge the closest pair until all are `min_separation` apart
+    centers = np.sort(centers)
+    while len(centers) > 1:
+        gaps = np.diff(centers)
+        i = int(np.argmin(gaps))
+        if gaps[i] >= separation:
+            break
+        near = np.abs(x[:, None] - centers[None, i:i + 2]) <= width
+        merged = x[near.any(axis=1)]
+        center = np.median(merged) if len(merged) else (centers[i] + centers[i + 1]) / 2
+        centers = np.sort(np.concatenate((centers[:i], [center], centers[i + 2:])))
+
+    distance = np.abs(x[:, None] - centers[None, :])
+    nearest = np.argmin(distance, axis=1)
+    sizes = np.bincount(nearest[distance[np.arange(len(x)), nearest] <= width], minlength=len(centers))
+    keep = sizes >= thresholds.min_share * len(x)
+    order = np.argsort(centers[keep])[::-1]
+    return centers[keep][order], sizes[keep][order]
+
+
+def fit(columns: list[dict], thresholds: Thresholds = Thresholds()) -> GearModel:
+    """
+    Learns the gear ratios of a vehicle from its logs.
+
+    Parameters
+    ----------
+    `columns` : list[dict[str, np.ndarray]]
+        Log columns of one or more trips (as returned by `Logs.reader.read_arrays`), with `timestamp`, `speed` and `rpm`.
+    `thresholds` : Thresholds, optional
+        Settings of the estimation.
+
+    Returns
+    -------
+    `GearModel`
+        The learned model. Gears that were never driven steadily in the logs are missing from it; it is named only
+        if every gear was found or `thresholds.ratios` is given (see the module description).
+    """
+    if isinstance(columns, dict):
+        columns = [columns]
+    x = [_steady_ratios(trip, thresholds) for trip in columns]
+    return _model(np.concatenate(x) if x else np.empty(0), thresholds)
+
+
+def _model(x: np.ndarray, thresholds: Thresholds) -> GearModel:
+    """
+    Clusters log ratios and numbers the gears when that is possible.
+    """
+    centers, _ = cluster(x, thresholds)
+    ratios, numbers = np.exp(centers), None
+    if thresholds.ratios:
+        known = np.log(np.asarray(thresholds.ratios, dtype=np.float64))
+        distance = np.abs(centers[:, None] - known[None, :])
+        nearest = np.argmin(distance, axis=1) if len(centers) else np.empty(0, dtype=np.int64)
+        matched = distance[np.arange(len(centers)), nearest] <= math.log1p(thresholds.tolerance)
+        ratios, numbers = ratios[matched], (nearest[matched] + 1).tolist()
+    elif len(centers) == thresholds.max_gears:
+        numbers = list(range(1, len(centers) + 1))
+    return GearModel(ratios, thresholds.tolerance, thresholds.min_speed, thresholds.min_rpm, numbers)
+
+
+def _steady_ratios(columns: dict, thresholds: Thresholds) -> np.ndarray:
+    """
+    Log ratios of the steady samples of one trip.
+    """
+    mask = steady(columns["timestamp"], columns["speed"], columns["rpm"], thresholds)
+    return log_ratio(columns["speed"], columns["rpm"])[mask]
+
+
+def _read_ratios(path: str, thresholds: Thresholds) -> dict:
+    """
+    Reads the log ratios of the steady samples of a session log. Runs in a worker process.
+    """
+    return {"ratios": _steady_ratios(read_arrays(path), thresholds)}
+
+
+def fit_logs(roots: list[str], thresholds: Thresholds = Thresholds(), workers: int = None) -> tuple[GearModel, list[dict]]:
+    """
+    Learns the gear ratios of a vehicle from every session log below `roots`, read in parallel.
+
+    Parameters
+    ----------
+    `roots` : list[str]
+        Files or directories to search for session logs (of a single vehicle).
+    `thresholds` : Thresholds, optional
+        Settings of the estimation.
+    `workers` : int, optional
+        Number of worker processes (default is the number of CPUs).
+
+    Returns
+    -------
+    `tuple[GearModel, list[dict]]`
+        The learned model (see `fit`), and per log its `path` and `status` (`'ok'` or `'error'`, with the `error`).
+    """
+    x, results = [], []
+    for result in map_files(partial(_read_ratios, thresholds=thresholds), discover(roots), workers):
+        if result["status"] == "ok":
+            x.append(result.pop("ratios"))
+        results.append(result)
+    return _model(np.concatenate(x) if x else np.empty(0), thresholds), results
+
+
+
+
+class GearTracker:
+    """
+    Live gear estimation with hysteresis, one sample at a time in O(1).
+
+    A new gear is reported once it has been classified on `confirm` consecutive samples. Samples between gears
+    (shifting, clutch or torque converter slip) keep the current gear; stopping or idling reports `NEUTRAL` at once.
+    """
+    def __init__(self, model: GearModel, confirm: int = 2) -> "GearTracker":
+        """
+        Parameters
+        ----------
+        `model` : GearModel
+            The gear ratios of the vehicle.
+        `confirm` : int, optional
+            Number of consecutive samples needed to change gear (default is `2`).
+        """
+        self._model = model
+        self._confirm = confirm
+        self._candidate = NEUTRAL
+        self._count = 0
+        self.gear = NEUTRAL
+
+    def update(self, sample: dict) -> int:
+        """
+        Adds a sample (as returned by `Sonata.sample()`).
+
+        Returns
+        -------
+        `int`
+            The current gear, or `NEUTRAL`.
+        """
+        speed, rpm = sample.get("speed", math.nan), sample.get("rpm", math.nan)
+        if not (speed >= self._model.min_speed and rpm >= self._model.min_rpm):
+            self.gear, self._candidate, self._count = NEUTRAL, NEUTRAL, 0
+            return self.gear
+        gear = self._model.classify(speed, rpm)
+        if gear == NEUTRAL or gear == self.gear:
+            self._candidate, self._count = NEUTRAL, 0
+            return self.gear
+        if gear == self._candidate:
+            self._count += 1
+        else:
+            self._candidate, self._count = gear, 1
+        if self._count >= self._confirm:
+            self.gear, self._candidate, self._count = gear, NEUTRAL, 0
+        return self.gear
+
+    def reset(self) -> None:
+        """
+        Starts a new trip.
+        """
+        self._candidate, self._count = NEUTRAL, 0
+        self.gear = NEUTRAL
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Learn the gear ratios of a vehicle from its session logs.")
+    parser.add_argument("roots", nargs="+", help="Files or directories to search for session logs.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    model, results = fit_logs(args.roots, workers=args.workers)
+    for result in results:
+        if result["status"] != "ok":
+            print(f"  error  {result['path']}  ({result['error']})")
+    if not model.gears:
+        print("  no steady driving found")
+    elif not model.named:
+        print(f"  {model.gears} of {Thresholds().max_gears} gears found, ratios are not numbered")
+    labels = model.numbers if model.named else range(1, model.gears + 1)
+    for label, ratio in zip(labels, model.ratios):
+        print(f"  {'gear' if model.named else 'ratio'} {label}  {ratio:>7.1f} rpm per km/h  ({1000 / ratio:>6.1f} km/h per 1000 rpm)")
@@ -0,0 +1,272 @@
+"""
+# opmap.py
+
+Engine operating maps: 2D histograms over `rpm` x `calculated_engine_load`, showing where an engine spends its time
+and how it behaves there.
+
+Each cell of an `OperatingMap` holds the number of samples, the dwell time (each interval between two samples is
+credited to the cell of the sample that starts it) and the mean of chosen channels (e.g. `timing_advance`,
+`short_term_fuel_trim_bank1`). Cells are evenly spaced, so finding a sample's cell is plain arithmetic and a live
+update from `Sonata.sample()` costs O(1); whole logs are added at once with `np.bincount`. Maps only hold sums, so maps
+of different sessions or vehicles merge exactly, and they serialize to plain dictionaries (JSON, Firebase).
+
+Usage:
+    `python -m OBDModule.opmap <directory> [<directory> ...] [--workers N]`
+"""
+
+import argparse
+import numpy as np
+from functools import partial
+
+from Logs.ingest import discover
+from Logs.parallel import map_files
+from Logs.reader import read_arrays
+
+
+
+
+
+DEFAULT_CHANNELS = ("timing_advance", "short_term_fuel_trim_bank1", "intake_manifold_pressure")
+"""
+Channels averaged per cell when none are given.
+"""
+
+
+
+
+class OperatingMap:
+    """
+    Incrementally updated RPM x load histogram with per-cell dwell time and channel means.
+    """
+    def __init__(self, rpm: tuple[float, float, float] = (0.0, 7000.0, 250.0), load: tuple[float, float, float] = (0.0, 100.0, 5.0),
+                 channels: tuple[str, ...] = DEFAULT_CHANNELS, max_gap: float = 5.0) -> "OperatingMap":
+        """
+        Parameters
+        ----------
+        `rpm` : tuple[float, float, float], optional
+            `(low, high, step)` of the RPM axis (default is `(0, 7000, 250)`). Values outside it count in the edge cells.
+        `load` : tuple[float, float, float], optional
+            `(low, high, step)` of the calculated engine load axis, in % (default is `(0, 100, 5)`).
+        `channels` : tuple[str, ...], optional
+            Channels averaged per cell (default is `DEFAULT_CHANNELS`).
+        `max_gap` : float, optional
+            Intervals longer than this (seconds) add no dwell time (default is `5.0`).
+        """
+        self.rpm = tuple(float(value) for value in rpm)
+        self.load = tuple(float(value) for value in load)
+        self.channels = tuple(channels)
+        self.max_gap = max_gap
+        self._rows = max(1, int(round((self.rpm[1] - self.rpm[0]) / self.rpm[2])))
+        self._columns = max(1, int(round((self.load[1] - self.load[0]) / self.load[2])))
+        shape = (self._rows, self._columns)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.dwell = np.zeros(shape)
+        self._sums = np.zeros((len(self.channels),) + shape)
+        self._counts = np.zeros((len(self.channels),) + shape, dtype=np.int64)
+        self._previous = None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """
+        Number of RPM rows and load columns.
+        """
+        return self.count.shape
+
+    @property
+    def rpm_edges(self) -> np.ndarray:
+        return self.rpm[0] + np.arange(self._rows + 1) * self.rpm[2]
+
+    @property
+    def load_edges(self) -> np.ndarray:
+        return self.load[0] + np.arange(self._columns + 1) * self.load[2]
+
+
+    def _cell(self, rpm: float, load: float) -> tuple[int, int]:
+        """
+        Gets the cell of a sample, or `None` if RPM or load is missing.
+        """
+        if not (rpm == rpm and load == load):
+            return None
+        row = min(max(int((rpm - self.rpm[0]) // self.rpm[2]), 0), self._rows - 1)
+        column = min(max(int((load - self.load[0]) // self.load[2]), 0), self._columns - 1)
+        return row, column
+
+    def update(self, sample: dict) -> None:
+        """
+        Adds a sample (as returned by `Sonata.sample()`), in O(1).
+        """
+        time = float(sample["timestamp"])
+        if self._previous is not None:
+            previous_time, previous_cell = self._previous
+            dt = time - previous_time
+            if previous_cell is not None and 0 < dt <= self.max_gap:
+                self.dwell[previous_cell] += dt
+        cell = self._cell(float(sample.get("rpm", np.nan)), float(sample.get("calculated_engine_load", np.nan)))
+        self._previous = (time, cell)
+        if cell is None:
+            return
+        self.count[cell] += 1
+        for i, name in enumerate(self.channels):
+            value = float(sample.get(name, np.nan))
+            if value == value:
+                self._sums[i][cell] += value
+                self._counts[i][cell] += 1
+
+    def feed_arrays(self, columns: dict[str, np.ndarray]) -> None:
+        """
+        Adds every sample of a log at once (vectorized, same result as calling `update` on each).
+
+        Parameters
+        ----------
+        `columns` : dict[str, np.ndarray]
+            Log columns (as returned by `Logs.reader.read_arrays`), with `timestamp`, `rpm` and `calculated_engine_load`.
+        """
+        time = np.asarray(columns["timestamp"], dtype=np.float64)
+        if not len(time):
+            return
+        rpm = np.asarray(columns["rpm"], dtype=np.float64)
+        load = np.asarray(columns["calculated_engine_load"], dtype=np.float64)
+        valid = ~np.isnan(rpm) & ~np.isnan(load)
+        rpm_index = np.clip(np.floor_divide(np.nan_to_num(rpm) - self.rpm[0], self.rpm[2]), 0, self._rows - 1).astype(np.int64)
+        load_index = np.clip(np.floor_divide(np.nan_to_num(load) - self.load[0], self.load[2]), 0, self._columns - 1).astype(np.int64)
+        flat = rpm_index * self._columns + load_index
+        size = self.count.size
+
+        if self._previous is not None:
+            previous_time, previous_cell = self._previous
+            dt = time[0] - previous_time
+            if previous_cell is not None and 0 < dt <= self.max_gap:
+                self.dwell[previous_cell] += dt
+        dt = np.diff(time)
+        credited = valid[:-1] & (dt > 0) & (dt <= self.max_gap)
+        self.dwell += np.bincount(flat[:-1][credited], weights=dt[credited], minlength=size).reshape(self.shape)
+        self.count += np.bincount(flat[valid], minlength=size).reshape(self.shape)
+        for i, name in enumerate(self.channels):
+            if name not in columns:
+                continue
+            values = np.asarray(columns[name], dtype=np.float64)
+            present = valid & ~np.isnan(values)
+            self._sums[i] += np.bincount(flat[present], weights=values[present], minlength=size).reshape(self.shape)
+            self._counts[i] += np.bincount(flat[present], minlength=size).reshape(self.shape)
+        self._previous = (float(time[-1]), (int(rpm_index[-1]), int(load_index[-1])) if valid[-1] else None)
+
+    def reset_session(self) -> None:
+        """
+        Forgets the last sample, so that the next one (e.g. of a new session) adds no dwell time.
+        """
+        self._previous = None
+
+
+    def mean(self, name: str) -> np.ndarray:
+        """
+        Gets the per-cell mean of a channel.
+
+        Returns
+        -------
+        `np.ndarray`
+            The mean of each cell (`nan` where the channel has no value).
+        """
+        i = self.channels.index(name)
+        with np.errstate(all="ignore"):
+            return np.where(self._counts[i] > 0, self._sums[i] / self._counts[i], np.nan)
+
+    def dwell_fraction(self) -> np.ndarray:
+        """
+        Gets the fraction of the total dwell time spent in each cell.
+        """
+        total = self.dwell.sum()
+        return self.dwell / total if total > 0 else np.zeros(self.shape)
+
+    def merge(self, other: "OperatingMap") -> "OperatingMap":
+        """
+        Adds another map (e.g. of another session) into this one. Both must have the same axes and channels.
+        """
+        if (self.rpm, self.load, self.channels) != (other.rpm, other.load, other.channels):
+            raise ValueError("Cannot merge operating maps with different axes or channels")
+        self.count += other.count
+        self.dwell += other.dwell
+        self._sums += other._sums
+        self._counts += other._counts
+        return self
+
+
+    def to_dict(self) -> dict:
+        return {
+            "rpm": list(self.rpm),
+            "load": list(self.load),
+            "channels": list(self.channels),
+            "max_gap": self.max_gap,
+            "count": self.count.tolist(),
+            "dwell": self.dwell.tolist(),
+            "sums": {name: self._sums[i].tolist() for i, name in enumerate(self.channels)},
+            "counts": {name: self._counts[i].tolist() for i, name in enumerate(self.channels)},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "OperatingMap":
+        operating_map = cls(data["rpm"], data["load"], data["channels"], data["max_gap"])
+        operating_map.count[:] = data["count"]
+        operating_map.dwell[:] = data["dwell"]
+        for i, name in enumerate(operating_map.channels):
+            operating_map._sums[i] = data["sums"][name]
+            operating_map._counts[i] = data["counts"][name]
+        return operating_map
+
+
+
+
+def _map_file(path: str, settings: dict) -> dict:
+    """
+    Builds the operating map of a single session log. Runs in a worker process.
+    """
+    operating_map = OperatingMap(**settings)
+    operating_map.feed_arrays(read_arrays(path))
+    return {"map": operating_map.to_dict()}
+
+
+def map_logs(roots: list[str], rpm: tuple[float, float, float] = (0.0, 7000.0, 250.0), load: tuple[float, float, float] = (0.0, 100.0, 5.0),
+             channels: tuple[str, ...] = DEFAULT_CHANNELS, max_gap: float = 5.0, workers: int = None) -> tuple[OperatingMap, list[dict]]:
+    """
+    Builds the combined operating map of every session log below `roots`, in parallel.
+
+    Parameters
+    ----------
+    `roots` : list[str]
+        Files or directories to search for session logs.
+    `rpm`, `load`, `channels`, `max_gap` : optional
+        As for `OperatingMap`.
+    `workers` : int, optional
+        Number of worker processes (default is the number of CPUs).
+
+    Returns
+    -------
+    `tuple[OperatingMap, list[dict]]`
+        The merged map, and per log its `path` and `status` (`'ok'` or `'error'`, with the `error`).
+    """
+    settings = {"rpm": rpm, "load": load, "channels": channels, "max_gap": max_gap}
+    combined = OperatingMap(**settings)
+    results = []
+    for result in map_files(partial(_map_file, settings=settings), discover(roots), workers):
+        if result["status"] == "ok":
+            combined.merge(OperatingMap.from_dict(result.pop("map")))
+        results.append(result)
+    return combined, results
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the RPM x load operating map of session logs.")
+    parser.add_argument("roots", nargs="+", help="Files or directories to search for session logs.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    operating_map, results = map_logs(args.roots, rpm=(0.0, 7000.0, 500.0), load=(0.0, 100.0, 10.0), workers=args.workers)
+    for result in results:
+        if result["status"] != "ok":
+            print(f"  error  {result['path']}  ({result['error']})")
+    fraction = operating_map.dwell_fraction()
+    print("  dwell time (%), rpm rows x load columns")
+    print("  " + " " * 6 + "".join(f"{edge:>6.0f}" for edge in operating_map.load_edges[:-1]))
+    for row, edge in reversed(list(enumerate(operating_map.rpm_edges[:-1]))):
+        print(f"  {edge:>6.0f}" + "".join(f"{100 * value:>6.1f}" if value > 0 else f"{'.':>6}" for value in fraction[row]))
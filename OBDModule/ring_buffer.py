@@ -0,0 +1,236 @@
+"""
+# ring_buffer.py
+
+Defines the RingBuffer and RingBuffers classes, which keep the most recent samples of each watched PID in
+fixed, preallocated NumPy arrays and answer window queries over them (e.g. "what did RPM do in the last 30 seconds").
+"""
+
+import numpy as np
+
+
+
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of `(time, value)` samples for a single channel.
+
+    Every sample is written twice, `capacity` slots apart, so the latest `capacity` samples are always contiguous
+    in memory. Window queries can therefore return views into the buffer instead of copies.
+    Views are only valid until the buffer wraps around over them; copy them if they must outlive that.
+    """
+    def __init__(self, capacity: int) -> "RingBuffer":
+        """
+        Parameters
+        ----------
+        `capacity` : int
+            Maximum number of samples kept.
+        """
+        self._capacity = capacity
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+        self._values = np.zeros(2 * capacity, dtype=np.float64)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+
+    @property
+    def capacity(self) -> int:
+        """
+        Maximum number of samples kept.
+        """
+        return self._capacity
+
+    @property
+    def times(self) -> np.ndarray:
+        """
+        Times of every buffered sample, oldest first (a view).
+        """
+        return self._times[self._next + self._capacity - self._count:self._next + self._capacity]
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        Values of every buffered sample, oldest first (a view).
+        """
+        return self._values[self._next + self._capacity - self._count:self._next + self._capacity]
+
+
+    def push(self, time: float, value: float) -> None:
+        """
+        Adds a sample, overwriting the oldest one once the buffer is full.
+
+        Parameters
+        ----------
+        `time` : float
+            Time of the sample, in seconds. Must not decrease between calls.
+        `value` : float
+            Value of the sample.
+        """
+        i = self._next
+        self._times[i] = self._times[i + self._capacity] = time
+        self._values[i] = self._values[i + self._capacity] = value
+        self._next = (i + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+
+    def clear(self) -> None:
+        """
+        Drops every buffered sample.
+        """
+        self._next = 0
+        self._count = 0
+
+
+    def last(self, seconds: float, now: float = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the samples of the last `seconds` seconds.
+
+        Parameters
+        ----------
+        `seconds` : float
+            Length of the window.
+        `now` : float, optional
+            End of the window (default is the time of the latest sample).
+
+        Returns
+        -------
+        `tuple[np.ndarray, np.ndarray]`
+            Views of the times and values in the window, oldest first.
+        """
+        times, values = self.times, self.values
+        if self._count == 0:
+            return times, values
+        end = times[-1] if now is None else now
+        lo = np.searchsorted(times, end - seconds, side="left")
+        hi = np.searchsorted(times, end, side="right")
+        return times[lo:hi], values[lo:hi]
+
+    def mean(self, seconds: float, now: float = None) -> float:
+        """
+        Gets the mean value over the last `seconds` seconds (`nan` if the window is empty).
+        """
+        _, values = self.last(seconds, now)
+        return float(np.nanmean(values)) if len(values) else float("nan")
+
+    def max(self, seconds: float, now: float = None) -> float:
+        """
+        Gets the maximum value over the last `seconds` seconds (`nan` if the window is empty).
+        """
+        _, values = self.last(seconds, now)
+        return float(np.nanmax(values)) if len(values) else float("nan")
+
+    def min(self, seconds: float, now: float = None) -> float:
+        """
+        Gets the minimum value over the last `seconds` seconds (`nan` if the window is empty).
+        """
+        _, values = self.last(seconds, now)
+        return float(np.nanmin(values)) if len(values) else float("nan")
+
+    def slope(self, seconds: float, now: float = None) -> float:
+        """
+        Gets the least-squares rate of change over the last `seconds` seconds, in units per second.
+
+        Returns
+        -------
+        `float`
+            The slope, or `nan` if the window holds fewer than two samples at distinct times.
+        """
+        times, values = self.last(seconds, now)
+        valid = ~np.isnan(values)
+        if valid.sum() < 2:
+            return float("nan")
+        t = times[valid] - times[valid].mean()
+        denominator = np.dot(t, t)
+        if denominator == 0:
+            return float("nan")
+        return float(np.dot(t, values[valid] - values[valid].mean()) / denominator)
+
+
+
+
+class RingBuffers:
+    """
+    One `RingBuffer` per channel, fed from `Sonata.sample()` samples or from `SonataAsync` watch callbacks.
+    """
+    def __init__(self, capacity: int = 1024) -> "RingBuffers":
+        """
+        Parameters
+        ----------
+        `capacity` : int, optional
+            Maximum number of samples kept per channel (default is `1024`).
+        """
+        self._capacity = capacity
+        self._buffers = {}
+
+    def __getitem__(self, name: str) -> RingBuffer:
+        return self._buffers[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._buffers
+
+    def __iter__(self):
+        return iter(self._buffers)
+
+
+    def buffer(self, name: str) -> RingBuffer:
+        """
+        Gets the buffer of a channel, creating it if needed.
+
+        Parameters
+        ----------
+        `name` : str
+            Name of the channel (or of the `obd` command).
+
+        Returns
+        -------
+        `RingBuffer`
+            The channel's buffer.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            buffer = self._buffers[name] = RingBuffer(self._capacity)
+        return buffer
+
+    def push(self, name: str, time: float, value: float) -> None:
+        """
+        Adds one sample to the buffer of a channel.
+        """
+        self.buffer(name).push(time, value)
+
+    def feed(self, sample: dict) -> None:
+        """
+        Adds every channel of a sample (as returned by `Sonata.sample()`) to its buffer.
+        """
+        time = sample["timestamp"]
+        for name, value in sample.items():
+            if name != "timestamp":
+                self.buffer(name).push(time, value)
+
+    def callback(self, name: str):
+        """
+        Makes an `obd.Async` watch callback that pushes every new response into the buffer of `name`.
+
+        Parameters
+        ----------
+        `name` : str
+            Name of the buffer to feed.
+
+        Returns
+        -------
+        `Callable[[obd.OBDResponse], None]`
+            The callback.
+        """
+        buffer = self.buffer(name)
+
+        def _on_response(response) -> None:
+            if response.is_null():
+                return
+            try: value = response.value.magnitude
+            except AttributeError: value = response.value
+            try: buffer.push(response.time, float(value))
+            except (TypeError, ValueError): pass
+
+        return _on_response
@@ -0,0 +1,399 @@
+"""
+# stats.py
+
+Defines incremental, constant-memory statistics for the sample stream of `Sonata` / `SonataAsync`.
+
+`RunningStats` keeps count, mean and variance (Welford's algorithm), minimum and maximum. `QuantileSketch` estimates
+percentiles within a fixed relative error, from logarithmically spaced buckets whose number is bounded. Both can be
+merged exactly, so the statistics of several sessions are the merge of the statistics of each one. `StreamStats`
+keeps one of each per channel and is fed sample by sample (or from `SonataAsync.watch`), so a trip's summary is
+ready the moment the trip ends.
+"""
+
+import math
+import numpy as np
+
+
+
+
+
+class RunningStats:
+    """
+    Count, mean, variance, minimum and maximum of a stream of values, updated in O(1) (missing values are skipped,
+    and infinite ones, which would make the mean and variance non-finite for good, are only counted in `nonfinite`).
+    """
+    def __init__(self) -> "RunningStats":
+        self.count = 0
+        self.nonfinite = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def variance(self) -> float:
+        """
+        Sample variance (`nan` with fewer than two values).
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self) -> float:
+        """
+        Sample standard deviation (`nan` with fewer than two values).
+        """
+        return math.sqrt(self.variance) if self.count > 1 else math.nan
+
+
+    def update(self, value: float) -> None:
+        """
+        Adds one value (`nan` and `None` are ignored, infinite values counted in `nonfinite`).
+        """
+        if value is None or value != value:
+            return
+        value = float(value)
+        if not math.isfinite(value):
+            self.nonfinite += 1
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def update_many(self, values: np.ndarray) -> None:
+        """
+        Adds many values at once (vectorized, then merged in).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.nonfinite += int(np.isinf(values).sum())
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        batch = RunningStats()
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch._m2 = float(((values - batch.mean) ** 2).sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        self.merge(batch)
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """
+        Merges the statistics of another stream into these (Chan et al.'s parallel update). Returns `self`.
+        """
+        self.nonfinite += other.nonfinite
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+
+    def to_dict(self) -> dict:
+        """
+        Serializes the statistics (JSON-compatible); `from_dict` restores them.
+        """
+        return {"count": self.count, "mean": self.mean, "m2": self._m2, "min": self.min if self.count else None, "max": self.max if self.count else None,
+                "nonfinite": self.nonfinite}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunningStats":
+        stats = cls()
+        stats.count, stats.mean, stats._m2 = data["count"], data["mean"], data["m2"]
+        stats.nonfinite = data.get("nonfinite", 0)
+        if stats.count:
+            stats.min, stats.max = data["min"], data["max"]
+        return stats
+
+
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy (as in DDSketch).
+
+    Every value `x` is counted in bucket `ceil(log(|x|) / log(gamma))` of its sign, with `gamma = (1 + a) / (1 - a)`,
+    so any quantile is returned within a relative error `a` of the true value. Values closer to zero than
+    `min_value` are counted as zero; infinite values are skipped. When there are more than `max_buckets` buckets, the ones nearest to zero are
+    collapsed, which only affects the accuracy of the lowest quantiles.
+    """
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048, min_value: float = 1e-9) -> "QuantileSketch":
+        """
+        Parameters
+        ----------
+        `relative_accuracy` : float, optional
+            Relative error of the returned quantiles (default is `0.01`, i.e. 1%).
+        `max_buckets` : int, optional
+            Maximum number of buckets kept (default is `2048`).
+        `min_value` : float, optional
+            Magnitude below which values count as zero (default is `1e-9`).
+        """
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._max_buckets = max_buckets
+        self._min_value = min_value
+        self._positive = {}
+        self._negative = {}
+        self._zero = 0
+        self.count = 0
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+
+    def update(self, value: float) -> None:
+        """
+        Adds one value (`nan`, infinite values and `None` are ignored).
+        """
+        if value is None or not math.isfinite(value):
+            return
+        self.count += 1
+        if value > self._min_value:
+            key = self._key(value)
+            self._positive[key] = self._positive.get(key, 0) + 1
+        elif value < -self._min_value:
+            key = self._key(-value)
+            self._negative[key] = self._negative.get(key, 0) + 1
+        else:
+            self._zero += 1
+            return
+        if len(self._positive) + len(self._negative) > self._max_buckets:
+            self._collapse()
+
+    def update_many(self, values: np.ndarray) -> None:
+        """
+        Adds many values at once (vectorized).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        self.count += len(values)
+        for store, magnitudes in ((self._positive, values[values > self._min_value]), (self._negative, -values[values < -self._min_value])):
+            if len(magnitudes):
+                keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64), return_counts=True)
+                for key, count in zip(keys.tolist(), counts.tolist()):
+                    store[key] = store.get(key, 0) + count
+        self._zero += int((np.abs(values) <= self._min_value).sum())
+        if len(self._positive) + len(self._negative) > self._max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        """
+        Folds the buckets nearest to zero into their neighbour until at most `max_buckets` are left.
+        """
+        while len(self._positive) + len(self._negative) > self._max_buckets:
+            store = self._negative if len(self._negative) > len(self._positive) else self._positive
+            lowest, second = sorted(store)[:2]
+            store[second] += store.pop(lowest)
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Merges another sketch (with the same relative accuracy) into this one. Returns `self`.
+        """
+        if not math.isclose(other._gamma, self._gamma):
+            raise ValueError("Cannot merge sketches with different relative accuracies")
+        for store, others in ((self._positive, other._positive), (self._negative, other._negative)):
+            for key, count in others.items():
+                store[key] = store.get(key, 0) + count
+        self._zero += other._zero
+        self.count += other.count
+        if len(self._positive) + len(self._negative) > self._max_buckets:
+            self._collapse()
+        return self
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile.
+
+        Parameters
+        ----------
+        `q` : float
+            The quantile, between `0` and `1` (e.g. `0.99`).
+
+        Returns
+        -------
+        `float`
+            The estimate (`nan` if the sketch is empty).
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self._zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self._positive)) if self._positive else 0.0
+
+
+    def to_dict(self) -> dict:
+        """
+        Serializes the sketch (JSON-compatible); `from_dict` restores it.
+        """
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_buckets": self._max_buckets,
+            "min_value": self._min_value,
+            "positive": {str(key): count for key, count in self._positive.items()},
+            "negative": {str(key): count for key, count in self._negative.items()},
+            "zero": self._zero,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantileSketch":
+        sketch = cls(data["relative_accuracy"], data["max_buckets"], data["min_value"])
+        sketch._positive = {int(key): count for key, count in data["positive"].items()}
+        sketch._negative = {int(key): count for key, count in data["negative"].items()}
+        sketch._zero = data["zero"]
+        sketch.count = data["count"]
+        return sketch
+
+
+
+
+class StreamStats:
+    """
+    `RunningStats` and `QuantileSketch` of every channel of a sample stream.
+    """
+    def __init__(self, relative_accuracy: float = 0.01, quantiles: tuple[float, ...] = (0.5, 0.9, 0.99)) -> "StreamStats":
+        """
+        Parameters
+        ----------
+        `relative_accuracy` : float, optional
+            Relative error of the quantile sketches (default is `0.01`).
+        `quantiles` : tuple[float, ...], optional
+            Quantiles reported by `summary` (default is the median, 90th and 99th percentiles).
+        """
+        self._relative_accuracy = relative_accuracy
+        self._quantiles = quantiles
+        self._stats = {}
+        self._sketches = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stats
+
+    def __iter__(self):
+        return iter(self._stats)
+
+    def stats(self, name: str) -> RunningStats:
+        """
+        Gets the running statistics of a channel, creating them if needed.
+        """
+        if name not in self._stats:
+            self._stats[name] = RunningStats()
+            self._sketches[name] = QuantileSketch(self._relative_accuracy)
+        return self._stats[name]
+
+    def sketch(self, name: str) -> QuantileSketch:
+        """
+        Gets the quantile sketch of a channel, creating it if needed.
+        """
+        self.stats(name)
+        return self._sketches[name]
+
+
+    def update(self, name: str, value: float) -> None:
+        """
+        Adds one value of a channel.
+        """
+        self.stats(name).update(value)
+        self._sketches[name].update(value)
+
+    def feed(self, sample: dict) -> None:
+        """
+        Adds every channel of a sample (as returned by `Sonata.sample()`).
+        """
+        for name, value in sample.items():
+            if name != "timestamp":
+                self.update(name, value)
+
+    def feed_arrays(self, columns: dict[str, np.ndarray]) -> None:
+        """
+        Adds whole columns at once (e.g. from `Logs.reader.read_arrays`), vectorized.
+        """
+        for name, values in columns.items():
+            if name != "timestamp":
+                self.stats(name).update_many(values)
+                self._sketches[name].update_many(values)
+
+    def callback(self, name: str):
+        """
+        Makes an `obd.Async` watch callback that adds every new response to the statistics of `name`
+        (see `SonataAsync.watch`).
+        """
+        def _on_response(response) -> None:
+            if response.is_null():
+                return
+            try: value = response.value.magnitude
+            except AttributeError: value = response.value
+            try: self.update(name, float(value))
+            except (TypeError, ValueError): pass
+
+        return _on_response
+
+    def merge(self, other: "StreamStats") -> "StreamStats":
+        """
+        Merges the statistics of another stream (e.g. another session) into these. Returns `self`.
+        """
+        for name in other:
+            self.stats(name).merge(other._stats[name])
+            self._sketches[name].merge(other._sketches[name])
+        return self
+
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Summarizes every channel.
+
+        Returns
+        -------
+        `dict[str, dict]`
+            Per channel: `count`, `mean`, `std`, `min`, `max`, `nonfinite` (infinite values skipped), and one `p<percent>`
+            entry per quantile (e.g. `p99`).
+        """
+        summary = {}
+        for name, stats in self._stats.items():
+            entry = {"count": stats.count, "mean": stats.mean if stats.count else math.nan, "std": stats.std,
+                     "min": stats.min if stats.count else math.nan, "max": stats.max if stats.count else math.nan, "nonfinite": stats.nonfinite}
+            for q in self._quantiles:
+                entry[f"p{q * 100:g}"] = self._sketches[name].quantile(q)
+            summary[name] = entry
+        return summary
+
+    def to_dict(self) -> dict:
+        """
+        Serializes every channel's statistics (JSON-compatible), e.g. to keep them across sessions; `from_dict` restores them.
+        """
+        return {
+            "relative_accuracy": self._relative_accuracy,
+            "quantiles": list(self._quantiles),
+            "channels": {name: {"stats": self._stats[name].to_dict(), "sketch": self._sketches[name].to_dict()} for name in self._stats},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StreamStats":
+        stream = cls(data["relative_accuracy"], tuple(data["quantiles"]))
+        for name, entry in data["channels"].items():
+            stream._stats[name] = RunningStats.from_dict(entry["stats"])
+            stream._sketches[name] = QuantileSketch.from_dict(entry["sketch"])
+        return stream
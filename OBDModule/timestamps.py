@@ -0,0 +1,225 @@
+"""
+# timestamps.py
+
+Per-channel acquisition timestamps around `Sonata` / `SonataAsync`, and alignment of all channels to one instant.
+
+`Sonata.sample()` queries the channels one after another but stamps the whole row with the time it started, so the
+last channel of a row is up to a few hundred milliseconds older than that time says. `TimedSampler` records, for every
+single response, the midpoint of its request (from the monotonic high-resolution clock, mapped onto wall-clock time);
+under `SonataAsync`, whose getters return the responses cached by the watch loop, it records the time python-OBD
+received each response instead (mapped onto the same clock), and the row's instant is the oldest of these times, since
+every cached response is older than the read itself. `Aligner` then interpolates every channel between its previous
+and current response to the row's instant, which lies inside every channel's interval, so no value is extrapolated.
+
+Per-channel times only live in memory: session logs have one timestamp per row, so rows are aligned (`Aligner`,
+or `collect` and `align_arrays` for a batch) before they are written.
+"""
+
+import obd
+import time
+import numpy as np
+from collections import namedtuple
+
+from OBDModule.channels import CHANNELS, channel
+
+
+
+
+
+TimedSample = namedtuple("TimedSample", ["timestamp", "values", "times"])
+"""
+One row of responses with their own timestamps.
+
+- `timestamp`: Wall-clock time at which the row started (seconds since the epoch), as in `Sonata.sample()`;
+  under `SonataAsync`, the time of the oldest response in the row.
+- `values`: Value of each channel, keyed by channel name (`nan` if it could not be read).
+- `times`: Acquisition time of each channel (seconds since the epoch, monotonic), keyed by channel name.
+"""
+
+
+
+
+class Clock:
+    """
+    Monotonic, high-resolution clock expressed in seconds since the epoch.
+
+    The wall clock is read once, at creation; later readings add the elapsed `perf_counter` time to it,
+    so they never go backwards (e.g. when the Pi's clock is corrected by NTP) and have sub-microsecond resolution.
+    """
+    def __init__(self) -> "Clock":
+        self._epoch = time.time()
+        self._origin = time.perf_counter()
+
+    def __call__(self) -> float:
+        return self._epoch + (time.perf_counter() - self._origin)
+
+
+
+
+class TimedSampler:
+    """
+    Queries channels through `Sonata` / `SonataAsync` and timestamps every response individually.
+    """
+    def __init__(self, sonata, channels: list[str] = None, clock: Clock = None) -> "TimedSampler":
+        """
+        Parameters
+        ----------
+        `sonata` : Sonata or SonataAsync
+            The connected vehicle interface.
+        `channels` : list[str], optional
+            Names of the channels to query, in query order (default is every logged channel).
+        `clock` : Clock, optional
+            Clock used for every timestamp (default is a new `Clock`).
+        """
+        self._clock = clock if clock is not None else Clock()
+        self._names = list(channels) if channels is not None else [entry.name for entry in CHANNELS]
+        self._connection = getattr(sonata, "connection", None)
+        self._watched = isinstance(self._connection, obd.Async)
+        self._getters = []
+        for name in self._names:
+            entry = channel(name)
+            self._getters.append((name, getattr(sonata, entry.getter), entry.kwargs, obd.commands[entry.command]))
+
+    @property
+    def channels(self) -> list[str]:
+        """
+        Names of the queried channels, in query order.
+        """
+        return self._names
+
+
+    def sample(self) -> TimedSample:
+        """
+        Queries each channel once.
+
+        Returns
+        -------
+        `TimedSample`
+            The values, each with the midpoint of its own request as its acquisition time (or, under `SonataAsync`,
+            the time its cached response was received).
+        """
+        if self._watched:
+            return self._sample_watched()
+        clock = self._clock
+        values, times = {}, {}
+        started = clock()
+        for name, getter, kwargs, _ in self._getters:
+            before = clock()
+            try: values[name] = float(getter(**kwargs))
+            except Exception: values[name] = float("nan")
+            times[name] = (before + clock()) / 2
+        return TimedSample(started, values, times)
+
+    def _sample_watched(self) -> TimedSample:
+        """
+        Reads each channel from the watch cache of an `obd.Async` connection, with the time of its cached response.
+        """
+        values, times = {}, {}
+        offset = self._clock() - time.time()    # maps python-OBD's `time.time()` stamps onto the sampler's clock
+        for name, getter, kwargs, command in self._getters:
+            for _ in range(3):      # the watch loop may replace the response while the getter reads it
+                response = self._connection.query(command)
+                try: value = float(getter(**kwargs))
+                except Exception: value = float("nan")
+                if self._connection.query(command) is response:
+                    break
+            values[name] = value
+            times[name] = float(response.time) + offset if not response.is_null() else float("nan")
+        known = [t for t in times.values() if t == t]
+        return TimedSample(min(known) if known else self._clock(), values, times)
+
+
+
+
+def collect(samples: list[TimedSample]) -> tuple[np.ndarray, dict[str, np.ndarray], dict[str, np.ndarray]]:
+    """
+    Stacks timed samples into arrays, as taken by `align_arrays`.
+
+    Returns
+    -------
+    `tuple[np.ndarray, dict[str, np.ndarray], dict[str, np.ndarray]]`
+        The row timestamps, and the acquisition times and values of each channel.
+    """
+    names = list(samples[0].values) if samples else []
+    instants = np.array([sample.timestamp for sample in samples], dtype=np.float64)
+    times = {name: np.array([sample.times.get(name, np.nan) for sample in samples], dtype=np.float64) for name in names}
+    values = {name: np.array([sample.values.get(name, np.nan) for sample in samples], dtype=np.float64) for name in names}
+    return instants, times, values
+
+
+def align_arrays(times: dict[str, np.ndarray], values: dict[str, np.ndarray], instants: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Interpolates every channel of a batch of timed samples (see `collect`) to common instants (vectorized).
+
+    Parameters
+    ----------
+    `times` : dict[str, np.ndarray]
+        Acquisition times of each channel (increasing).
+    `values` : dict[str, np.ndarray]
+        Values of each channel, keyed like `times`. Missing (`nan`) values are skipped.
+    `instants` : np.ndarray
+        The common instants, e.g. the row timestamps.
+
+    Returns
+    -------
+    `dict[str, np.ndarray]`
+        `timestamp` (the instants) and every channel at those instants (`nan` outside the channel's time range).
+    """
+    instants = np.asarray(instants, dtype=np.float64)
+    aligned = {"timestamp": instants}
+    for name, channel_values in values.items():
+        t = np.asarray(times[name], dtype=np.float64)
+        v = np.asarray(channel_values, dtype=np.float64)
+        valid = ~np.isnan(v) & ~np.isnan(t)
+        if valid.sum() < 1:
+            aligned[name] = np.full(len(instants), np.nan)
+            continue
+        aligned[name] = np.interp(instants, t[valid], v[valid], left=np.nan, right=np.nan)
+    return aligned
+
+
+
+
+class Aligner:
+    """
+    Streaming alignment: turns each timed sample into a sample with every channel at one common instant.
+    """
+    def __init__(self, max_gap: float = 2.0) -> "Aligner":
+        """
+        Parameters
+        ----------
+        `max_gap` : float, optional
+            A channel whose previous and current responses are further apart than this (seconds) is not interpolated;
+            its current value is used as is (default is `2.0`).
+        """
+        self._max_gap = max_gap
+        self._previous = {}
+
+    def update(self, sample: TimedSample) -> dict:
+        """
+        Aligns a timed sample.
+
+        Parameters
+        ----------
+        `sample` : TimedSample
+            The latest timed sample (from `TimedSampler.sample()`).
+
+        Returns
+        -------
+        `dict`
+            A sample shaped like `Sonata.sample()`'s: `timestamp` (the start of the row) and each channel's value
+            interpolated to it. On the first call, or after a gap, a channel keeps its own (unaligned) value.
+        """
+        instant = sample.timestamp
+        aligned = {"timestamp": instant}
+        for name, value in sample.values.items():
+            t = sample.times[name]
+            previous = self._previous.get(name)
+            if previous is not None and value == value and previous[0] < instant <= t and t - previous[0] <= self._max_gap:
+                t0, v0 = previous
+                aligned[name] = v0 + (value - v0) * (instant - t0) / (t - t0)
+            else:
+                aligned[name] = value
+            if value == value:
+                self._previous[name] = (t, value)
+        return aligned
@@ -0,0 +1,270 @@
+"""
+# triggers.py
+
+Event-triggered high-rate capture around `Sonata` / `SonataAsync`.
+
+Normally every logged channel is sampled at the steady logging rate, and the last few seconds are kept in a
+pre-trigger buffer. Every sample is checked against the `Trigger` rules (hard acceleration, RPM spike, ...). When one
+fires, `TriggeredCapture` switches to that trigger's reduced channel set and samples it back to back (as fast as the
+adapter answers, since fewer PIDs are queried per row) for the trigger's duration. The pre-trigger buffer and the
+capture are then saved together as a separate event record, a session log whose metadata describes the event.
+
+Besides the sampled channels, conditions see `mil_on`: whether the Malfunction Indicator Lamp is on (`1`) or off (`0`),
+read from `Sonata.DTCs.status_since_last_clear()` every `mil_interval` seconds (the status changes rarely, so it is
+not queried on every row). It is not written to the logs.
+"""
+
+import os
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+from Logs.session import SessionWriter, session_metadata
+from OBDModule.channels import CHANNELS
+
+
+
+
+
+Trigger = namedtuple("Trigger", ["name", "condition", "channels", "duration", "cooldown"], defaults=(5.0, 30.0))
+"""
+A rule that starts a high-rate capture.
+
+- `name`: Name of the trigger, used in the event record.
+- `condition`: `Callable[[dict, dict], bool]`, called with the current and the previous sample (`None` at first), both with `mil_on`.
+- `channels`: Names of the channels captured at high rate.
+- `duration`: Length of the capture, in seconds.
+- `cooldown`: Seconds after a capture during which the trigger cannot fire again.
+"""
+
+
+
+
+def above(name: str, threshold: float):
+    """
+    Condition: the channel is above `threshold`.
+    """
+    return lambda sample, previous: sample.get(name, float("nan")) > threshold
+
+
+def below(name: str, threshold: float):
+    """
+    Condition: the channel is below `threshold`.
+    """
+    return lambda sample, previous: sample.get(name, float("nan")) < threshold
+
+
+def rate_above(name: str, rate: float):
+    """
+    Condition: the channel rises faster than `rate` units per second since the previous sample
+    (use a negative `rate` with `rate_below` for drops).
+    """
+    def _condition(sample: dict, previous: dict) -> bool:
+        if previous is None or sample["timestamp"] <= previous["timestamp"]:
+            return False
+        return (sample.get(name, float("nan")) - previous.get(name, float("nan"))) / (sample["timestamp"] - previous["timestamp"]) > rate
+    return _condition
+
+
+def rate_below(name: str, rate: float):
+    """
+    Condition: the channel changes slower than `rate` units per second since the previous sample (e.g. `-15` for a fast drop).
+    """
+    def _condition(sample: dict, previous: dict) -> bool:
+        if previous is None or sample["timestamp"] <= previous["timestamp"]:
+            return False
+        return (sample.get(name, float("nan")) - previous.get(name, float("nan"))) / (sample["timestamp"] - previous["timestamp"]) < rate
+    return _condition
+
+
+def changes_to(name: str, value):
+    """
+    Condition: the channel takes `value` after having another value.
+    """
+    return lambda sample, previous: previous is not None and previous.get(name) != value and sample.get(name) == value
+
+
+
+
+DEFAULT_TRIGGERS = (
+    Trigger("hard_acceleration", rate_above("speed", 10.0), ("speed", "rpm", "absolute_throttle_pos", "calculated_engine_load"), 5.0),
+    Trigger("hard_braking", rate_below("speed", -15.0), ("speed", "rpm", "absolute_throttle_pos"), 5.0),
+    Trigger("rpm_spike", above("rpm", 5000.0), ("rpm", "absolute_throttle_pos", "calculated_engine_load", "timing_advance"), 3.0),
+    Trigger("mil_on", changes_to("mil_on", 1), ("rpm", "calculated_engine_load", "coolant_temperature", "short_term_fuel_trim_bank1", "timing_advance"), 5.0),
+)
+"""
+Triggers used when none are given.
+"""
+
+
+
+
+class TriggeredCapture:
+    """
+    Sampling scheduler that switches to a reduced, high-rate channel set when a trigger fires.
+    """
+    def __init__(self, sonata, triggers: tuple[Trigger, ...] = DEFAULT_TRIGGERS, channels: list[str] = None, pre_seconds: float = 10.0,
+                 directory: str = "events", vehicle: str = None, on_event=None, mil_interval: float = 5.0) -> "TriggeredCapture":
+        """
+        Parameters
+        ----------
+        `sonata` : Sonata or SonataAsync
+            The connected vehicle interface (anything with a `sample(channels)` method).
+        `triggers` : tuple[Trigger, ...], optional
+            The trigger rules, checked in order (default is `DEFAULT_TRIGGERS`).
+        `channels` : list[str], optional
+            Channels sampled in normal mode (default is every logged channel).
+        `pre_seconds` : float, optional
+            Seconds of normal-mode samples saved before the trigger (default is `10.0`).
+        `directory` : str, optional
+            Directory the event records are written to (default is `'events'`).
+        `vehicle` : str, optional
+            Name of the vehicle, written in the event records.
+        `on_event` : Callable[[str, dict], None], optional
+            Called with the path and the metadata of every event record written.
+        `mil_interval` : float, optional
+            Seconds between two reads of the MIL status, in normal mode (default is `5.0`).
+        """
+        self._sonata = sonata
+        self._triggers = tuple(triggers)
+        self._channels = list(channels) if channels is not None else [entry.name for entry in CHANNELS]
+        self._pre_seconds = pre_seconds
+        self._directory = directory
+        self._vehicle = vehicle
+        self._on_event = on_event
+        self._mil_interval = mil_interval
+        self._mil = None
+        self._mil_read = None
+
+        self._buffer = deque()
+        self._previous = None
+        self._active = None
+        self._fired_at = None
+        self._captured = []
+        self._last_fired = {}
+        self.events = []
+
+    @property
+    def capturing(self) -> Trigger:
+        """
+        The trigger whose capture is in progress, or `None` in normal mode.
+        """
+        return self._active
+
+
+    def step(self) -> dict:
+        """
+        Takes one sample, in normal or capture mode, and handles triggers and the end of captures.
+
+        Returns
+        -------
+        `dict`
+            The sample taken.
+        """
+        if self._active is not None:
+            sample = self._sonata.sample(list(self._active.channels))
+            self._captured.append(sample)
+            if sample["timestamp"] - self._fired_at >= self._active.duration:
+                self._finish()
+            return sample
+
+        sample = self._sonata.sample(self._channels)
+        self._buffer.append(sample)
+        while self._buffer and sample["timestamp"] - self._buffer[0]["timestamp"] > self._pre_seconds:
+            self._buffer.popleft()
+        checked = dict(sample, mil_on=self._mil_status(sample["timestamp"]))
+        previous, self._previous = self._previous, checked
+        for trigger in self._triggers:
+            last = self._last_fired.get(trigger.name)
+            if last is not None and sample["timestamp"] - last < trigger.cooldown:
+                continue
+            try: fired = trigger.condition(checked, previous)
+            except Exception: fired = False
+            if fired:
+                self._active = trigger
+                self._fired_at = sample["timestamp"]
+                self._captured = []
+                break
+        return sample
+
+    def _mil_status(self, now: float) -> int:
+        """
+        Gets the MIL status, read again once `mil_interval` seconds have passed (`None` until it could be read once;
+        a failed read keeps the last known status).
+        """
+        if self._mil_read is None or now - self._mil_read >= self._mil_interval:
+            self._mil_read = now
+            try: self._mil = int(bool(self._sonata.DTCs.status_since_last_clear().is_MIL_on))
+            except Exception: pass
+        return self._mil
+
+    def _finish(self) -> None:
+        """
+        Writes the event record of the capture that just ended and returns to normal mode.
+        """
+        trigger, fired_at = self._active, self._fired_at
+        self._last_fired[trigger.name] = fired_at
+        self._active = None
+        self._previous = None           # rates across the capture would compare different sampling regimes
+
+        pre = list(self._buffer)
+        samples = pre + self._captured
+        self._buffer.clear()
+        metadata = session_metadata(self._sonata, vehicle=self._vehicle, channels=self._channels, start=samples[0]["timestamp"])
+        metadata["event"] = {
+            "trigger": trigger.name,
+            "fired_at": fired_at,
+            "pre_samples": len(pre),
+            "capture_samples": len(self._captured),
+            "capture_channels": list(trigger.channels),
+            "capture_rate": len(self._captured) / max(self._captured[-1]["timestamp"] - fired_at, 1e-9) if self._captured else 0.0,
+        }
+        os.makedirs(self._directory, exist_ok=True)
+        fired = datetime.fromtimestamp(fired_at)
+        stem = os.path.join(self._directory, f"{fired:%Y-%m-%d_%H-%M-%S}-{fired.microsecond // 1000:03d}_{trigger.name}")
+        path, copy = f"{stem}.txt", 1
+        while os.path.exists(path):
+            path, copy = f"{stem}_{copy}.txt", copy + 1
+        with SessionWriter(path, metadata) as writer:
+            for sample in samples:
+                writer.append(sample)
+        self._captured = []
+        self.events.append(path)
+        if self._on_event is not None:
+            self._on_event(path, metadata)
+
+
+    def run(self, stop=None, interval: float = 1 / 3, on_sample=None) -> None:
+        """
+        Samples until `stop` is set: at `interval` in normal mode, back to back while capturing. A capture still in
+        progress when the loop ends is cut short and its event record written.
+
+        Parameters
+        ----------
+        `stop` : threading.Event, optional
+            Event that ends the loop (default is to run until interrupted).
+        `interval` : float, optional
+            Seconds between normal-mode samples (default is `1/3`, i.e. 3 Hz).
+        `on_sample` : Callable[[dict], None], optional
+            Called with every normal-mode sample (e.g. `SessionWriter.append` for the regular log). Capture samples
+            only go to the event record.
+        """
+        next_sample = time.monotonic()
+        try:
+            while stop is None or not stop.is_set():
+                normal = self._active is None
+                if normal:
+                    delay = next_sample - time.monotonic()
+                    if delay > 0:
+                        if stop is not None:
+                            if stop.wait(delay):
+                                break
+                        else:
+                            time.sleep(delay)
+                    next_sample = max(next_sample + interval, time.monotonic())
+                sample = self.step()
+                if normal and on_sample is not None:
+                    on_sample(sample)
+        finally:
+            if self._active is not None:
+                self._finish()
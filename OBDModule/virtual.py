@@ -0,0 +1,300 @@
+"""
+# virtual.py
+
+Virtual (computed) channels: quantities derived from real channels, declared once as expressions.
+
+A `VirtualChannel` is an arithmetic expression over channel names, e.g. `short_term_fuel_trim_bank1 + long_term_fuel_trim_bank1`.
+`VirtualEngine` parses and compiles every expression once, orders the virtual channels by their dependencies (virtual
+channels may use other virtual channels), and evaluates them either per sample or vectorized over whole log arrays
+(the expressions only use NumPy functions, which accept both). `VirtualSonata` wraps `Sonata` / `SonataAsync` so that
+virtual channels are read like real ones, with `get_<name>()` getters and in `sample()`; every real input a request
+needs is queried once, however many virtual channels use it.
+"""
+
+import ast
+import numpy as np
+from collections import namedtuple
+from graphlib import TopologicalSorter, CycleError
+
+from OBDModule.channels import CHANNELS, Channel
+
+
+
+
+
+VirtualChannel = namedtuple("VirtualChannel", ["name", "expression", "unit"])
+"""
+A computed channel.
+
+- `name`: Name of the channel, used like a real channel name.
+- `expression`: Arithmetic expression over channel names (real or virtual), numbers, tuples of numbers and `FUNCTIONS`.
+- `unit`: Unit of the result.
+"""
+
+
+FUNCTIONS = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "clip": np.clip,
+    "where": np.where,
+    "interp": np.interp,
+}
+"""
+Functions available in expressions (all accept scalars and arrays).
+"""
+
+
+EXTRA_INPUTS = (
+    Channel("long_term_fuel_trim_bank1",    "LONG_FUEL_TRIM_1",         "get_long_term_fuel_trim_Bank1",        {},     "%"),
+    Channel("accelerator_position_d",       "ACCELERATOR_POS_D",        "get_accelerator_position_D",           {},     "%"),
+    Channel("intake_air_temperature",       "INTAKE_TEMP",              "get_intake_air_temperature",           {},     "degC"),
+    Channel("control_module_voltage",       "CONTROL_MODULE_VOLTAGE",   "get_control_module_voltage",           {},     "V"),
+    Channel("commanded_equivalence_ratio",  "COMMANDED_EQUIV_RATIO",    "get_commanded_equivalence_ratio",      {},     "ratio"),
+    Channel("barometric_pressure",          "BAROMETRIC_PRESSURE",      "get_barometric_pressure",              {},     "kPa"),
+)
+"""
+Real inputs that expressions may use besides the logged channels (not written to session logs).
+"""
+
+
+DEFAULT_VIRTUAL_CHANNELS = (
+    VirtualChannel("lambda_ratio", "interp(o2_bank1sensor1_wr_lambda_current, (-1.82, -1.08, -0.47, 0.0, 0.34, 0.61, 1.01), (0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.4))", "ratio"),
+    VirtualChannel("air_fuel_ratio", "lambda_ratio * 14.7", "ratio"),
+    VirtualChannel("total_fuel_trim_bank1", "short_term_fuel_trim_bank1 + long_term_fuel_trim_bank1", "%"),
+    VirtualChannel("pedal_throttle_difference", "accelerator_position_d - relative_throttle_pos", "%"),
+    VirtualChannel("power_estimate", "calculated_engine_load / 100 * 250 * rpm * 0.10471975511965977 / 1000", "kW"),
+)
+"""
+Virtual channels provided by default:
+- `lambda_ratio`: Air-fuel equivalence ratio (lambda), from the wide-range O2 sensor current, with the pumping-current curve of a Bosch LSU 4.9 sensor.
+- `air_fuel_ratio`: Gasoline air-fuel ratio from `lambda_ratio`.
+- `total_fuel_trim_bank1`: Short-term plus long-term fuel trim.
+- `pedal_throttle_difference`: Accelerator pedal position minus relative throttle position.
+- `power_estimate`: Rough engine power, from the calculated load and a 250 Nm peak torque.
+"""
+
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.Compare,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv, ast.USub, ast.UAdd,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+)
+
+
+
+
+def compile_expression(expression: str) -> tuple:
+    """
+    Parses and compiles an expression, allowing only arithmetic, comparisons, constants and `FUNCTIONS`.
+
+    Parameters
+    ----------
+    `expression` : str
+        The expression.
+
+    Returns
+    -------
+    `tuple[code, frozenset[str]]`
+        The compiled expression and the channel names it reads.
+    """
+    tree = ast.parse(expression, mode="eval")
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax in expression '{expression}': {type(node).__name__}")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+            raise ValueError(f"Unknown function in expression '{expression}'")
+        if isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+            names.add(node.id)
+    return compile(tree, f"<virtual: {expression}>", "eval"), frozenset(names)
+
+
+
+
+class VirtualEngine:
+    """
+    Compiled set of virtual channels, with their dependency graph.
+    """
+    def __init__(self, channels: tuple[VirtualChannel, ...] = DEFAULT_VIRTUAL_CHANNELS, inputs: tuple[Channel, ...] = EXTRA_INPUTS) -> "VirtualEngine":
+        """
+        Parameters
+        ----------
+        `channels` : tuple[VirtualChannel, ...], optional
+            The virtual channels (default is `DEFAULT_VIRTUAL_CHANNELS`).
+        `inputs` : tuple[Channel, ...], optional
+            Real inputs available besides the logged channels (default is `EXTRA_INPUTS`).
+        """
+        self._virtual = {entry.name: entry for entry in channels}
+        self._real = {entry.name: entry for entry in CHANNELS + tuple(inputs)}
+        self._compiled = {}
+        self._depends = {}
+        for entry in channels:
+            if entry.name in self._real:
+                raise ValueError(f"Virtual channel '{entry.name}' shadows a real channel")
+            code, names = compile_expression(entry.expression)
+            unknown = names - self._virtual.keys() - self._real.keys()
+            if unknown:
+                raise ValueError(f"Virtual channel '{entry.name}' uses unknown channel(s) {sorted(unknown)}")
+            self._compiled[entry.name] = code
+            self._depends[entry.name] = names
+        try:
+            self._order = tuple(TopologicalSorter({name: self._depends[name] & self._virtual.keys() for name in self._virtual}).static_order())
+        except CycleError as error:
+            raise ValueError(f"Virtual channels depend on each other in a cycle: {error.args[1]}") from None
+
+    @property
+    def names(self) -> tuple[str, ...]:
+        """
+        Names of the virtual channels, in evaluation order.
+        """
+        return self._order
+
+    def unit(self, name: str) -> str:
+        """
+        Unit of a virtual or real channel.
+        """
+        return self._virtual[name].unit if name in self._virtual else self._real[name].unit
+
+    def real_input(self, name: str) -> Channel:
+        """
+        Gets the definition (getter, unit, ...) of a real channel that expressions can use.
+        """
+        return self._real[name]
+
+    def is_virtual(self, name: str) -> bool:
+        return name in self._virtual
+
+
+    def plan(self, names: list[str]) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """
+        Resolves which real inputs must be read, and which virtual channels evaluated, to produce `names`.
+
+        Returns
+        -------
+        `tuple[tuple[str, ...], tuple[str, ...]]`
+            The real channels (each once, in request order) and the virtual channels (in evaluation order).
+        """
+        real, virtual, pending = [], set(), list(names)
+        while pending:
+            name = pending.pop(0)
+            if name in self._virtual:
+                if name not in virtual:
+                    virtual.add(name)
+                    pending.extend(sorted(self._depends[name]))
+            elif name in self._real:
+                if name not in real:
+                    real.append(name)
+            else:
+                raise KeyError(f"Unknown channel '{name}'")
+        return tuple(real), tuple(name for name in self._order if name in virtual)
+
+    def evaluate(self, values: dict, names: tuple[str, ...] = None) -> dict:
+        """
+        Evaluates virtual channels on one sample, or on whole columns (vectorized).
+
+        Parameters
+        ----------
+        `values` : dict
+            A sample (as returned by `Sonata.sample()`) or log columns (as returned by `Logs.reader.read_arrays`).
+            Missing inputs count as `nan`.
+        `names` : tuple[str, ...], optional
+            The virtual channels to evaluate, in evaluation order (default is all of them, see `plan`).
+
+        Returns
+        -------
+        `dict`
+            A copy of `values` with the virtual channels added.
+        """
+        result = dict(values)
+        namespace = dict(FUNCTIONS)
+        for name in (self._order if names is None else names):
+            for dependency in self._depends[name]:
+                if dependency not in namespace:
+                    namespace[dependency] = result.get(dependency, np.nan)
+            with np.errstate(all="ignore"):
+                value = eval(self._compiled[name], {"__builtins__": {}}, namespace)
+            value = float(value) if np.ndim(value) == 0 else np.asarray(value, dtype=np.float64)
+            result[name] = namespace[name] = value
+        return result
+
+    def evaluate_arrays(self, columns: dict) -> dict[str, np.ndarray]:
+        """
+        Evaluates every virtual channel over log columns. Same as `evaluate`, with array results.
+        """
+        length = len(next(iter(columns.values()))) if columns else 0
+        result = self.evaluate(columns)
+        for name in self._order:
+            if np.ndim(result[name]) == 0:
+                result[name] = np.full(length, result[name])
+        return result
+
+
+
+
+class VirtualSonata:
+    """
+    `Sonata` / `SonataAsync` with virtual channels added, readable like real ones.
+
+    `sample()` accepts real and virtual channel names, and every `get_<virtual name>()` getter exists
+    (e.g. `get_lambda_ratio()`). Everything else is forwarded to the wrapped object.
+    """
+    def __init__(self, sonata, engine: VirtualEngine = None) -> "VirtualSonata":
+        """
+        Parameters
+        ----------
+        `sonata` : Sonata or SonataAsync
+            The connected vehicle interface.
+        `engine` : VirtualEngine, optional
+            The virtual channels (default is a `VirtualEngine` of `DEFAULT_VIRTUAL_CHANNELS`).
+        """
+        self._sonata = sonata
+        self._engine = engine if engine is not None else VirtualEngine()
+        self._plans = {}
+
+    def __getattr__(self, attribute: str):
+        if attribute.startswith("get_") and self._engine.is_virtual(attribute[len("get_"):]):
+            name = attribute[len("get_"):]
+            return lambda: self.sample([name])[name]
+        return getattr(self._sonata, attribute)
+
+    @property
+    def engine(self) -> VirtualEngine:
+        """
+        The virtual channels.
+        """
+        return self._engine
+
+
+    def sample(self, channels: list[str] = None) -> dict:
+        """
+        Reads real and virtual channels as a single sample, querying each real input once.
+
+        Parameters
+        ----------
+        `channels` : list[str], optional
+            Names of the channels to read, real or virtual (default is every logged channel and every virtual channel).
+
+        Returns
+        -------
+        `dict`
+            The sample, with `timestamp` followed by the value of each requested channel (and of the real inputs
+            that were read to compute them). Channels that could not be read are `nan`.
+        """
+        key = tuple(channels) if channels is not None else None
+        if key not in self._plans:
+            names = list(channels) if channels is not None else [entry.name for entry in CHANNELS] + list(self._engine.names)
+            self._plans[key] = self._engine.plan(names)
+        real, virtual = self._plans[key]
+
+        logged = {entry.name for entry in CHANNELS}
+        sample = self._sonata.sample([name for name in real if name in logged])
+        for name in real:
+            if name not in logged:
+                entry = self._engine.real_input(name)
+                try: sample[name] = float(getattr(self._sonata, entry.getter)(**entry.kwargs))
+                except Exception: sample[name] = float("nan")
+        return self._engine.evaluate(sample, virtual)